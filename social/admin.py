@@ -3,8 +3,9 @@ from .models import Profile, Post, Comment, Message
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
-    list_display = ('user', 'bio', 'created_at', 'updated_at')
+    list_display = ('user', 'bio', 'followers_count', 'following_count', 'created_at', 'updated_at')
     search_fields = ('user__username', 'bio')
+    readonly_fields = ('followers_count', 'following_count')
     list_filter = ('created_at', 'updated_at')
 
 @admin.register(Post)
@@ -12,24 +13,14 @@ class PostAdmin(admin.ModelAdmin):
     list_display = ('author', 'content', 'created_at', 'updated_at', 'likes_count', 'reposts_count')
     search_fields = ('author__username', 'content')
     list_filter = ('created_at', 'updated_at')
-    
-    def likes_count(self, obj):
-        return obj.likes.count()
-    likes_count.short_description = 'Likes'
-    
-    def reposts_count(self, obj):
-        return obj.reposts.count()
-    reposts_count.short_description = 'Reposts'
+    readonly_fields = ('likes_count', 'reposts_count', 'comments_count')
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('author', 'post', 'content', 'created_at', 'updated_at', 'likes_count')
     search_fields = ('author__username', 'content', 'post__content')
     list_filter = ('created_at', 'updated_at')
-    
-    def likes_count(self, obj):
-        return obj.likes.count()
-    likes_count.short_description = 'Likes'
+    readonly_fields = ('likes_count',)
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
@@ -0,0 +1,257 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import router
+from django.db.models import F, Model
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Profile
+
+# Access tokens carry the claims most requests need about their user, so the
+# user row is only loaded when a view touches anything else. Tokens are
+# revoked by bumping the user's token version: tokens of an older version are
+# refused through a small in-memory map of the users who revoked recently,
+# reloaded from the database every AUTH_DENYLIST_REFRESH seconds.
+
+USERNAME_CLAIM = 'username'
+ACTIVE_CLAIM = 'active'
+VERSION_CLAIM = 'ver'
+
+DEFAULT_TOKEN_CACHE_SIZE = 10000
+DEFAULT_TOKEN_CACHE_SECONDS = 30
+DEFAULT_DENYLIST_REFRESH = 5
+
+
+def current_version(user_id):
+    using = router.db_for_write(Profile)
+    return Profile.objects.using(using).filter(user_id=user_id).values_list(
+        'token_version', flat=True
+    ).first() or 0
+
+
+def add_claims(token, user):
+    token[USERNAME_CLAIM] = user.username
+    token[ACTIVE_CLAIM] = user.is_active
+    token[VERSION_CLAIM] = current_version(user.pk)
+    return token
+
+
+def tokens_for(user):
+    """
+    Refresh token (and through ``.access_token`` an access token) with the
+    user's claims
+    """
+    return add_claims(RefreshToken.for_user(user), user)
+
+
+def token_lifetime():
+    return max(jwt_settings.ACCESS_TOKEN_LIFETIME, jwt_settings.REFRESH_TOKEN_LIFETIME)
+
+
+class Denylist:
+    """
+    Lowest accepted token version of every user who revoked their tokens
+    within the lifetime of a token; older revocations can only concern
+    tokens that have expired anyway.
+    """
+    def __init__(self):
+        self.versions = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def stale(self):
+        interval = getattr(settings, 'AUTH_DENYLIST_REFRESH', DEFAULT_DENYLIST_REFRESH)
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= interval
+
+    def min_version(self, user_id):
+        if self.stale():
+            with self.lock:
+                if self.stale():
+                    self.reload()
+        return self.versions.get(user_id, 0)
+
+    def reload(self):
+        # From the primary: a lagging replica could miss a revocation
+        since = timezone.now() - token_lifetime()
+        self.versions = dict(
+            Profile.objects.using(router.db_for_write(Profile)).filter(
+                tokens_revoked_at__gte=since
+            ).values_list('user_id', 'token_version')
+        )
+        self.loaded_at = time.monotonic()
+
+    def add(self, user_id, version):
+        with self.lock:
+            self.versions[user_id] = max(version, self.versions.get(user_id, 0))
+
+    def clear(self):
+        with self.lock:
+            self.versions = {}
+            self.loaded_at = None
+
+
+denylist = Denylist()
+
+
+def revoke_tokens(user_id):
+    """
+    Invalidate every token issued to the user so far. Other processes
+    notice within AUTH_DENYLIST_REFRESH seconds.
+    """
+    Profile.objects.filter(user_id=user_id).update(
+        token_version=F('token_version') + 1, tokens_revoked_at=timezone.now()
+    )
+    version = current_version(user_id)
+    denylist.add(user_id, version)
+    return version
+
+
+def check_not_revoked(token):
+    user_id = token[jwt_settings.USER_ID_CLAIM]
+    if token.get(VERSION_CLAIM, 0) < denylist.min_version(user_id):
+        raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+
+
+class TokenCache:
+    """
+    Recently validated tokens by their encoded form, so a client sending the
+    same token again skips the signature check and claim validation
+    """
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, raw_token):
+        with self.lock:
+            entry = self.entries.get(raw_token)
+            if entry is None:
+                return None
+            token, expires = entry
+            if expires <= time.time():
+                del self.entries[raw_token]
+                return None
+            self.entries.move_to_end(raw_token)
+            return token
+
+    def put(self, raw_token, token):
+        size = getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', DEFAULT_TOKEN_CACHE_SIZE)
+        seconds = getattr(settings, 'AUTH_TOKEN_CACHE_SECONDS', DEFAULT_TOKEN_CACHE_SECONDS)
+        if not size or not seconds:
+            return
+        # Never past the token's own expiry
+        expires = min(time.time() + seconds, token.get('exp', 0))
+        with self.lock:
+            self.entries[raw_token] = (token, expires)
+            self.entries.move_to_end(raw_token)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def load_user(user_id):
+    try:
+        return User.objects.get(pk=user_id)
+    except User.DoesNotExist:
+        raise AuthenticationFailed('User not found', code='user_not_found')
+
+
+class ClaimsUser(SimpleLazyObject):
+    """
+    ``request.user`` built from token claims. id, username and the
+    authentication flags are answered from the token; anything else (and
+    comparisons with model instances) loads the user row on first use.
+    """
+    def __init__(self, claims):
+        user_id = claims[jwt_settings.USER_ID_CLAIM]
+        super().__init__(lambda: load_user(user_id))
+        self.__dict__['_claims'] = claims
+
+    @property
+    def id(self):
+        return self._claims[jwt_settings.USER_ID_CLAIM]
+
+    pk = id
+
+    @property
+    def username(self):
+        return self._claims[USERNAME_CLAIM]
+
+    @property
+    def is_active(self):
+        return self._claims[ACTIVE_CLAIM]
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __bool__(self):
+        return True
+
+    def __eq__(self, other):
+        if isinstance(other, ClaimsUser):
+            return self.id == other.id
+        if isinstance(other, Model) and other._meta.concrete_model is User:
+            return self.id == other.pk
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without the per-request user query. Tokens issued
+    before the claims were added fall back to loading the user.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = token_cache.get(raw_token)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            token_cache.put(raw_token, token)
+        return token
+
+    def get_user(self, validated_token):
+        check_not_revoked(validated_token)
+        if USERNAME_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        if not validated_token.get(ACTIVE_CLAIM, True):
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return ClaimsUser(validated_token.payload)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refreshing reads the username and active flag from the user row again
+    rather than copying the old token's, so a rename or deactivation reaches
+    the next access token instead of lasting as long as the refresh token
+    """
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        check_not_revoked(refresh)
+        row = User.objects.filter(pk=refresh[jwt_settings.USER_ID_CLAIM]).values_list(
+            'username', 'is_active'
+        ).first()
+        if row is None or not row[1]:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        refresh[USERNAME_CLAIM], refresh[ACTIVE_CLAIM] = row
+        # Same jti and expiry, only the claims differ
+        return super().validate({**attrs, 'refresh': str(refresh)})
@@ -0,0 +1,369 @@
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import authentication, cache, compression, conversations, counters, search, timeline, trending
+from .models import Comment, Conversation, Follow, Message, Post, Profile
+
+# Traffic is described the way the backlog is, one JSON object per line:
+#
+#     {"name": "feed_scroll", "weight": 30,
+#      "steps": [{"method": "GET", "path": "/api/posts/feed/", "pages": 3}]}
+#
+# A scenario without "steps" is a single request given by its own "method",
+# "path" and "body". Paths and bodies can use placeholders filled from the
+# seeded data for every run: {me} (the signed-in user), {user}, {profile},
+# {post}, {hot_post}, {partner} (someone the user has a conversation with),
+# {topic} (a word seeded posts are about) and {post_ids} (a comma-separated
+# screen of posts). "pages" follows the paginated response's "next" link.
+#
+# Clients send ACCEPT_ENCODING like a browser would, and each request records
+# the bytes on the wire next to the decoded body size.
+
+PASSWORD = 'bench-pass-1'
+HOT_POSTS = 20
+SCREEN_SIZE = 20
+TOPICS = 50
+ACCEPT_ENCODING = 'br, gzip'
+
+SCENARIOS = [
+    {'name': 'feed_scroll', 'weight': 30, 'steps': [
+        {'method': 'GET', 'path': '/api/posts/feed/', 'pages': 3},
+        {'method': 'GET', 'path': '/api/posts/state/?ids={post_ids}'},
+    ]},
+    {'name': 'explore', 'weight': 15, 'steps': [
+        {'method': 'GET', 'path': '/api/posts/explore/', 'pages': 2},
+    ]},
+    {'name': 'conversations', 'weight': 15, 'steps': [
+        {'method': 'GET', 'path': '/api/messages/unread_count/'},
+        {'method': 'GET', 'path': '/api/messages/conversations/'},
+        {'method': 'GET', 'path': '/api/messages/with/{partner}/'},
+        {'method': 'POST', 'path': '/api/messages/', 'body': {'sender': '{me}', 'receiver': '{partner}', 'content': 'ping'}},
+    ]},
+    {'name': 'like_storm', 'weight': 15, 'steps': [
+        {'method': 'PUT', 'path': '/api/posts/{hot_post}/like/'},
+        {'method': 'PUT', 'path': '/api/posts/{hot_post}/like/'},
+        {'method': 'DELETE', 'path': '/api/posts/{hot_post}/like/'},
+    ]},
+    {'name': 'profile_view', 'weight': 20, 'steps': [
+        {'method': 'GET', 'path': '/api/profiles/{profile}/'},
+        {'method': 'GET', 'path': '/api/users/{user}/posts/'},
+    ]},
+    {'name': 'post_detail', 'weight': 5, 'method': 'GET', 'path': '/api/posts/{post}/'},
+    {'name': 'search', 'weight': 5, 'method': 'GET', 'path': '/api/search/?q=topic{topic}&type=posts'},
+]
+
+
+def load_scenarios(path):
+    with open(path) as lines:
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+def steps_of(scenario):
+    if 'steps' in scenario:
+        return scenario['steps']
+    return [{key: scenario[key] for key in ('method', 'path', 'body', 'pages') if key in scenario}]
+
+
+# Seeding
+
+def seed(users=200, follows=20, posts=5, comments=2, likes=5, messages=5, rng=None, tag='bench'):
+    """
+    Bulk-insert a synthetic social graph and rebuild everything the signals
+    would have maintained. Follows go preferentially to a few popular users
+    (Zipf-like), like real follower counts. Returns the new users.
+    """
+    rng = rng or random.Random(0)
+    password = make_password(PASSWORD)
+    prefix = f'{tag}{int(time.time())}_'
+    User.objects.bulk_create(
+        [User(username=f'{prefix}{i}', password=password, email=f'{prefix}{i}@example.com') for i in range(users)],
+        batch_size=500,
+    )
+    people = list(User.objects.filter(username__startswith=prefix).order_by('id'))
+    Profile.objects.bulk_create([Profile(user=user, bio=f'bio of {user.username}') for user in people], batch_size=500)
+    ids = [user.id for user in people]
+
+    popularity = [1 / (rank + 1) ** 1.1 for rank in range(len(ids))]
+    links = set()
+    for follower in ids:
+        for followed in rng.choices(ids, weights=popularity, k=min(follows, len(ids) - 1)):
+            if followed != follower:
+                links.add((follower, followed))
+    Follow.objects.bulk_create(
+        [Follow(follower_id=a, following_id=b) for a, b in links], batch_size=500, ignore_conflicts=True
+    )
+
+    now = timezone.now()
+    Post.objects.bulk_create([
+        Post(author_id=author, content=f'post {i} by {author} about topic{rng.randrange(TOPICS)}')
+        for author in ids for i in range(posts)
+    ], batch_size=500)
+    post_ids = list(Post.objects.filter(author_id__in=ids).values_list('id', flat=True))
+    # created_at is auto_now_add; spread the posts over the last three days
+    spread = [Post(id=post_id, created_at=now - timedelta(seconds=rng.randrange(72 * 3600))) for post_id in post_ids]
+    Post.objects.bulk_update(spread, ['created_at'], batch_size=500)
+
+    Comment.objects.bulk_create([
+        Comment(post_id=post_id, author_id=rng.choice(ids), content=f'comment {i}')
+        for post_id in post_ids for i in range(comments)
+    ], batch_size=500)
+    Post.likes.through.objects.bulk_create([
+        Post.likes.through(post_id=post_id, user_id=user_id)
+        for post_id in post_ids for user_id in set(rng.sample(ids, min(likes, len(ids))))
+    ], batch_size=500, ignore_conflicts=True)
+    following = defaultdict(list)
+    for follower, followed in links:
+        following[follower].append(followed)
+    Message.objects.bulk_create([
+        Message(sender_id=sender, receiver_id=rng.choice(following[sender] or ids), content=f'message {i}')
+        for sender in ids for i in range(messages)
+    ], batch_size=500)
+
+    for model, counter, expression in counters.counter_sources():
+        counters.reconcile(model, counter, expression)
+    for user in people:
+        timeline.rebuild(user)
+    conversations.rebuild()
+    search.rebuild()
+    trending.rebuild()
+    cache.invalidate_all()
+    return people
+
+
+# Traffic
+
+class Context:
+    """
+    Ids the placeholders are filled from
+    """
+    def __init__(self, users):
+        self.people = {user.id: user for user in users}
+        self.users = list(self.people)
+        self.profiles = dict(Profile.objects.filter(user_id__in=self.users).values_list('user_id', 'id'))
+        self.posts = list(Post.objects.values_list('id', flat=True).order_by('-id')[:10000])
+        self.hot_posts = list(Post.objects.order_by('-likes_count').values_list('id', flat=True)[:HOT_POSTS])
+        self.partners = defaultdict(list)
+        for owner, other in Conversation.objects.filter(owner_id__in=self.users).values_list('owner_id', 'other_id'):
+            self.partners[owner].append(other)
+
+    def values(self, me, rng):
+        user = rng.choice(self.users)
+        return {
+            'me': me,
+            'user': user,
+            'profile': self.profiles.get(user, user),
+            'post': rng.choice(self.posts),
+            'topic': rng.randrange(TOPICS),
+            'hot_post': rng.choice(self.hot_posts or self.posts),
+            'partner': rng.choice(self.partners.get(me) or [u for u in self.users if u != me] or [me]),
+            'post_ids': ','.join(str(post_id) for post_id in rng.sample(self.posts, min(SCREEN_SIZE, len(self.posts)))),
+        }
+
+
+def fill(template, values):
+    if isinstance(template, str):
+        return template.format(**values)
+    if isinstance(template, dict):
+        return {key: fill(value, values) for key, value in template.items()}
+    return template
+
+
+class InProcessClient:
+    """
+    Requests through the Django test client, counting the queries of each
+    """
+    measures_queries = True
+
+    def __init__(self, token, encoding=ACCEPT_ENCODING):
+        self.client = APIClient()
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        if encoding:
+            headers['HTTP_ACCEPT_ENCODING'] = encoding
+        self.client.credentials(**headers)
+
+    def request(self, method, path, body=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method.lower())(path, body, format='json' if body else None)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        data, raw = decode(content, response.get('Content-Encoding'))
+        return response.status_code, data, len(queries.captured_queries), len(content), raw
+
+
+class HttpClient:
+    """
+    Requests against a running server
+    """
+    measures_queries = False
+
+    def __init__(self, token, base_url, encoding=ACCEPT_ENCODING):
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.encoding = encoding
+
+    def request(self, method, path, body=None):
+        headers = {'Authorization': f'Bearer {self.token}', 'Content-Type': 'application/json'}
+        if self.encoding:
+            headers['Accept-Encoding'] = self.encoding
+        request = urllib.request.Request(
+            self.base_url + path, method=method, data=json.dumps(body).encode() if body else None, headers=headers,
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                status, content, coding = response.status, response.read(), response.headers.get('Content-Encoding')
+        except urllib.error.HTTPError as error:
+            status, content, coding = error.code, error.read(), error.headers.get('Content-Encoding')
+        data, raw = decode(content, coding)
+        return status, data, None, len(content), raw
+
+
+def decode(content, coding):
+    """
+    ``(data, raw size)`` of a response body sent with ``coding``
+    """
+    raw = compression.decompress(content, coding) if coding else content
+    try:
+        data = json.loads(raw) if raw else None
+    except ValueError:
+        data = None
+    return data, len(raw)
+
+
+def local_path(url):
+    parts = urlsplit(url)
+    return parts.path + (f'?{parts.query}' if parts.query else '')
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, seconds, status, queries, wire=0, raw=0):
+        with self.lock:
+            self.samples[endpoint].append((seconds, status, queries, wire, raw))
+
+
+def run_scenario(client, scenario, values, recorder):
+    for step in steps_of(scenario):
+        method = step.get('method', 'GET').upper()
+        endpoint = f'{method} {step["path"].split("?")[0]}'
+        path = fill(step['path'], values)
+        body = fill(step.get('body'), values)
+        for _ in range(step.get('pages', 1)):
+            started = time.perf_counter()
+            status, data, queries, wire, raw = client.request(method, path, body)
+            recorder.add(endpoint, time.perf_counter() - started, status, queries, wire, raw)
+            following = data.get('next') if isinstance(data, dict) else None
+            if not following:
+                break
+            path = local_path(following)
+
+
+def replay(scenarios, context, make_client, iterations=500, threads=1, rng_seed=0):
+    """
+    Run ``iterations`` weighted scenarios spread over ``threads`` clients.
+    Returns the recorder and the wall-clock seconds.
+    """
+    recorder = Recorder()
+    tokens = {}
+    remaining = [iterations]
+    lock = threading.Lock()
+
+    def token_for(user_id):
+        with lock:
+            if user_id not in tokens:
+                tokens[user_id] = str(authentication.tokens_for(context.people[user_id]).access_token)
+            return tokens[user_id]
+
+    def worker(seed):
+        rng = random.Random(seed)
+        clients = {}
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            me = rng.choice(context.users)
+            if me not in clients:
+                clients[me] = make_client(token_for(me))
+            scenario = rng.choices(scenarios, weights=[s.get('weight', 1) for s in scenarios])[0]
+            run_scenario(clients[me], scenario, context.values(me, rng), recorder)
+
+    failures = []
+
+    def guarded(seed):
+        try:
+            worker(seed)
+        except Exception as error:
+            failures.append(error)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    if threads <= 1:
+        # In the calling thread, so a test's transaction sees the seeded data
+        worker(rng_seed)
+    else:
+        workers = [threading.Thread(target=guarded, args=(rng_seed + i,)) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        if failures:
+            raise failures[0]
+    return recorder, time.perf_counter() - started
+
+
+# Results
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples, wall):
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    queries = [sample[2] for sample in samples if sample[2] is not None]
+    statuses = Counter(str(sample[1]) for sample in samples)
+    wire = sum(sample[3] for sample in samples)
+    raw = sum(sample[4] for sample in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample[1] >= 400),
+        'statuses': dict(sorted(statuses.items())),
+        'rps': round(len(samples) / wall, 2) if wall else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.50), 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99), 3) if latencies else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'bytes_per_request': round(raw / len(samples)) if samples else None,
+        'wire_bytes_per_request': round(wire / len(samples)) if samples else None,
+        # Share of the body size not sent thanks to compression
+        'bytes_saved': round(1 - wire / raw, 3) if raw else None,
+    }
+
+
+def report(recorder, wall):
+    everything = [sample for samples in recorder.samples.values() for sample in samples]
+    return {
+        'wall_seconds': round(wall, 3),
+        'total': summarize(everything, wall),
+        'endpoints': {endpoint: summarize(samples, wall) for endpoint, samples in sorted(recorder.samples.items())},
+    }
@@ -0,0 +1,166 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Serialized post and profile fragments are cached under keys that embed the
+# version of every object they were rendered from. Writes never delete
+# fragments: the signal handlers bump the versions instead, so the next read
+# misses and renders afresh while stale entries age out of the store.
+#
+# Version tokens are nanosecond timestamps rather than counters, so a version
+# key that was evicted from an LRU store comes back as a value that has never
+# been used before and can't resurrect an old fragment.
+
+DEFAULT_TIMEOUT = 300
+GENERATION_KEY = 'fragments:generation'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def store():
+    """
+    The cache backend holding fragments. Process-local (locmem) by default;
+    point FRAGMENT_CACHE_ALIAS at a shared backend when running several workers.
+    """
+    return caches[getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'default')]
+
+
+def timeout():
+    return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def _count(kind, event, amount=1):
+    if amount:
+        with _stats_lock:
+            _stats[(kind, event)] += amount
+
+
+def stats():
+    """
+    Hit/miss/invalidation counters of this process, per fragment kind
+    """
+    with _stats_lock:
+        snapshot = dict(_stats)
+    result = {}
+    for (kind, event), value in sorted(snapshot.items()):
+        result.setdefault(kind, {'hits': 0, 'misses': 0, 'invalidations': 0})[event] = value
+    for counts in result.values():
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = round(counts['hits'] / lookups, 4) if lookups else None
+    return result
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _version_key(kind, object_id):
+    return f'v:{kind}:{object_id}'
+
+
+def _new_token():
+    return time.time_ns()
+
+
+def _versions(keys):
+    """
+    Current token of every version key, creating the missing ones
+    """
+    backend = store()
+    found = backend.get_many(keys)
+    for key in keys:
+        if key not in found:
+            token = _new_token()
+            # Another process may have created it meanwhile; theirs wins
+            if not backend.add(key, token, None):
+                token = backend.get(key, token)
+            found[key] = token
+    return found
+
+
+def _bump(keys):
+    token = _new_token()
+    store().set_many({key: token for key in keys}, None)
+
+
+def invalidate(kind, object_ids):
+    """
+    Make every fragment rendered from these objects unreachable. The bump is
+    repeated after the surrounding transaction commits, so a concurrent read
+    of the old rows can't cache them under the new version.
+    """
+    keys = [_version_key(kind, object_id) for object_id in set(object_ids) if object_id is not None]
+    if not keys:
+        return
+    _count(kind, 'invalidations', len(keys))
+    _bump(keys)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(keys))
+
+
+def invalidate_all():
+    """
+    Drop every cached fragment, e.g. after bulk fixes that bypass the signals
+    """
+    _bump([GENERATION_KEY])
+
+
+def render_many(kind, instances, render, variant='', depends=None, key=None):
+    """
+    Serialized data for ``instances``, served from the cache where possible.
+
+    ``render(missing)`` serializes the instances that missed and returns their
+    data in the same order. ``key(instance)`` is the id the fragment is
+    invalidated by (the primary key by default) and ``depends(instance)`` lists
+    extra ``(kind, id)`` pairs the fragment was rendered from.
+    """
+    if not instances:
+        return []
+    ids = [key(instance) if key else instance.pk for instance in instances]
+    sources = []
+    for instance, object_id in zip(instances, ids):
+        pairs = [(kind, object_id)] + list(depends(instance) if depends else [])
+        sources.append([_version_key(k, i) for k, i in pairs])
+
+    versions = _versions(sorted({GENERATION_KEY}.union(*sources)))
+    generation = versions[GENERATION_KEY]
+    variant = hashlib.md5(variant.encode()).hexdigest()[:12] if variant else ''
+    keys = [
+        ':'.join([f'f:{kind}:{object_id}', variant, str(generation)] + [str(versions[k]) for k in source])
+        for object_id, source in zip(ids, sources)
+    ]
+
+    backend = store()
+    cached = backend.get_many(keys)
+    missing = [i for i, fragment_key in enumerate(keys) if fragment_key not in cached]
+    _count(kind, 'hits', len(keys) - len(missing))
+    _count(kind, 'misses', len(missing))
+
+    if missing:
+        rendered = render([instances[i] for i in missing])
+        fresh = {keys[i]: data for i, data in zip(missing, rendered)}
+        backend.set_many(fresh, timeout())
+        cached.update(fresh)
+    return [dict(cached[fragment_key]) for fragment_key in keys]
+
+
+def render_one(kind, instance, render, variant='', depends=None, key=None):
+    return render_many(kind, [instance], lambda missing: [render(missing[0])], variant, depends, key)[0]
+
+
+def request_variant(context):
+    """
+    File fields render as absolute URLs when a request is available, so
+    fragments are kept apart per scheme and host
+    """
+    request = context.get('request')
+    if request is None:
+        return ''
+    return request.build_absolute_uri('/')
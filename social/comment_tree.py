@@ -0,0 +1,170 @@
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Comment
+from .pagination import OldestFirstKeysetPagination
+from .queries import comment_list_queryset
+
+# Number of comment levels rendered below a post (1 = top-level comments only)
+DEFAULT_MAX_DEPTH = 3
+# Number of comments rendered per parent at every level
+DEFAULT_MAX_WIDTH = 10
+# Top-level comments embedded in each post of the feed and explore pages
+DEFAULT_FEED_PREVIEW = 2
+
+
+def max_depth():
+    return getattr(settings, 'COMMENT_TREE_MAX_DEPTH', DEFAULT_MAX_DEPTH)
+
+
+def max_width():
+    return getattr(settings, 'COMMENT_TREE_MAX_WIDTH', DEFAULT_MAX_WIDTH)
+
+
+def feed_preview():
+    return getattr(settings, 'FEED_COMMENT_PREVIEW', DEFAULT_FEED_PREVIEW)
+
+
+def limits(context):
+    """
+    ``(depth, width)`` for a serializer context, defaulting to the settings
+    """
+    return context.get('comment_depth', max_depth()), context.get('comment_width', max_width())
+
+
+def _first_per_group(queryset, group_by, width):
+    """
+    The first ``width`` comments, oldest first, of every ``group_by`` value
+    """
+    return comment_list_queryset(queryset).annotate(sibling_rank=Window(
+        RowNumber(),
+        partition_by=[F(group_by)],
+        order_by=[F('created_at').asc(), F('id').asc()],
+    )).filter(sibling_rank__lte=width).order_by('created_at', 'id')
+
+
+def attach_replies(comments, depth, width):
+    """
+    Load up to ``depth`` levels of replies below ``comments`` into
+    ``comment.tree_replies``, at most ``width`` per parent.
+
+    Runs one query per level no matter how many comments are passed in.
+    Comments that already have a tree attached are left alone.
+    """
+    level = [comment for comment in comments if not hasattr(comment, 'tree_replies')]
+    for comment in level:
+        comment.tree_replies = []
+
+    while level and depth > 0 and width > 0:
+        parents = {comment.id: comment for comment in level if comment.replies_count}
+        if not parents:
+            return
+        level = list(_first_per_group(Comment.objects.filter(parent_id__in=parents), 'parent_id', width))
+        for reply in level:
+            reply.tree_replies = []
+            parents[reply.parent_id].tree_replies.append(reply)
+        depth -= 1
+
+
+# The bounded trees of a page of posts in one query. ``ranked`` numbers
+# every comment of the posts among its siblings, oldest first; ``tree``
+# walks down from the first ``width`` top-level comments, following only
+# replies ranked within ``width`` and stopping at ``depth`` levels.
+POST_TREE_SQL = """
+{keyword} ranked AS (
+    SELECT id, parent_id, post_id,
+           ROW_NUMBER() OVER (PARTITION BY post_id, parent_id ORDER BY created_at, id) AS sibling_rank,
+           COUNT(*) OVER (PARTITION BY post_id, parent_id) AS sibling_count
+    FROM {table}
+    WHERE post_id IN ({posts})
+),
+tree AS (
+    SELECT id, sibling_count, 1 AS tree_depth
+    FROM ranked
+    WHERE parent_id IS NULL AND sibling_rank <= %s
+    UNION ALL
+    SELECT ranked.id, ranked.sibling_count, tree.tree_depth + 1
+    FROM ranked JOIN tree ON ranked.parent_id = tree.id
+    WHERE ranked.sibling_rank <= %s AND tree.tree_depth < %s
+)
+SELECT {table}.*, tree.sibling_count
+FROM {table} JOIN tree ON {table}.id = tree.id
+ORDER BY {table}.created_at, {table}.id
+"""
+
+
+def _post_tree(post_ids, depth, width):
+    connection = connections[router.db_for_read(Comment)]
+    # SQL Server has no RECURSIVE keyword; its CTEs may refer to themselves anyway
+    sql = POST_TREE_SQL.format(
+        keyword='WITH' if connection.vendor == 'microsoft' else 'WITH RECURSIVE',
+        table=connection.ops.quote_name(Comment._meta.db_table),
+        posts=', '.join(['%s'] * len(post_ids)),
+    )
+    return Comment.objects.raw(sql, [*post_ids, width, width, depth])
+
+
+def attach_post_comments(posts, depth, width):
+    """
+    Load the bounded comment tree of every post into ``post.tree_comments``,
+    in one query, and the number of its top-level comments into
+    ``post.top_level_count``
+    """
+    posts = [post for post in posts if not hasattr(post, 'tree_comments')]
+    by_id = {post.id: post for post in posts}
+    for post in posts:
+        post.tree_comments = []
+        post.top_level_count = None
+    if not posts or depth <= 0 or width <= 0:
+        return
+
+    comments = list(_post_tree(list(by_id), depth, width))
+    by_comment = {comment.id: comment for comment in comments}
+    for comment in comments:
+        comment.tree_replies = []
+    for comment in comments:
+        if comment.parent_id is None:
+            post = by_id[comment.post_id]
+            post.tree_comments.append(comment)
+            post.top_level_count = comment.sibling_count
+        else:
+            by_comment[comment.parent_id].tree_replies.append(comment)
+    for post in posts:
+        if post.top_level_count is None:
+            post.top_level_count = 0
+
+
+def has_more_comments(post):
+    total = getattr(post, 'top_level_count', None)
+    if total is None:
+        # No tree was loaded; any comment means a top-level one is hidden
+        return post.comments_count > 0
+    return total > len(post.tree_comments)
+
+
+def comments_cursor(post):
+    """
+    Cursor for /posts/{id}/comments/ continuing after the last rendered
+    top-level comment
+    """
+    return _cursor_after(getattr(post, 'tree_comments', None))
+
+
+def has_more_replies(comment):
+    return comment.replies_count > len(getattr(comment, 'tree_replies', ()))
+
+
+def replies_cursor(comment):
+    """
+    Cursor for /comments/{id}/replies/ continuing after the last rendered reply
+    """
+    return _cursor_after(getattr(comment, 'tree_replies', None))
+
+
+def _cursor_after(shown):
+    if not shown:
+        return None
+    paginator = OldestFirstKeysetPagination()
+    return paginator.encode_cursor(paginator.get_position(shown[-1]))
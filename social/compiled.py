@@ -0,0 +1,136 @@
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from rest_framework import fields, relations
+from rest_framework.fields import ISO_8601, SkipField, is_simple_callable
+from rest_framework.settings import api_settings
+
+from . import metrics
+
+# Serializer.to_representation goes through Field.get_attribute and
+# Field.to_representation for every field of every row, and rebuilds the
+# field set of each nested serializer it creates. For read-only rendering the
+# work per field is known once the serializer is bound: a plan holds one
+# accessor per readable field, and rows are rendered by running the plan.
+#
+# Output is the same as DRF's: the plan only takes shortcuts where a field's
+# own to_representation would return the value unchanged, and any row that
+# doesn't follow the fast path (a missing relation, a callable attribute)
+# falls back to the field's own get_attribute.
+
+
+def enabled():
+    return getattr(settings, 'SERIALIZER_COMPILED', True)
+
+
+def _attribute(field, attrs):
+    def get(instance):
+        value = instance
+        try:
+            for attr in attrs:
+                value = getattr(value, attr)
+        except ObjectDoesNotExist:
+            return None
+        except AttributeError:
+            return field.get_attribute(instance)
+        if is_simple_callable(value):
+            return field.get_attribute(instance)
+        return value
+    return get
+
+
+def _primary_key(field, model):
+    # What RelatedField.get_attribute does with use_pk_only_optimization,
+    # without building a PKOnlyObject per row
+    try:
+        attname = model._meta.get_field(field.source_attrs[0]).attname
+    except Exception:
+        return None
+
+    def get(instance):
+        return getattr(instance, attname)
+    return get
+
+
+def _datetime(field):
+    # DateTimeField.to_representation looks up the output format and the
+    # current timezone for every value; both are fixed while a serializer is
+    # rendering a response
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    zone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if not isinstance(output_format, str) or output_format.lower() != ISO_8601 or zone is None:
+        return field.to_representation
+
+    def convert(value):
+        if isinstance(value, datetime.datetime) and value.utcoffset() is not None:
+            text = value.astimezone(zone).isoformat()
+            return text[:-6] + 'Z' if text.endswith('+00:00') else text
+        return field.to_representation(value)
+    return convert
+
+
+def _accessor(field, model):
+    """
+    ``(get, convert)`` for one field; ``convert`` is None when the value is
+    rendered as is
+    """
+    if isinstance(field, fields.SerializerMethodField):
+        method = getattr(field.parent, field.method_name)
+        return method, None
+    if field.source == '*':
+        return (lambda instance: instance), field.to_representation
+    if (isinstance(field, relations.PrimaryKeyRelatedField) and field.pk_field is None
+            and field.use_pk_only_optimization() and len(field.source_attrs) == 1):
+        get = _primary_key(field, model)
+        if get is not None:
+            return get, None
+    get = _attribute(field, field.source_attrs)
+    if type(field) is fields.ReadOnlyField:
+        return get, None
+    if type(field) is fields.DateTimeField:
+        return get, _datetime(field)
+    return get, field.to_representation
+
+
+class Plan:
+    """
+    The readable fields of a bound serializer, compiled to accessors
+    """
+    def __init__(self, serializer):
+        model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+        self.steps = [(field.field_name, *_accessor(field, model)) for field in serializer._readable_fields]
+
+    def render(self, instance):
+        data = {}
+        for name, get, convert in self.steps:
+            try:
+                value = get(instance)
+            except SkipField:
+                continue
+            if value is None:
+                data[name] = None
+            elif convert is None:
+                data[name] = value
+            elif isinstance(value, relations.PKOnlyObject) and value.pk is None:
+                # From the fallback of a related field
+                data[name] = None
+            else:
+                data[name] = convert(value)
+        return data
+
+
+class CompiledSerializerMixin:
+    """
+    Read-only rendering through a Plan built once per serializer instance.
+    List serializers reuse their child, so a page of rows shares one plan.
+    """
+
+    @metrics.timed_serializer
+    def to_representation(self, instance):
+        if not enabled():
+            return super().to_representation(instance)
+        plan = self.__dict__.get('_plan')
+        if plan is None:
+            plan = self.__dict__['_plan'] = Plan(self)
+        return plan.render(instance)
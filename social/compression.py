@@ -0,0 +1,226 @@
+import gzip
+import re
+import zlib
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional; only gzip is offered without it
+    brotli = None
+
+# Response compression. Feed and list pages embed full comment trees and are
+# tens to hundreds of KB of repetitive JSON, which gzip shrinks several times
+# over and brotli a little further. The encoding is negotiated from
+# Accept-Encoding (br first when the brotli package is installed, gzip
+# otherwise), and the body is left alone when compressing can't pay off:
+# small bodies, media that is already compressed, byte ranges, and bodies
+# that already have an encoding.
+#
+# Bodies from COMPRESSION_STREAM_SIZE up, and streaming responses, are
+# compressed chunk by chunk as they are sent, so the first bytes leave before
+# the whole page is compressed and no second full-size copy is held.
+#
+# Token endpoints (COMPRESSION_EXCLUDE_PATHS) are never compressed: their
+# bodies carry secrets next to request input, which is what BREACH-style
+# length attacks need.
+
+CHUNK_SIZE = 64 * 1024
+
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/|application/(json|javascript|xml|x-ndjson|problem\+json)$|application/[\w.+-]+\+(json|xml)$'
+    r'|image/svg\+xml$)'
+)
+
+
+def enabled():
+    return getattr(settings, 'COMPRESSION_ENABLED', True)
+
+
+def min_size():
+    return getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+
+
+def stream_size():
+    return getattr(settings, 'COMPRESSION_STREAM_SIZE', 256 * 1024)
+
+
+def available():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def accepted(header):
+    """
+    ``{coding: q}`` from an Accept-Encoding header
+    """
+    codings = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def negotiate(header):
+    """
+    The coding to send for ``header``, or None for the identity. Ties go to
+    the server's preference (br, then gzip).
+    """
+    if not header:
+        return None
+    codings = accepted(header)
+    best, best_q = None, 0.0
+    for coding in available():
+        q = codings.get(coding, codings.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compressible(request, response):
+    """
+    Whether the response is worth compressing for any client; the answer
+    doesn't depend on Accept-Encoding, so it also decides Vary
+    """
+    if response.has_header('Content-Encoding') or response.status_code == 206:
+        return False
+    # Byte ranges of media address the stored bytes, not an encoded copy
+    if response.has_header('Accept-Ranges') or response.has_header('Content-Range'):
+        return False
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    if not COMPRESSIBLE_TYPES.match(content_type):
+        return False
+    if request.path.startswith(tuple(getattr(settings, 'COMPRESSION_EXCLUDE_PATHS', ()))):
+        return False
+    return response.streaming or len(response.content) >= min_size()
+
+
+class Compressor:
+    """
+    One incremental encoder: ``compress`` returns what can be sent so far,
+    ``finish`` the rest
+    """
+    def __init__(self, coding):
+        self.coding = coding
+        if coding == 'br':
+            self.encoder = brotli.Compressor(quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5))
+        else:
+            # wbits 16 + 15 writes a gzip container (with a zero mtime)
+            self.encoder = zlib.compressobj(getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=True):
+        if self.coding == 'br':
+            out = self.encoder.process(data)
+            return out + self.encoder.flush() if flush else out
+        out = self.encoder.compress(data)
+        return out + self.encoder.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self):
+        if self.coding == 'br':
+            return self.encoder.finish()
+        return self.encoder.flush()
+
+
+def compress(data, coding):
+    compressor = Compressor(coding)
+    return compressor.compress(data, flush=False) + compressor.finish()
+
+
+def decompress(data, coding):
+    if coding == 'gzip':
+        return gzip.decompress(data)
+    if coding == 'br':
+        if brotli is None:
+            raise ValueError('brotli is not installed')
+        return brotli.decompress(data)
+    return data
+
+
+def compress_chunks(chunks, coding):
+    # Flushing after each chunk lets the client start parsing; chunks are at
+    # least CHUNK_SIZE where we cut them ourselves, so the flushes cost little
+    compressor = Compressor(coding)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.finish()
+
+
+async def compress_chunks_async(chunks, coding):
+    compressor = Compressor(coding)
+    async for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.finish()
+
+
+def split(content):
+    for start in range(0, len(content), CHUNK_SIZE):
+        yield content[start:start + CHUNK_SIZE]
+
+
+def weaken_etag(response):
+    # The compressed body is a different representation of the same resource
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+
+
+def streamed(response, chunks):
+    """
+    A StreamingHttpResponse carrying ``response``'s status and headers
+    """
+    streaming = StreamingHttpResponse(chunks, status=response.status_code)
+    for name, value in response.items():
+        streaming[name] = value
+    streaming.cookies = response.cookies
+    return streaming
+
+
+def apply(request, response):
+    """
+    Compress ``response`` for ``request`` if both sides allow it; returns the
+    response to send
+    """
+    if not compressible(request, response):
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    coding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if coding is None:
+        return response
+
+    if response.streaming:
+        if not getattr(settings, 'COMPRESSION_STREAMING', True):
+            return response
+        if response.is_async:
+            response.streaming_content = compress_chunks_async(response.streaming_content, coding)
+        else:
+            response.streaming_content = compress_chunks(response.streaming_content, coding)
+        del response['Content-Length']
+    elif len(response.content) >= stream_size() and getattr(settings, 'COMPRESSION_STREAMING', True):
+        response = streamed(response, compress_chunks(split(response.content), coding))
+        del response['Content-Length']
+    else:
+        body = compress(response.content, coding)
+        if len(body) >= len(response.content):
+            return response
+        response.content = body
+        response['Content-Length'] = str(len(body))
+
+    weaken_etag(response)
+    response['Content-Encoding'] = coding
+    return response
@@ -0,0 +1,158 @@
+import functools
+import hashlib
+from calendar import timegm
+
+from django.db.models import Exists, Max, OuterRef, Q, Sum
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.exceptions import NotFound
+
+from . import cache
+from .models import Comment, Conversation, Post, Profile
+from .pagination import KeysetPagination
+
+# Conditional GETs for the endpoints clients poll. Each validator reads a few
+# columns and aggregates that change whenever the rendered response would,
+# and the ETag is a hash of them. A matching If-None-Match (or, where
+# there is a true high-water mark, If-Modified-Since) is answered with 304
+# before the objects are loaded or serialized.
+#
+# Counters are updated with UPDATE ... SET n = n + 1 and don't move
+# updated_at, so posts and profiles have an ETag but no Last-Modified; only
+# message threads, whose inbox rows are touched on every change, have both.
+
+
+def etag(*parts):
+    return 'W/"{}"'.format(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def as_id(value):
+    # Malformed ids are left to the view, which answers 404
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def viewer_id(request):
+    return request.user.id if request.user and request.user.is_authenticated else None
+
+
+def post(request, pk=None, **kwargs):
+    """
+    The post, its counters and author, its comments and whether the viewer
+    liked it, in one query
+    """
+    pk = as_id(pk)
+    if pk is None:
+        return None
+    rows = Post.objects.filter(pk=pk)
+    user_id = viewer_id(request)
+    if user_id is not None:
+        rows = rows.annotate(viewer_liked=Exists(
+            Post.likes.through.objects.filter(post_id=OuterRef('pk'), user_id=user_id)
+        ))
+    found = list(rows.values(
+        'updated_at', 'likes_count', 'reposts_count', 'comments_count', 'image', 'image_variants',
+        'author__username', 'author__profile__id', *(['viewer_liked'] if user_id is not None else []),
+    ).annotate(
+        # Grouped by the columns above, i.e. over this post's comments
+        comments_changed=Max('comments__updated_at'), comment_likes=Sum('comments__likes_count'),
+    ).order_by())
+    if not found:
+        return None
+    return etag('post', pk, user_id, cache.request_variant({'request': request}), found[0]), None
+
+
+def profile(request, pk=None, **kwargs):
+    pk = as_id(pk)
+    if pk is None:
+        return None
+    row = Profile.objects.filter(pk=pk).values(
+        'updated_at', 'followers_count', 'following_count', 'bio', 'profile_picture', 'picture_variants',
+        'user__username',
+    ).first()
+    if row is None:
+        return None
+    return etag('profile', pk, cache.request_variant({'request': request}), row), None
+
+
+def user_posts(request, pk=None, **kwargs):
+    """
+    The rows of the requested page only, read through the same keyset
+    pagination as the view: the posts' columns, their commenters with the
+    latest edit and like sum of each, and the viewer's likes. Likes moving
+    between two comments of one author would keep the sums, hence weak ETags.
+    """
+    pk = as_id(pk)
+    if pk is None:
+        return None
+    paginator = KeysetPagination()
+    try:
+        page = paginator.paginate_queryset(Post.objects.filter(author_id=pk).values(
+            'id', 'created_at', 'updated_at', 'likes_count', 'reposts_count', 'comments_count',
+            'image', 'image_variants', 'author__username', 'author__profile__id',
+        ), request)
+    except NotFound:
+        return None
+    if not page:
+        return None
+    ids = [row['id'] for row in page]
+    commenters = list(Comment.objects.filter(post_id__in=ids).values('author__username').annotate(
+        changed=Max('updated_at'), likes=Sum('likes_count'),
+    ).order_by('author__username'))
+    user_id = viewer_id(request)
+    liked = None
+    if user_id is not None:
+        liked = sorted(Post.likes.through.objects.filter(post_id__in=ids, user_id=user_id)
+                       .values_list('post_id', flat=True))
+    return etag('user_posts', pk, user_id, cache.request_variant({'request': request}),
+                request.query_params.urlencode(), paginator.has_next, paginator.has_previous,
+                page, commenters, liked), None
+
+
+def thread(request, user_id=None, **kwargs):
+    """
+    Both participants' inbox rows: new, edited, deleted and read messages
+    all move updated_at on at least one of them
+    """
+    me, user_id = viewer_id(request), as_id(user_id)
+    if me is None or user_id is None:
+        return None
+    rows = list(Conversation.objects.filter(
+        Q(owner_id=me, other_id=user_id) | Q(owner_id=user_id, other_id=me)
+    ).order_by('owner_id').values_list('owner_id', 'updated_at', 'last_message_id', 'unread_count'))
+    if not rows:
+        return None
+    return etag('thread', me, user_id, request.query_params.urlencode(), rows), max(row[1] for row in rows)
+
+
+def conditional(validator):
+    """
+    Answer GET/HEAD on a view method with 304 when the client's copy still
+    matches ``validator(request, **kwargs)``, an ``(etag, last_modified)``
+    pair or None when there is nothing to validate against
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return method(self, request, *args, **kwargs)
+            validators = validator(request, **kwargs)
+            if validators is None:
+                return method(self, request, *args, **kwargs)
+            tag, last_modified = validators
+            timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+            response = get_conditional_response(request, etag=tag, last_modified=timestamp)
+            if response is None:
+                response = method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = tag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            # Clients keep their copy but always ask first
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,32 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .notifications import user_group
+
+# Close code sent when the connection is not authenticated
+UNAUTHORIZED = 4401
+
+
+class NotificationConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Per-user push channel for message, like, follow and comment events
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=UNAUTHORIZED)
+            return
+        self.group_name = user_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        if content.get('type') == 'ping':
+            await self.send_json({'type': 'pong'})
+
+    async def notify(self, message):
+        await self.send_json({'type': message['event'], 'data': message['data']})
@@ -0,0 +1,111 @@
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from . import counters
+from .models import Conversation, Message
+
+
+def thread(user_id, other_id):
+    """
+    All messages exchanged between two users
+    """
+    return Message.objects.filter(
+        Q(sender_id=user_id, receiver_id=other_id) | Q(sender_id=other_id, receiver_id=user_id)
+    )
+
+
+def message_created(message):
+    """
+    Point both participants' inbox rows at a new message and count it as unread for the receiver
+    """
+    for owner_id, other_id in ((message.sender_id, message.receiver_id), (message.receiver_id, message.sender_id)):
+        conversation, _ = Conversation.objects.get_or_create(owner_id=owner_id, other_id=other_id)
+        Conversation.objects.filter(pk=conversation.pk).filter(
+            Q(last_message_at__isnull=True) | Q(last_message_at__lte=message.created_at)
+        ).update(last_message=message, last_message_at=message.created_at, updated_at=timezone.now())
+    counters.adjust(
+        Conversation.objects.filter(owner_id=message.receiver_id, other_id=message.sender_id),
+        'unread_count', 1, updated_at=timezone.now()
+    )
+
+
+def refresh(owner_id, other_id):
+    """
+    Recompute one inbox row from the messages of the thread
+    """
+    last = thread(owner_id, other_id).order_by('-created_at', '-id').values_list('id', 'created_at').first()
+    unread = Message.objects.filter(sender_id=other_id, receiver_id=owner_id, is_read=False).count()
+    Conversation.objects.filter(owner_id=owner_id, other_id=other_id).update(
+        last_message_id=last[0] if last else None,
+        last_message_at=last[1] if last else None,
+        unread_count=unread,
+        updated_at=timezone.now(),
+    )
+
+
+def refresh_unread(owner_id, other_id):
+    unread = Message.objects.filter(sender_id=other_id, receiver_id=owner_id, is_read=False).count()
+    # Also called after edits, so updated_at moves even when the count doesn't
+    Conversation.objects.filter(owner_id=owner_id, other_id=other_id).update(
+        unread_count=unread, updated_at=timezone.now()
+    )
+
+
+def unread_total(user_id):
+    """
+    Unread messages across all of a user's conversations, summed from the
+    inbox rows rather than counted over the messages table
+    """
+    total = Conversation.objects.filter(owner_id=user_id).aggregate(total=Sum('unread_count'))['total']
+    return total or 0
+
+
+def mark_read(reader, ids=None, sender_id=None, up_to_id=None, before=None):
+    """
+    Mark the reader's unread messages as read with a single UPDATE.
+
+    Either an explicit list of message ``ids`` or a conversation (``sender_id``)
+    bounded by ``up_to_id`` and/or ``before`` selects the messages. Returns a
+    ``{message_id: sender_id}`` map of the messages that changed state.
+    """
+    unread = Message.objects.filter(receiver_id=reader.id, is_read=False)
+    if ids is not None:
+        unread = unread.filter(id__in=ids)
+    if sender_id is not None:
+        unread = unread.filter(sender_id=sender_id)
+    if up_to_id is not None:
+        unread = unread.filter(id__lte=up_to_id)
+    if before is not None:
+        unread = unread.filter(created_at__lte=before)
+
+    with transaction.atomic():
+        changed = dict(unread.values_list('id', 'sender_id'))
+        if changed:
+            unread.filter(id__in=changed).update(is_read=True)
+            for other_id in set(changed.values()):
+                refresh_unread(reader.id, other_id)
+    return changed
+
+
+def message_deleted(message):
+    refresh(message.sender_id, message.receiver_id)
+    refresh(message.receiver_id, message.sender_id)
+
+
+def rebuild():
+    """
+    Recreate every inbox row from the messages table
+    """
+    Conversation.objects.all().delete()
+    pairs = Message.objects.values_list('sender_id', 'receiver_id').distinct()
+    owners = set()
+    for sender_id, receiver_id in pairs:
+        owners.add((sender_id, receiver_id))
+        owners.add((receiver_id, sender_id))
+    Conversation.objects.bulk_create(
+        [Conversation(owner_id=owner_id, other_id=other_id) for owner_id, other_id in owners],
+        batch_size=1000,
+    )
+    for owner_id, other_id in owners:
+        refresh(owner_id, other_id)
@@ -0,0 +1,108 @@
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Post, Profile
+
+
+def adjust(queryset, field, delta, **changes):
+    """
+    Atomically add ``delta`` to ``field`` on every row of ``queryset``, never
+    going below zero, in the same UPDATE as any other ``changes``
+    """
+    if not delta:
+        return
+    if delta > 0:
+        value = F(field) + delta
+    else:
+        value = Case(When(**{f'{field}__gt': -delta}, then=F(field) + delta), default=Value(0))
+    queryset.update(**{field: value}, **changes)
+
+
+# Many-to-many relations whose size is stored on the owning model:
+# (model, m2m field name, counter column)
+COUNTED_M2M_FIELDS = (
+    (Post, 'likes', 'likes_count'),
+    (Post, 'reposts', 'reposts_count'),
+    (Comment, 'likes', 'likes_count'),
+)
+
+
+def counted_relation(through):
+    """
+    Return ``(model, m2m_field, counter)`` for a counted m2m through model, or None
+    """
+    for model, name, counter in COUNTED_M2M_FIELDS:
+        field = model._meta.get_field(name)
+        if field.remote_field.through is through:
+            return model, field, counter
+    return None
+
+
+def existing_links(field, instance, reverse, pk_set):
+    """
+    Subset of ``pk_set`` that is currently linked to ``instance``
+    """
+    through = field.remote_field.through
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    if reverse:
+        source, target = target, source
+    links = through.objects.filter(**{f'{source}_id': instance.pk})
+    if pk_set is not None:
+        links = links.filter(**{f'{target}_id__in': pk_set})
+    return set(links.values_list(f'{target}_id', flat=True))
+
+
+def apply_m2m_change(model, counter, instance, reverse, pk_set, delta):
+    """
+    Update counters after ``pk_set`` links were added (delta=1) or removed (delta=-1)
+    """
+    if not pk_set:
+        return
+    if reverse:
+        # instance is the User; every object in pk_set gained or lost one link
+        adjust(model.objects.filter(pk__in=pk_set), counter, delta)
+    else:
+        adjust(model.objects.filter(pk=instance.pk), counter, delta * len(pk_set))
+
+
+def _count(queryset, field, outer='pk'):
+    counts = queryset.filter(**{field: OuterRef(outer)}).order_by().values(field).annotate(
+        total=Count('*')
+    ).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def counter_sources():
+    """
+    ``(model, counter, expression)`` triples computing each counter from scratch
+    """
+    return [
+        (Post, 'likes_count', _count(Post.likes.through.objects.all(), 'post_id')),
+        (Post, 'reposts_count', _count(Post.reposts.through.objects.all(), 'post_id')),
+        (Post, 'comments_count', _count(Comment.objects.all(), 'post_id')),
+        (Comment, 'likes_count', _count(Comment.likes.through.objects.all(), 'comment_id')),
+        (Comment, 'replies_count', _count(Comment.objects.all(), 'parent_id')),
+        (Profile, 'followers_count', _count(Follow.objects.all(), 'following_id', outer='user_id')),
+        (Profile, 'following_count', _count(Follow.objects.all(), 'follower_id', outer='user_id')),
+    ]
+
+
+def reconcile(model, counter, expression, batch_size=1000):
+    """
+    Recompute ``counter`` for every row of ``model`` in primary key batches and
+    fix the rows that drifted. Returns the number of rows corrected.
+    """
+    corrected = 0
+    last_pk = 0
+    while True:
+        rows = list(
+            model.objects.filter(pk__gt=last_pk).order_by('pk')
+            .annotate(actual=expression).values_list('pk', counter, 'actual')[:batch_size]
+        )
+        if not rows:
+            return corrected
+        last_pk = rows[-1][0]
+        stale = [model(pk=pk, **{counter: actual}) for pk, stored, actual in rows if stored != actual]
+        if stale:
+            model.objects.bulk_update(stale, [counter])
+            corrected += len(stale)
@@ -0,0 +1,103 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Reads go to a replica only when a view opted in for the current request
+# (see ReplicaReadMixin) and the user hasn't written recently. Everything
+# else - writes, reads inside transactions, management commands - uses the
+# primary.
+
+DEFAULT_PIN_SECONDS = 5
+
+_state = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    def __init__(self):
+        self.use_replica = False
+        self.wrote = False
+
+
+@contextmanager
+def request_scope():
+    state = RoutingState()
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def choose_replica(aliases):
+    return random.choice(aliases)
+
+
+def _pin_key(user_id):
+    return f'db-pin:{user_id}'
+
+
+def _pin_cache():
+    return caches[getattr(settings, 'DATABASE_PIN_CACHE', 'default')]
+
+
+def pin_to_primary(user_id):
+    """
+    Keep the user's reads on the primary until replicas have caught up with
+    what they just wrote
+    """
+    seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+    _pin_cache().set(_pin_key(user_id), True, seconds)
+
+
+def is_pinned(user_id):
+    return bool(_pin_cache().get(_pin_key(user_id)))
+
+
+def read_from_replicas(user):
+    """
+    Let the rest of the current request read from replicas, unless ``user``
+    has to see their own recent writes
+    """
+    state = _state.get()
+    if state is None or state.wrote or not replica_aliases():
+        return False
+    if user.is_authenticated and is_pinned(user.id):
+        return False
+    state.use_replica = True
+    return True
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica:
+            return DEFAULT_DB_ALIAS
+        aliases = replica_aliases()
+        if not aliases or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return choose_replica(aliases)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+            # Later reads of this request must see the write
+            state.use_replica = False
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replica_aliases():
+            return False
+        return None
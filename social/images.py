@@ -0,0 +1,350 @@
+import io
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from . import cache
+from .models import Post, Profile
+
+logger = logging.getLogger(__name__)
+
+# Uploaded post images and profile pictures are post-processed off the request
+# path: the original is re-encoded without its EXIF/ICC metadata (orientation
+# is applied first) and capped to IMAGE_MAX_DIMENSION, then resized copies are
+# written in WebP plus a JPEG (PNG when the image has transparency) fallback.
+# Dimensions, a blurhash placeholder and the list of variants are stored on
+# the row with a queryset update, so the job never overwrites other columns
+# and never runs the post_save receivers again.
+#
+# ``variants['source']`` is the file name the variants were made from; when it
+# differs from the current file name the image was replaced and is processed
+# again.
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_DIMENSION = 2048
+DEFAULT_QUALITY = 82
+DEFAULT_POST_WIDTHS = (160, 320, 640, 1080)
+DEFAULT_PROFILE_WIDTHS = (64, 128, 256)
+VARIANTS_DIR = 'variants'
+
+
+class ImageSpec:
+    """
+    Where an image field keeps its metadata: ``<prefix>_width``,
+    ``<prefix>_height``, ``<prefix>_placeholder`` and ``<prefix>_variants``
+    """
+    def __init__(self, field, prefix, fragment, fragment_key, widths_setting, default_widths):
+        self.field = field
+        self.prefix = prefix
+        self.fragment = fragment
+        self.fragment_key = fragment_key
+        self.widths_setting = widths_setting
+        self.default_widths = default_widths
+
+    def column(self, name):
+        return f'{self.prefix}_{name}'
+
+    def widths(self):
+        return sorted(getattr(settings, self.widths_setting, self.default_widths))
+
+    def file(self, instance):
+        return getattr(instance, self.field)
+
+    def variants(self, instance):
+        return getattr(instance, self.column('variants')) or {}
+
+
+SPECS = {
+    Post: ImageSpec('image', 'image', 'post', 'pk', 'IMAGE_VARIANT_WIDTHS', DEFAULT_POST_WIDTHS),
+    Profile: ImageSpec('profile_picture', 'picture', 'profile', 'user_id',
+                       'PROFILE_PICTURE_WIDTHS', DEFAULT_PROFILE_WIDTHS),
+}
+
+
+def needs_processing(instance):
+    spec = SPECS[type(instance)]
+    file = spec.file(instance)
+    return bool(file) and spec.variants(instance).get('source') != file.name
+
+
+# Worker pool
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='images',
+            )
+        return _executor
+
+
+def schedule(instance):
+    """
+    Process the instance's image once the current transaction has committed.
+    With IMAGE_PROCESSING_ASYNC off the work runs inline instead, and the
+    instance is refreshed so the response already shows the variants.
+    """
+    if not needs_processing(instance):
+        return
+    model, pk = type(instance), instance.pk
+    if getattr(settings, 'IMAGE_PROCESSING_ASYNC', True):
+        transaction.on_commit(lambda: executor().submit(_run_in_worker, model, pk))
+    elif process(model, pk):
+        spec = SPECS[model]
+        instance.refresh_from_db(fields=[spec.field] + [
+            spec.column(name) for name in ('width', 'height', 'placeholder', 'variants')
+        ])
+
+
+def _run_in_worker(model, pk):
+    try:
+        process(model, pk)
+    except Exception:
+        logger.exception('Processing the image of %s %s failed', model.__name__, pk)
+    finally:
+        close_old_connections()
+
+
+# Processing
+
+def process(model, pk):
+    """
+    Generate the variants of one row's image. Returns False when there was
+    nothing to do or the image was replaced while it was being processed.
+    """
+    spec = SPECS[model]
+    started = time.time()
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_processing(instance):
+        return False
+    file = spec.file(instance)
+    storage = file.storage
+    source = file.name
+
+    with file.open('rb'):
+        image = Image.open(file)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    transparent = has_alpha(image)
+    image = image.convert('RGBA' if transparent else 'RGB')
+    fallback = 'png' if transparent else 'jpeg'
+    max_dimension = getattr(settings, 'IMAGE_MAX_DIMENSION', DEFAULT_MAX_DIMENSION)
+    if max(image.size) > max_dimension:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    directory, filename = os.path.split(source)
+    stem = os.path.splitext(filename)[0]
+    # The stripped original replaces the upload
+    clean = storage.save(os.path.join(directory, f'{stem}.{extension(fallback)}'), encode(image, fallback))
+
+    items = []
+    for width in [w for w in spec.widths() if w < image.width] + [image.width]:
+        resized = image if width == image.width else resize(image, width)
+        for format in ('webp', fallback):
+            name = storage.save(
+                os.path.join(directory, VARIANTS_DIR, f'{stem}_{width}w.{extension(format)}'),
+                encode(resized, format),
+            )
+            items.append({'name': name, 'format': format, 'width': resized.width, 'height': resized.height})
+
+    written = [clean] + [item['name'] for item in items]
+    updated = model.objects.filter(pk=pk, **{spec.field: source}).update(**{
+        spec.field: clean,
+        spec.column('width'): image.width,
+        spec.column('height'): image.height,
+        spec.column('placeholder'): blurhash(image),
+        spec.column('variants'): {'source': clean, 'items': items},
+    })
+    if not updated:
+        # Replaced or deleted meanwhile; the new upload gets its own job
+        discard(storage, written)
+        return False
+
+    # The upload and the variants of an earlier upload
+    discard(storage, [name for name in files_of(spec, instance) if name not in written], started)
+    cache.invalidate(spec.fragment, [getattr(instance, spec.fragment_key)])
+    return True
+
+
+def files_of(spec, instance):
+    """
+    The stored image of ``instance``, the image its variants were made from
+    (the same one unless it was just replaced) and the variants
+    """
+    file, variants = spec.file(instance), spec.variants(instance)
+    names = [file.name] if file else []
+    names += [variants['source']] if variants.get('source') else []
+    names += [item['name'] for item in variants.get('items', ())]
+    return list(dict.fromkeys(names))
+
+
+def referenced(name):
+    """
+    Whether any post or profile uses ``name`` as its image or a variant
+    """
+    for model, spec in SPECS.items():
+        uses = Q(**{spec.field: name}) | Q(**{f'{spec.column("variants")}__icontains': name})
+        if model.objects.filter(uses).exists():
+            return True
+    return False
+
+
+def discard(storage, names, since=None):
+    """
+    Delete the files among ``names`` no row references. Identical uploads
+    share a file, so each name is checked first; a file stored again after
+    ``since`` (a time.time()) may belong to an upload whose row isn't
+    committed yet, and is left to collect_media.
+    """
+    for name in names:
+        if referenced(name):
+            continue
+        try:
+            if since is not None and storage.get_modified_time(name).timestamp() > since:
+                continue
+        except FileNotFoundError:
+            continue
+        storage.delete(name)
+
+
+def release(instance):
+    """
+    Discard the files of a deleted post or profile once the delete commits
+    """
+    spec = SPECS[type(instance)]
+    names = files_of(spec, instance)
+    if names:
+        storage = spec.file(instance).storage
+        since = time.time()
+        transaction.on_commit(lambda: discard(storage, names, since))
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def extension(format):
+    return 'jpg' if format == 'jpeg' else format
+
+
+def resize(image, width):
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def encode(image, format):
+    """
+    ``image`` re-encoded as ``format``; Pillow only writes metadata that is
+    passed in explicitly, so none of the upload's EXIF/ICC data is kept
+    """
+    quality = getattr(settings, 'IMAGE_QUALITY', DEFAULT_QUALITY)
+    buffer = io.BytesIO()
+    if format == 'webp':
+        image.save(buffer, 'WEBP', quality=quality, method=4)
+    elif format == 'jpeg':
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+# Placeholders (https://blurha.sh): a few DCT components of the image packed
+# into a short base83 string that clients decode into a blurred preview
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+PLACEHOLDER_SIZE = 32
+
+
+def _base83(value, length):
+    return ''.join(BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _to_linear(value):
+    value /= 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def blurhash(image, x_components=4, y_components=3):
+    small = image.convert('RGB')
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    width, height = small.size
+    linear = [tuple(_to_linear(channel) for channel in pixel) for pixel in small.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[i][x] * cos_y[j][y]
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised = max(0, min(82, int(max(abs(c) for factor in ac for c in factor) * 166 - 0.5)))
+        maximum = (quantised + 1) / 166
+    else:
+        quantised, maximum = 0, 1
+    result += _base83(quantised, 1)
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (max(0, min(18, int(_sign_pow(c / maximum, 0.5) * 9 + 9.5))) for c in factor)
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+# Serialization
+
+def srcset(instance, request=None):
+    """
+    ``{'webp': 'url 160w, ...', 'jpeg'|'png': ...}`` for the processed image
+    of ``instance``, or None until it has been processed
+    """
+    spec = SPECS[type(instance)]
+    file = spec.file(instance)
+    variants = spec.variants(instance)
+    if not file or variants.get('source') != file.name:
+        return None
+    storage = file.storage
+    result = {}
+    for item in variants.get('items', ()):
+        url = storage.url(item['name'])
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        result.setdefault(item['format'], []).append(f'{url} {item["width"]}w')
+    return {format: ', '.join(entries) for format, entries in result.items()}
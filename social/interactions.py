@@ -0,0 +1,194 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, router, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import m2m_changed
+
+from .models import Follow, Post
+
+# Likes, reposts and follows are switched on and off with one conditional
+# statement each: an INSERT that the unique constraint turns into a no-op when
+# the row exists, or a DELETE whose row count says whether there was anything
+# to remove. Signals are only sent for rows that actually changed, so a double
+# tap can't count twice, and they run in the same transaction as the statement
+# so the counters can't drift from the rows.
+#
+# The m2m_changed signals sent here also carry the acting user as ``user``,
+# so receivers don't have to load it again.
+
+
+def _insert(model, **values):
+    try:
+        with transaction.atomic(using=router.db_for_write(model)):
+            return model.objects.create(**values)
+    except IntegrityError:
+        return None
+
+
+def _m2m_link(instance, name, user):
+    field = instance._meta.get_field(name)
+    through = field.remote_field.through
+    return through, {
+        f'{field.m2m_field_name()}_id': instance.pk,
+        f'{field.m2m_reverse_field_name()}_id': user.pk,
+    }
+
+
+def _m2m_changed(through, instance, action, user):
+    # Only the post_* actions: the links are already in their final state
+    m2m_changed.send(
+        sender=through, action=action, instance=instance, reverse=False,
+        model=User, pk_set={user.pk}, using=router.db_for_write(through), user=user,
+    )
+
+
+@transaction.atomic
+def add(instance, name, user):
+    """
+    Link ``user`` through the many-to-many ``name`` (e.g. post.likes).
+    Returns False when the link already existed.
+    """
+    through, link = _m2m_link(instance, name, user)
+    if _insert(through, **link) is None:
+        return False
+    _m2m_changed(through, instance, 'post_add', user)
+    return True
+
+
+@transaction.atomic
+def remove(instance, name, user):
+    """
+    Unlink ``user``. Returns False when there was no link.
+    """
+    through, link = _m2m_link(instance, name, user)
+    # No receivers listen to the through model, so this is a single DELETE
+    # and the count is what it removed
+    deleted, _ = through.objects.filter(**link).delete()
+    if not deleted:
+        return False
+    _m2m_changed(through, instance, 'post_remove', user)
+    return True
+
+
+def toggle(instance, name, user):
+    """
+    Link when absent, unlink otherwise. Returns the resulting state.
+    """
+    if add(instance, name, user):
+        return True
+    remove(instance, name, user)
+    return False
+
+
+@transaction.atomic
+def follow(follower, following):
+    return _insert(Follow, follower_id=follower.pk, following_id=following.pk) is not None
+
+
+@transaction.atomic
+def unfollow(follower, following):
+    rows = Follow.objects.filter(follower_id=follower.pk, following_id=following.pk)
+    # Lock the row first: a concurrent unfollow then waits and finds nothing,
+    # instead of both collecting it and sending post_delete twice
+    if not rows.select_for_update().exists():
+        return False
+    deleted, _ = rows.delete()
+    return deleted > 0
+
+
+def counter(instance, field):
+    """
+    Fresh value of a counter column updated by the signal handlers
+    """
+    return type(instance).objects.filter(pk=instance.pk).values_list(field, flat=True).first() or 0
+
+
+# Viewer state of posts (liked / reposted / following the author), answered
+# for a whole screen of posts at once
+
+MAX_STATE_IDS = 300
+DEFAULT_STATE_CACHE_USERS = 1000
+DEFAULT_STATE_CACHE_TIMEOUT = 60
+
+
+class StateCache:
+    """
+    Per-process LRU of the post state already looked up for each user, so
+    that scrolling back and forth doesn't query the same posts again.
+    Entries are dropped when the user likes, reposts or follows in this
+    process and expire after ``timeout`` seconds otherwise.
+    """
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id, post_ids):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry['expires'] < time.monotonic():
+                return {}
+            self.entries.move_to_end(user_id)
+            return {post_id: entry['posts'][post_id] for post_id in post_ids if post_id in entry['posts']}
+
+    def put(self, user_id, states):
+        size = getattr(settings, 'INTERACTION_STATE_CACHE_USERS', DEFAULT_STATE_CACHE_USERS)
+        if not size:
+            return
+        timeout = getattr(settings, 'INTERACTION_STATE_CACHE_TIMEOUT', DEFAULT_STATE_CACHE_TIMEOUT)
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry['expires'] < time.monotonic():
+                entry = self.entries[user_id] = {'expires': time.monotonic() + timeout, 'posts': {}}
+            entry['posts'].update(states)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def forget(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+state_cache = StateCache()
+
+
+def post_states(user, post_ids):
+    """
+    ``{post_id: {'is_liked', 'is_reposted', 'is_following_author'}}`` for
+    the existing posts among ``post_ids``, with at most three queries
+    """
+    states = state_cache.get(user.id, post_ids)
+    missing = [post_id for post_id in post_ids if post_id not in states]
+    if not missing:
+        return states
+
+    posts = Post.objects.filter(pk__in=missing).annotate(following=Exists(
+        Follow.objects.filter(follower_id=user.id, following_id=OuterRef('author_id'))
+    )).values_list('pk', 'following')
+    liked = set(Post.likes.through.objects.filter(
+        user_id=user.id, post_id__in=missing
+    ).values_list('post_id', flat=True))
+    reposted = set(Post.reposts.through.objects.filter(
+        user_id=user.id, post_id__in=missing
+    ).values_list('post_id', flat=True))
+
+    fresh = {
+        post_id: {
+            'is_liked': post_id in liked,
+            'is_reposted': post_id in reposted,
+            'is_following_author': following,
+        }
+        for post_id, following in posts
+    }
+    state_cache.put(user.id, fresh)
+    states.update(fresh)
+    return states
@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User
+
+from .models import Profile
+
+# Serializers reach for users and profiles through foreign keys (``sender``,
+# ``author.profile``, ...), which Django loads one row at a time. The loaders
+# below resolve every id a response needs with one IN query per type, remember
+# the rows for the rest of the request, and plant them in the relation caches
+# so the unchanged serializer fields find them there.
+
+
+class BatchLoader:
+    """
+    Memoizing ``key -> object`` loader fetching misses with a single IN query
+    """
+    def __init__(self, queryset, key='pk'):
+        self.queryset = queryset
+        self.key = key
+        self.cache = {}
+
+    def prime(self, obj):
+        self.cache.setdefault(getattr(obj, self.key), obj)
+
+    def load_many(self, keys):
+        missing = {key for key in keys if key is not None and key not in self.cache}
+        if missing:
+            for obj in self.queryset.filter(**{f'{self.key}__in': missing}):
+                self.cache[getattr(obj, self.key)] = obj
+        return {key: self.cache[key] for key in keys if key in self.cache}
+
+
+class Loaders:
+    def __init__(self):
+        self.users = BatchLoader(User.objects.all())
+        self.profiles = BatchLoader(Profile.objects.all(), key='user_id')
+
+
+def for_context(context):
+    """
+    The loaders of the current request, or of this serializer tree when
+    there's no request
+    """
+    request = context.get('request')
+    if request is None:
+        if '_loaders' not in context:
+            context['_loaders'] = Loaders()
+        return context['_loaders']
+    loaders = getattr(request, '_social_loaders', None)
+    if loaders is None:
+        loaders = request._social_loaders = Loaders()
+    return loaders
+
+
+def prime_users(context, instances, *fields):
+    """
+    Load the users behind the ``fields`` foreign keys of every instance
+    """
+    loaders = for_context(context)
+    pending = []
+    for instance in instances:
+        for name in fields:
+            field = instance._meta.get_field(name)
+            if field.is_cached(instance):
+                if field.get_cached_value(instance) is not None:
+                    loaders.users.prime(field.get_cached_value(instance))
+            else:
+                pending.append((instance, field))
+    users = loaders.users.load_many({getattr(instance, field.attname) for instance, field in pending})
+    for instance, field in pending:
+        user = users.get(getattr(instance, field.attname))
+        if user is not None:
+            field.set_cached_value(instance, user)
+    loaded = (getattr(instance, name) for instance in instances for name in fields)
+    return [user for user in loaded if user is not None]
+
+
+def prime_profiles(context, users):
+    """
+    Load ``user.profile`` for every user, and point each profile back at its user
+    """
+    loaders = for_context(context)
+    relation = Profile.user.field.remote_field
+    pending = []
+    for user in users:
+        if relation.is_cached(user):
+            if relation.get_cached_value(user) is not None:
+                loaders.profiles.prime(relation.get_cached_value(user))
+        else:
+            pending.append(user)
+    profiles = loaders.profiles.load_many({user.pk for user in pending})
+    for user in pending:
+        profile = profiles.get(user.pk)
+        if profile is not None:
+            relation.set_cached_value(user, profile)
+            Profile.user.field.set_cached_value(profile, user)
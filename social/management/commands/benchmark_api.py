@@ -0,0 +1,174 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_test_environment
+from django.utils import timezone
+
+from social import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic social graph and replay weighted API traffic, reporting latency and queries per endpoint'
+
+    def add_arguments(self, parser):
+        seeding = parser.add_argument_group('seeding')
+        seeding.add_argument('--users', type=int, default=200)
+        seeding.add_argument('--follows', type=int, default=20, help='Follows per user')
+        seeding.add_argument('--posts', type=int, default=5, help='Posts per user')
+        seeding.add_argument('--comments', type=int, default=2, help='Comments per post')
+        seeding.add_argument('--likes', type=int, default=5, help='Likes per post')
+        seeding.add_argument('--messages', type=int, default=5, help='Messages sent per user')
+
+        traffic = parser.add_argument_group('traffic')
+        traffic.add_argument('--iterations', type=int, default=500, help='Scenarios to run in total')
+        traffic.add_argument('--threads', type=int, default=1, help='Concurrent clients')
+        traffic.add_argument('--scenarios', help='Comma-separated subset of the built-in scenarios')
+        traffic.add_argument('--replay', help='JSONL file of scenarios to run instead of the built-in ones')
+        traffic.add_argument('--random-seed', type=int, default=0)
+        traffic.add_argument('--throttle', action='store_true', help='Keep rate limiting on (in-process runs)')
+        traffic.add_argument('--encoding', default=benchmark.ACCEPT_ENCODING,
+                             help='Accept-Encoding sent with every request ("" for uncompressed responses)')
+
+        target = parser.add_argument_group('target')
+        target.add_argument('--url', help='Replay against a running server instead of in-process')
+        target.add_argument('--in-place', action='store_true',
+                            help='Use the configured database instead of a temporary SQLite file')
+        target.add_argument('--seed', action='store_true',
+                            help='Seed the configured database first (with --in-place or --url)')
+        target.add_argument('--output', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if not options['url'] and not options['in_place']:
+            return self.run_in_temporary_database(options)
+
+        if options['url'] is None:
+            setup_test_environment(debug=False)
+        rng = random.Random(options['random_seed'])
+        if options['seed']:
+            if not options['url']:
+                call_command('migrate', verbosity=0)
+            users = benchmark.seed(
+                users=options['users'], follows=options['follows'], posts=options['posts'],
+                comments=options['comments'], likes=options['likes'], messages=options['messages'], rng=rng,
+            )
+        else:
+            users = list(User.objects.filter(is_active=True).order_by('id')[:options['users']])
+        if not users:
+            raise CommandError('No users to sign in as; pass --seed')
+
+        scenarios = self.scenarios(options)
+        context = benchmark.Context(users)
+        if options['url']:
+            make_client = lambda token: benchmark.HttpClient(token, options['url'], options['encoding'])
+            recorder, wall = benchmark.replay(
+                scenarios, context, make_client, options['iterations'], options['threads'], options['random_seed']
+            )
+        else:
+            rates = None if options['throttle'] else {}
+            make_client = lambda token: benchmark.InProcessClient(token, options['encoding'])
+            with override_settings(**self.rest_framework_overrides(rates)):
+                recorder, wall = benchmark.replay(
+                    scenarios, context, make_client, options['iterations'], options['threads'], options['random_seed'],
+                )
+
+        results = {
+            'meta': self.meta(options, scenarios),
+            **benchmark.report(recorder, wall),
+        }
+        self.print_table(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+        return None
+
+    def run_in_temporary_database(self, options):
+        # Re-run in a child process whose settings point at a throwaway file.
+        # The child is started through ``python -m django`` with the options
+        # rebuilt here, so it works the same from manage.py, django-admin and
+        # call_command.
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, DB_ENGINE='sqlite', DB_REPLICAS='',
+                       DB_NAME=os.path.join(directory, 'benchmark.sqlite3'),
+                       DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+            command = [sys.executable, '-m', 'django', 'benchmark_api'] + self.child_arguments(options)
+            completed = subprocess.run(command, env=env, cwd=settings.BASE_DIR)
+        if completed.returncode:
+            raise CommandError(f'Benchmark run failed with exit code {completed.returncode}')
+
+    def child_arguments(self, options):
+        arguments = ['--in-place', '--seed', '--encoding', options['encoding']]
+        for key in ('users', 'follows', 'posts', 'comments', 'likes', 'messages',
+                    'iterations', 'threads', 'random_seed'):
+            arguments += ['--' + key.replace('_', '-'), str(options[key])]
+        if options['scenarios']:
+            arguments += ['--scenarios', options['scenarios']]
+        # The child runs from BASE_DIR, so paths are resolved here
+        for key in ('replay', 'output'):
+            if options[key]:
+                arguments += ['--' + key, os.path.abspath(options[key])]
+        if options['throttle']:
+            arguments.append('--throttle')
+        if options['verbosity'] != 1:
+            arguments += ['--verbosity', str(options['verbosity'])]
+        return arguments
+
+    def scenarios(self, options):
+        if options['replay']:
+            return benchmark.load_scenarios(options['replay'])
+        scenarios = benchmark.SCENARIOS
+        if options['scenarios']:
+            names = options['scenarios'].split(',')
+            unknown = set(names) - {scenario['name'] for scenario in scenarios}
+            if unknown:
+                raise CommandError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+            scenarios = [scenario for scenario in scenarios if scenario['name'] in names]
+        return scenarios
+
+    def rest_framework_overrides(self, rates):
+        if rates is None:
+            return {}
+        return {'REST_FRAMEWORK': {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}}
+
+    def meta(self, options, scenarios):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR,
+            ).stdout.strip() or None
+        except OSError:
+            commit = None
+        return {
+            'started_at': timezone.now().isoformat(),
+            'commit': commit,
+            'target': options['url'] or 'in-process',
+            'database': settings.DATABASES['default']['ENGINE'],
+            'iterations': options['iterations'],
+            'threads': options['threads'],
+            'accept_encoding': options['encoding'] or None,
+            'seed': {key: options[key] for key in ('users', 'follows', 'posts', 'comments', 'likes', 'messages')}
+            if options['seed'] else None,
+            'scenarios': {scenario['name']: scenario.get('weight', 1) for scenario in scenarios},
+        }
+
+    def print_table(self, results):
+        self.stdout.write(
+            f'{"endpoint":<44}{"reqs":>6}{"err":>5}{"rps":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}'
+            f'{"KB":>9}{"wire KB":>9}{"saved":>7}'
+        )
+        rows = list(results['endpoints'].items()) + [('TOTAL', results['total'])]
+        for endpoint, row in rows:
+            queries = '-' if row['queries_per_request'] is None else f'{row["queries_per_request"]:.1f}'
+            saved = '-' if row['bytes_saved'] is None else f'{row["bytes_saved"]:.0%}'
+            self.stdout.write(
+                f'{endpoint:<44}{row["requests"]:>6}{row["errors"]:>5}{row["rps"]:>9.1f}'
+                f'{row["p50_ms"]:>9.1f}{row["p95_ms"]:>9.1f}{row["p99_ms"]:>9.1f}{queries:>9}'
+                f'{row["bytes_per_request"] / 1024:>9.1f}{row["wire_bytes_per_request"] / 1024:>9.1f}{saved:>7}'
+            )
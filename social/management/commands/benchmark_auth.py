@@ -0,0 +1,74 @@
+import base64
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from social import authentication
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of each authentication class'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per JWT mode')
+        parser.add_argument('--basic-requests', type=int, default=10,
+                            help='Requests for Basic authentication, which hashes the password each time')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                rows = self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f'{"mode":<16}{"us/request":>12}{"queries/request":>17}')
+        for mode, micros, queries in rows:
+            self.stdout.write(f'{mode:<16}{micros:>12.1f}{queries:>17.2f}')
+
+    def run(self, options):
+        user = User.objects.create_user('bench-auth', password='bench-pass-1')
+        access = str(authentication.tokens_for(user).access_token)
+        bearer = f'Bearer {access}'
+        basic = 'Basic ' + base64.b64encode(b'bench-auth:bench-pass-1').decode()
+        authentication.denylist.min_version(user.id)
+
+        def claims_cold():
+            authentication.token_cache.clear()
+            return authentication.ClaimsJWTAuthentication()
+
+        modes = [
+            ('basic', BasicAuthentication, basic, options['basic_requests']),
+            ('jwt', JWTAuthentication, bearer, options['requests']),
+            ('claims-cold', claims_cold, bearer, options['requests']),
+            ('claims', authentication.ClaimsJWTAuthentication, bearer, options['requests']),
+        ]
+        return [(mode, *self.measure(factory, header, count)) for mode, factory, header, count in modes]
+
+    def measure(self, authenticator, header, count):
+        """
+        Average microseconds and queries to authenticate one request, including
+        reading request.user.id as every view does
+        """
+        factory = APIRequestFactory()
+        requests = [factory.get('/api/posts/feed/', HTTP_AUTHORIZATION=header) for _ in range(count)]
+        elapsed = 0.0
+        with CaptureQueriesContext(connection) as queries:
+            for django_request in requests:
+                backend = authenticator()
+                started = time.perf_counter()
+                request = Request(django_request, authenticators=[backend])
+                request.user.id
+                elapsed += time.perf_counter() - started
+        return elapsed / count * 1e6, len(queries.captured_queries) / count
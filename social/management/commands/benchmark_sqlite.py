@@ -0,0 +1,130 @@
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIClient
+
+from social.models import Post
+
+# Environment of each mode; every run gets a fresh database file
+MODES = {
+    'stock': {'DB_SQLITE_TUNED': '0'},
+    'tuned': {'DB_SQLITE_TUNED': '1', 'DB_SQLITE_SERIALIZE_WRITES': '0'},
+    'serialized': {'DB_SQLITE_TUNED': '1', 'DB_SQLITE_SERIALIZE_WRITES': '1'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare mixed read/write API throughput on stock and tuned SQLite settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default='stock,tuned,serialized',
+                            help=f'Comma-separated modes out of: {", ".join(MODES)}')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=100, help='Requests per client')
+        parser.add_argument('--write-ratio', type=float, default=0.3, help='Share of requests that write')
+        parser.add_argument('--run-one', action='store_true', help='Internal: benchmark the current settings')
+
+    def handle(self, *args, **options):
+        if options['run_one']:
+            self.stdout.write(json.dumps(self.run_one(options)))
+            return
+
+        rows = []
+        for mode in options['modes'].split(','):
+            with tempfile.TemporaryDirectory() as directory:
+                # python -m django rather than sys.argv[0], which isn't
+                # manage.py under call_command or django-admin
+                env = dict(os.environ, DB_ENGINE='sqlite', DB_REPLICAS='',
+                           DB_NAME=os.path.join(directory, 'bench.sqlite3'),
+                           DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE, **MODES[mode])
+                output = subprocess.run(
+                    [sys.executable, '-m', 'django', 'benchmark_sqlite', '--run-one',
+                     '--threads', str(options['threads']), '--requests', str(options['requests']),
+                     '--write-ratio', str(options['write_ratio'])],
+                    env=env, cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+                ).stdout
+            rows.append((mode, json.loads(output.strip().splitlines()[-1])))
+
+        self.stdout.write(f'{"mode":<12}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"errors":>8}')
+        for mode, result in rows:
+            self.stdout.write(
+                f'{mode:<12}{result["throughput"]:>10.1f}{result["p50_ms"]:>10.1f}'
+                f'{result["p95_ms"]:>10.1f}{result["errors"]:>8}'
+            )
+
+    def run_one(self, options):
+        setup_test_environment(debug=False)
+        call_command('migrate', verbosity=0)
+        users = [User.objects.create_user(f'bench{i}', password='bench-pass-1') for i in range(options['threads'] * 2)]
+        posts = [Post.objects.create(author=random.choice(users), content=f'post {i}') for i in range(200)]
+        post_ids = [post.id for post in posts]
+
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def client_loop(user, seed):
+            rng = random.Random(seed)
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    try:
+                        response = self.request(client, rng, users, post_ids, options['write_ratio'])
+                        failed = response.status_code >= 500
+                    except OperationalError:
+                        failed = True
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        if failed:
+                            errors.append(1)
+            finally:
+                close_old_connections()
+
+        threads = [
+            threading.Thread(target=client_loop, args=(users[i], i)) for i in range(options['threads'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'engine': settings.DATABASES['default']['ENGINE'],
+            'requests': len(latencies),
+            'throughput': len(latencies) / wall,
+            'p50_ms': statistics.median(latencies) * 1000,
+            'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+            'errors': len(errors),
+        }
+
+    def request(self, client, rng, users, post_ids, write_ratio):
+        post_id = rng.choice(post_ids)
+        if rng.random() >= write_ratio:
+            return rng.choice([
+                lambda: client.get('/api/posts/feed/'),
+                lambda: client.get('/api/posts/explore/'),
+                lambda: client.get(f'/api/posts/{post_id}/'),
+            ])()
+        return rng.choice([
+            lambda: client.put(f'/api/posts/{post_id}/like/'),
+            lambda: client.delete(f'/api/posts/{post_id}/like/'),
+            lambda: client.post('/api/messages/', {'receiver': rng.choice(users).id, 'content': 'hi'}),
+        ])()
@@ -0,0 +1,51 @@
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from social import images
+
+
+class Command(BaseCommand):
+    # The image pipeline deletes files as rows let go of them; this catches
+    # what it can't (crashed jobs, files re-stored while being discarded).
+    # Run it daily, e.g. from cron.
+    help = 'Delete uploaded files and image variants that no post or profile references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Keep files younger than this; they may belong to a request in flight')
+        parser.add_argument('--dry-run', action='store_true', help='Only list what would be deleted')
+
+    def handle(self, *args, **options):
+        referenced = set()
+        directories = set()
+        for model, spec in images.SPECS.items():
+            directories.add(model._meta.get_field(spec.field).upload_to.strip('/'))
+            for name, variants in model.objects.exclude(**{spec.field: ''}).values_list(
+                spec.field, spec.column('variants')
+            ).iterator():
+                referenced.add(name)
+                referenced.update(item['name'] for item in (variants or {}).get('items', ()))
+
+        cutoff = time.time() - options['grace_hours'] * 3600
+        deleted = freed = 0
+        for directory in sorted(directories):
+            root = default_storage.path(directory)
+            for current, _, files in os.walk(root):
+                for filename in files:
+                    full_path = os.path.join(current, filename)
+                    name = os.path.relpath(full_path, default_storage.location).replace('\\', '/')
+                    stat = os.stat(full_path)
+                    if name in referenced or stat.st_mtime > cutoff:
+                        continue
+                    if options['verbosity'] > 1 or options['dry_run']:
+                        self.stdout.write(name)
+                    if not options['dry_run']:
+                        os.unlink(full_path)
+                    deleted += 1
+                    freed += stat.st_size
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{action} {deleted} file(s), {freed / 1024 / 1024:.1f} MB'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from social import images
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized variants of uploaded images that have not been processed yet'
+
+    def handle(self, *args, **options):
+        for model, spec in images.SPECS.items():
+            processed = failed = 0
+            rows = model.objects.exclude(**{spec.field: ''}).exclude(**{f'{spec.field}__isnull': True})
+            for instance in rows.iterator():
+                if not images.needs_processing(instance):
+                    continue
+                try:
+                    processed += images.process(model, instance.pk)
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'{model.__name__} {instance.pk}: {exc}')
+            self.stdout.write(self.style.SUCCESS(
+                f'Processed {processed} {model._meta.verbose_name} image(s), {failed} failed'
+            ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from social import conversations
+from social.models import Conversation
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the conversation inbox rows from the messages table'
+
+    def handle(self, *args, **options):
+        conversations.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {Conversation.objects.count()} conversation row(s)'))
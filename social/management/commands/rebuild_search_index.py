@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from social import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for users, posts and comments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Objects loaded per query')
+
+    def handle(self, *args, **options):
+        indexed = search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} object(s)'))
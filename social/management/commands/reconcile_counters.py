@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from social import cache, counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized like/repost/comment/follow counters and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows checked per query')
+
+    def handle(self, *args, **options):
+        total = 0
+        for model, counter, expression in counters.counter_sources():
+            corrected = counters.reconcile(model, counter, expression, batch_size=options['batch_size'])
+            total += corrected
+            self.stdout.write(f'{model.__name__}.{counter}: {corrected} row(s) corrected')
+        if total:
+            # Corrections bypass the signals that evict cached fragments
+            cache.invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f'Reconciled counters, {total} row(s) corrected'))
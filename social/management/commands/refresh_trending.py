@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from social import trending
+
+
+class Command(BaseCommand):
+    help = 'Expire old posts from the explore ranking and trim it to the configured pool size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Reseed the pool from post counters first')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            seeded = trending.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt trending pool with {seeded} post(s)'))
+            return
+        expired, trimmed = trending.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Removed {expired} expired and {trimmed} trimmed post(s)'))
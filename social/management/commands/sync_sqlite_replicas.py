@@ -0,0 +1,29 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database onto the configured replica files (local replica testing)'
+
+    def handle(self, *args, **options):
+        primary = connections['default'].settings_dict
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be synced with this command')
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No replicas configured; set DB_REPLICAS to a list of SQLite files')
+
+        source = sqlite3.connect(primary['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f'{alias}: copied from {primary["NAME"]}')
+        finally:
+            source.close()
+        self.stdout.write(self.style.SUCCESS(f'Synced {len(settings.DATABASE_REPLICAS)} replica(s)'))
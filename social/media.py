@@ -0,0 +1,133 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+from .storage import TEMPORARY_PREFIX, content_hash
+
+# Serves MEDIA_ROOT in place of django.views.static.serve: conditional GETs,
+# single byte ranges (video scrubbing, resumed downloads) and FileResponse,
+# which hands the open file to the server's wsgi.file_wrapper so servers
+# with sendfile() copy it without passing through Python. With
+# MEDIA_ACCEL_REDIRECT set, nginx is told to send the file itself.
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def etag_for(name, stat):
+    digest = content_hash(name)
+    if digest:
+        return f'"{digest}"'
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    ``(start, end)`` inclusive for a single satisfiable range, None when the
+    header is absent or not understood (serve the whole file), or False when
+    it can't be satisfied
+    """
+    match = RANGE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def read_range(file, start, length, block_size=FileResponse.block_size):
+    try:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+@require_safe
+def serve(request, path):
+    if os.path.basename(path).startswith(TEMPORARY_PREFIX):
+        raise Http404('Not found')
+    try:
+        full_path = default_storage.path(path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+
+    etag = etag_for(path, stat)
+    immutable = content_hash(path) is not None
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': IMMUTABLE if immutable else 'public, max-age=0, must-revalidate',
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    size = stat.st_size
+    byte_range = parse_range(request.headers.get('Range'), size)
+    if_range = request.headers.get('If-Range')
+    if byte_range is not None and if_range and if_range.strip() != etag:
+        # The client's partial copy is of another version
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    accel = getattr(settings, 'MEDIA_ACCEL_REDIRECT', '')
+    if accel:
+        # nginx serves the file (and the range) from an internal location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f'{accel.rstrip("/")}/{path.lstrip("/")}'
+    elif byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        file = open(full_path, 'rb')
+        if end == size - 1:
+            # Open-ended ranges still go through the file wrapper
+            file.seek(start)
+            response = FileResponse(file, status=206, content_type=content_type)
+        else:
+            response = StreamingHttpResponse(read_range(file, start, length), status=206, content_type=content_type)
+            response['Content-Length'] = length
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
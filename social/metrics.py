@@ -0,0 +1,362 @@
+import bisect
+import cProfile
+import functools
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+# Every request is recorded under the view action that served it, e.g.
+# ``PostViewSet.feed``: latency, query count, time spent in the database, in
+# serializers and in rendering the response body, and response size, each aggregated into a histogram of
+# this process. Queries are also fingerprinted (literals stripped) so that
+# one statement repeated many times within a request - the N+1 pattern - is
+# counted and logged. /metrics exposes everything in the Prometheus text
+# format.
+
+DEFAULT_DUPLICATE_THRESHOLD = 3
+DEFAULT_MAX_FINGERPRINTS = 200
+DEFAULT_SLOW_REQUEST_MS = 500
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram as Prometheus expects it
+    """
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+
+HISTOGRAMS = OrderedDict([
+    ('social_http_request_duration_seconds', ('Time to serve a request', SECONDS_BUCKETS)),
+    ('social_db_queries_per_request', ('SQL queries run by a request', QUERY_BUCKETS)),
+    ('social_db_duration_seconds', ('Time a request spent waiting for SQL queries', SECONDS_BUCKETS)),
+    ('social_serializer_duration_seconds', ('Time a request spent in serializers', SECONDS_BUCKETS)),
+    ('social_render_duration_seconds', ('Time a request spent rendering its response body', SECONDS_BUCKETS)),
+    ('social_http_response_size_bytes', ('Size of the response body', BYTES_BUCKETS)),
+])
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.histograms = {}
+        self.requests = Counter()
+        self.duplicates = Counter()
+        self.fingerprints = Counter()
+        self.statements = {}
+        self.profiles = Counter()
+
+    def reset(self):
+        with self.lock:
+            self.clear()
+
+    def record(self, endpoint, method, status, sample, repeated):
+        values = {
+            'social_http_request_duration_seconds': sample.duration,
+            'social_db_queries_per_request': sample.queries,
+            'social_db_duration_seconds': sample.db_time,
+            'social_serializer_duration_seconds': sample.serializer_time,
+            'social_render_duration_seconds': sample.render_time,
+            'social_http_response_size_bytes': sample.size,
+        }
+        limit = getattr(settings, 'METRICS_MAX_FINGERPRINTS', DEFAULT_MAX_FINGERPRINTS)
+        with self.lock:
+            self.requests[(endpoint, method, str(status))] += 1
+            for name, value in values.items():
+                if value is None:
+                    continue
+                key = (name, endpoint)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+                self.histograms[key].observe(value)
+            for fingerprint, (statement, count) in repeated.items():
+                self.duplicates[endpoint] += count - 1
+                key = (endpoint, fingerprint)
+                # Bounded, so an unlucky query shape can't grow the label set forever
+                if key in self.fingerprints or len(self.fingerprints) < limit:
+                    self.fingerprints[key] += 1
+                    self.statements[fingerprint] = statement
+
+    def profiled(self, endpoint):
+        with self.lock:
+            self.profiles[endpoint] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'histograms': {key: (list(h.cumulative()), h.sum, h.count) for key, h in self.histograms.items()},
+                'requests': dict(self.requests),
+                'duplicates': dict(self.duplicates),
+                'fingerprints': dict(self.fingerprints),
+                'statements': dict(self.statements),
+                'profiles': dict(self.profiles),
+            }
+
+
+registry = Registry()
+
+
+# Queries
+
+_literals = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def normalize(sql):
+    """
+    The shape of a statement: literals and placeholder lists collapsed, so
+    ``WHERE id = 1`` and ``WHERE id = 2`` compare equal
+    """
+    for pattern, replacement in _literals:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class Sample:
+    """
+    What one request did
+    """
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = 0
+        self.render_time = 0.0
+        self.statements = Counter()
+        self.duration = None
+        self.size = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook; statements are only normalized
+        # once the request is over
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def repeated(self):
+        """
+        ``{fingerprint: (normalized statement, count)}`` of the statement
+        shapes run at least METRICS_DUPLICATE_QUERY_THRESHOLD times
+        """
+        threshold = getattr(settings, 'METRICS_DUPLICATE_QUERY_THRESHOLD', DEFAULT_DUPLICATE_THRESHOLD)
+        shapes = {}
+        for sql, count in self.statements.items():
+            statement = normalize(sql)
+            shape = hashlib.sha1(statement.encode()).hexdigest()[:12]
+            previous = shapes.get(shape, (statement, 0))[1]
+            shapes[shape] = (statement, previous + count)
+        return {shape: found for shape, found in shapes.items() if found[1] >= threshold}
+
+
+def timed_serializer(to_representation):
+    """
+    Count ``to_representation`` as serializer time of the current request.
+    Nested serializers run inside the outermost call, which alone is timed.
+    """
+    @functools.wraps(to_representation)
+    def wrapper(serializer, data):
+        sample = _current.get()
+        if sample is None or sample.serializing:
+            return to_representation(serializer, data)
+        sample.serializing += 1
+        started = time.perf_counter()
+        try:
+            return to_representation(serializer, data)
+        finally:
+            sample.serializing -= 1
+            sample.serializer_time += time.perf_counter() - started
+    return wrapper
+
+
+@contextmanager
+def rendering():
+    """
+    Count the enclosed block as rendering time of the current request; the
+    renderers wrap their ``render`` in it
+    """
+    sample = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if sample is not None:
+            sample.render_time += time.perf_counter() - started
+
+
+# Requests
+
+def endpoint_of(view_func, method):
+    """
+    ``ViewSet.action`` for viewsets, the class name for other class-based
+    views and the function name otherwise
+    """
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__name__', 'unknown')
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        action = actions.get(method.lower())
+        if action:
+            return f'{cls.__name__}.{action}'
+    return cls.__name__
+
+
+_profiler_lock = threading.Lock()
+
+
+def should_profile():
+    rate = getattr(settings, 'METRICS_PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and random.random() < rate
+
+
+def save_profile(profiler, endpoint, duration):
+    directory = settings.METRICS_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{endpoint}-{int(duration * 1000)}ms.prof')
+    profiler.dump_stats(path)
+    registry.profiled(endpoint)
+    logger.warning('Slow request to %s took %.0f ms, profile saved to %s', endpoint, duration * 1000, path)
+    return path
+
+
+def measure(request, get_response):
+    """
+    Run the rest of the middleware chain and the view, recording the request
+    """
+    sample = Sample()
+    token = _current.set(sample)
+    profiler = None
+    if should_profile() and _profiler_lock.acquire(blocking=False):
+        # Only one profiler can be active in a process at a time
+        profiler = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(sample))
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        sample.duration = time.perf_counter() - started
+        endpoint = getattr(request, 'metrics_endpoint', 'unresolved')
+        if not response.streaming:
+            sample.size = len(response.content)
+        repeated = sample.repeated()
+        registry.record(endpoint, request.method, response.status_code, sample, repeated)
+        for statement, count in repeated.values():
+            logger.info('%s ran %d times in one request to %s', statement, count, endpoint)
+        slow = getattr(settings, 'METRICS_SLOW_REQUEST_MS', DEFAULT_SLOW_REQUEST_MS) / 1000
+        if profiler is not None and sample.duration >= slow:
+            response['X-Profile'] = os.path.basename(save_profile(profiler, endpoint, sample.duration))
+        return response
+    finally:
+        if profiler is not None:
+            _profiler_lock.release()
+        _current.reset(token)
+
+
+# Exposition
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_label(value)}"' for name, value in labels.items()) + '}'
+
+
+def render():
+    """
+    Everything recorded by this process in the Prometheus text format
+    """
+    snapshot = registry.snapshot()
+    lines = []
+
+    def family(name, kind, description):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    family('social_http_requests_total', 'counter', 'Requests served, by endpoint, method and status')
+    for (endpoint, method, status), value in sorted(snapshot['requests'].items()):
+        lines.append(f'social_http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {value}')
+
+    for name, (description, _) in HISTOGRAMS.items():
+        family(name, 'histogram', description)
+        for (metric, endpoint), (buckets, total, count) in sorted(snapshot['histograms'].items()):
+            if metric != name:
+                continue
+            for bound, cumulative in buckets:
+                lines.append(f'{name}_bucket{_labels(endpoint=endpoint, le=bound)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(endpoint=endpoint)} {total}')
+            lines.append(f'{name}_count{_labels(endpoint=endpoint)} {count}')
+
+    family('social_db_duplicate_queries_total', 'counter',
+           'Queries that repeated a statement already run by the same request (N+1 suspects)')
+    for endpoint, value in sorted(snapshot['duplicates'].items()):
+        lines.append(f'social_db_duplicate_queries_total{_labels(endpoint=endpoint)} {value}')
+
+    family('social_db_repeated_statement_requests_total', 'counter',
+           'Requests that ran one statement shape at least METRICS_DUPLICATE_QUERY_THRESHOLD times')
+    for (endpoint, shape), value in sorted(snapshot['fingerprints'].items()):
+        labels = _labels(endpoint=endpoint, fingerprint=shape, statement=snapshot['statements'][shape][:200])
+        lines.append(f'social_db_repeated_statement_requests_total{labels} {value}')
+
+    family('social_profiles_saved_total', 'counter', 'cProfile dumps kept for slow sampled requests')
+    for endpoint, value in sorted(snapshot['profiles'].items()):
+        lines.append(f'social_profiles_saved_total{_labels(endpoint=endpoint)} {value}')
+
+    family('social_fragment_cache_events_total', 'counter', 'Fragment cache lookups and invalidations')
+    for kind, counts in cache.stats().items():
+        for event in ('hits', 'misses', 'invalidations'):
+            lines.append(f'social_fragment_cache_events_total{_labels(kind=kind, event=event)} {counts[event]}')
+
+    return '\n'.join(lines) + '\n'
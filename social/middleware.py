@@ -0,0 +1,123 @@
+import math
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from . import compression, db_router, metrics
+from .authentication import ClaimsJWTAuthentication
+
+
+@database_sync_to_async
+def get_user_for_token(raw_token):
+    authentication = ClaimsJWTAuthentication()
+    try:
+        validated = authentication.get_validated_token(raw_token)
+        return authentication.get_user(validated)
+    except (InvalidToken, AuthenticationFailed):
+        return AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticate WebSocket connections with the same access tokens as the REST API.
+
+    The token is read from the ``token`` query parameter (browsers cannot set
+    headers on WebSocket handshakes) or from an ``Authorization: Bearer`` header.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        raw_token = self.get_raw_token(scope)
+        scope['user'] = await get_user_for_token(raw_token) if raw_token else AnonymousUser()
+        return await super().__call__(scope, receive, send)
+
+    def get_raw_token(self, scope):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        if query.get('token'):
+            return query['token'][0]
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                parts = value.decode().split()
+                if len(parts) == 2 and parts[0].lower() == 'bearer':
+                    return parts[1]
+        return None
+
+
+class DatabaseRoutingMiddleware:
+    """
+    Scope replica routing to one request, and pin users who wrote something
+    to the primary for a few seconds so they read their own writes
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with db_router.request_scope() as state:
+            response = self.get_response(request)
+            # DRF copies the authenticated (e.g. JWT) user onto the request
+            user = getattr(request, 'user', None)
+            if state.wrote and user is not None and user.is_authenticated:
+                db_router.pin_to_primary(user.id)
+        return response
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Report the throttle budget the request was counted against (see
+    throttling.py) in RateLimit-* headers, so clients can slow down before
+    they are refused
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            scope, period, decision = rate_limit
+            response['RateLimit-Policy'] = f'{decision.capacity};w={period};name="{scope}"'
+            response['RateLimit-Limit'] = str(decision.capacity)
+            response['RateLimit-Remaining'] = str(decision.remaining)
+            response['RateLimit-Reset'] = str(math.ceil(decision.reset))
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Record latency, queries, serializer and render time and response size of every
+    request under the view action that served it (see metrics.py)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return self.get_response(request)
+        return metrics.measure(request, self.get_response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_endpoint = metrics.endpoint_of(view_func, request.method)
+
+
+class CompressionMiddleware:
+    """
+    gzip or brotli response bodies the client accepts (see compression.py).
+    First in MIDDLEWARE, so everything below it, metrics included, sees the
+    uncompressed response.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not compression.enabled():
+            return response
+        return compression.apply(request, response)
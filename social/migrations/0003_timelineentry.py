@@ -0,0 +1,50 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_timelines(apps, schema_editor):
+    Follow = apps.get_model('social', 'Follow')
+    Post = apps.get_model('social', 'Post')
+    TimelineEntry = apps.get_model('social', 'TimelineEntry')
+    for follower_id, following_id in Follow.objects.values_list('follower_id', 'following_id').iterator():
+        posts = Post.objects.filter(author_id=following_id).order_by('-created_at').values_list(
+            'id', 'created_at'
+        )[:200]
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user_id=follower_id, post_id=post_id, author_id=following_id, created_at=created_at)
+            for post_id, created_at in posts
+        ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0002_remove_profile_followers_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='message',
+            options={'ordering': ['-created_at']},
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='social.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', '-created_at'], name='timeline_user_created_idx'), models.Index(fields=['user', 'author'], name='timeline_user_author_idx')],
+                'unique_together': {('user', 'post')},
+            },
+        ),
+        migrations.RunPython(populate_timelines, migrations.RunPython.noop),
+    ]
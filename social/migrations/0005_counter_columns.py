@@ -0,0 +1,70 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:04
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, field, outer='pk'):
+    counts = queryset.filter(**{field: OuterRef(outer)}).order_by().values(field).annotate(
+        total=Count('*')
+    ).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('social', 'Post')
+    Comment = apps.get_model('social', 'Comment')
+    Profile = apps.get_model('social', 'Profile')
+    Follow = apps.get_model('social', 'Follow')
+    Post.objects.update(
+        likes_count=_count(Post.likes.through.objects.all(), 'post_id'),
+        reposts_count=_count(Post.reposts.through.objects.all(), 'post_id'),
+        comments_count=_count(Comment.objects.all(), 'post_id'),
+    )
+    Comment.objects.update(likes_count=_count(Comment.likes.through.objects.all(), 'comment_id'))
+    Profile.objects.update(
+        followers_count=_count(Follow.objects.all(), 'following_id', outer='user_id'),
+        following_count=_count(Follow.objects.all(), 'follower_id', outer='user_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0004_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reposts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:05
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_replies_count(apps, schema_editor):
+    Comment = apps.get_model('social', 'Comment')
+    counts = Comment.objects.filter(parent_id=OuterRef('pk')).order_by().values('parent_id').annotate(
+        total=Count('*')
+    ).values('total')
+    Comment.objects.update(replies_count=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0005_counter_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='replies_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_replies_count, migrations.RunPython.noop),
+    ]
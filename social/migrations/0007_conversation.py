@@ -0,0 +1,47 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_conversations(apps, schema_editor):
+    Message = apps.get_model('social', 'Message')
+    Conversation = apps.get_model('social', 'Conversation')
+    inbox = {}
+    for message in Message.objects.order_by('created_at', 'id').iterator():
+        for owner_id, other_id in ((message.sender_id, message.receiver_id), (message.receiver_id, message.sender_id)):
+            row = inbox.setdefault((owner_id, other_id), Conversation(owner_id=owner_id, other_id=other_id))
+            row.last_message_id = message.id
+            row.last_message_at = message.created_at
+        if not message.is_read:
+            inbox[(message.receiver_id, message.sender_id)].unread_count += 1
+    Conversation.objects.bulk_create(inbox.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0006_comment_replies_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='social.message')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-last_message_at'],
+                'indexes': [models.Index(fields=['owner', '-last_message_at', '-id'], name='conversation_inbox_idx')],
+                'unique_together': {('owner', 'other')},
+            },
+        ),
+        migrations.RunPython(populate_conversations, migrations.RunPython.noop),
+    ]
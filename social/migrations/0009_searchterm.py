@@ -0,0 +1,69 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:12
+
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations, models
+
+# A frozen copy of social.search.tokenize as of this migration, so later
+# changes to the tokenizer don't change what it writes
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 64
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall((text or '').lower())]
+
+
+def build_search_index(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Profile = apps.get_model('social', 'Profile')
+    Post = apps.get_model('social', 'Post')
+    Comment = apps.get_model('social', 'Comment')
+    SearchTerm = apps.get_model('social', 'SearchTerm')
+
+    def write(kind, object_id, fields):
+        weights = Counter()
+        for text, weight in fields:
+            for token in tokenize(text):
+                weights[token] += weight
+        SearchTerm.objects.bulk_create([
+            SearchTerm(kind=kind, object_id=object_id, term=term, weight=weight)
+            for term, weight in weights.items()
+        ])
+
+    bios = dict(Profile.objects.values_list('user_id', 'bio'))
+    for user in User.objects.iterator():
+        write('user', user.id, [
+            (user.username, 4), (user.first_name, 3), (user.last_name, 3), (bios.get(user.id), 1),
+        ])
+    for post_id, content in Post.objects.values_list('id', 'content').iterator():
+        write('post', post_id, [(content, 1)])
+    for comment_id, content in Comment.objects.values_list('id', 'content').iterator():
+        write('comment', comment_id, [(content, 1)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0008_message_unread_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'User'), ('post', 'Post'), ('comment', 'Comment')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField(default=1)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'term'], name='search_term_idx')],
+                'unique_together': {('kind', 'object_id', 'term')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
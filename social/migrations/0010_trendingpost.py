@@ -0,0 +1,66 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:14
+
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+# Frozen copies of social.trending's constants and score formula as of this
+# migration; the half-life and age cut-off still follow the settings, as the
+# scores written here have to match the ones the app adds to
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+POST_WEIGHT = 1.0
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 1.5
+REPOST_WEIGHT = 2.0
+
+
+def event_score(weight, when):
+    half_life = timedelta(hours=getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 12))
+    return math.log(weight) + (when - EPOCH) / half_life * math.log(2)
+
+
+def seed_trending(apps, schema_editor):
+    Post = apps.get_model('social', 'Post')
+    TrendingPost = apps.get_model('social', 'TrendingPost')
+    max_age = timedelta(hours=getattr(settings, 'TRENDING_MAX_AGE_HOURS', 72))
+    rows = []
+    for post in Post.objects.filter(created_at__gte=timezone.now() - max_age).iterator():
+        weight = (
+            POST_WEIGHT + LIKE_WEIGHT * post.likes_count
+            + REPOST_WEIGHT * post.reposts_count + COMMENT_WEIGHT * post.comments_count
+        )
+        rows.append(TrendingPost(
+            post_id=post.id, author_id=post.author_id, post_created_at=post.created_at,
+            score=event_score(weight, post.created_at),
+        ))
+    TrendingPost.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0009_searchterm'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingPost',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='social.post')),
+                ('score', models.FloatField()),
+                ('post_created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-score'],
+                'indexes': [models.Index(fields=['-score', '-post'], name='trending_score_idx')],
+            },
+        ),
+        migrations.RunPython(seed_trending, migrations.RunPython.noop),
+    ]
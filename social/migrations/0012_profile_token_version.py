@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-17 00:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0011_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='tokens_revoked_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations
+
+# Frozen copies of social.search's tokenizer and user weights as of this
+# migration, so later changes to them don't change what it writes
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 64
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall((text or '').lower())]
+
+
+def reindex_users(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Profile = apps.get_model('social', 'Profile')
+    SearchTerm = apps.get_model('social', 'SearchTerm')
+
+    bios = dict(Profile.objects.values_list('user_id', 'bio'))
+    for user in User.objects.iterator():
+        weights = Counter()
+        for text, weight in [
+            (user.username, 4), (user.first_name, 3), (user.last_name, 3),
+            ((user.email or '').rpartition('@')[0], 2), (bios.get(user.id), 1),
+        ]:
+            for token in tokenize(text):
+                weights[token] += weight
+        SearchTerm.objects.filter(kind='user', object_id=user.id).delete()
+        SearchTerm.objects.bulk_create([
+            SearchTerm(kind='user', object_id=user.id, term=term, weight=weight)
+            for term, weight in weights.items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0014_timeline_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(reindex_users, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,26 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+
+class CounterFieldsMixin:
+    """
+    Keep full ``save()`` calls from overwriting denormalized counters with
+    stale in-memory values; counters are only changed through F() updates.
+    ``derived_fields`` are left alone the same way: they are only written
+    with queryset updates (see images.py and authentication.py).
+    """
+    counter_fields = ()
+    derived_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+                and field.name not in self.derived_fields
+            ]
+        super().save(*args, **kwargs)
+
 class Follow(models.Model):
     follower = models.ForeignKey(User, related_name='following_relationships', on_delete=models.CASCADE)
     following = models.ForeignKey(User, related_name='follower_relationships', on_delete=models.CASCADE)
@@ -13,40 +33,104 @@ class Follow(models.Model):
     def __str__(self):
         return f"{self.follower.username} follows {self.following.username}"
 
-class Profile(models.Model):
+class Profile(CounterFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     bio = models.TextField(max_length=500, blank=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    # Filled in by the image pipeline in images.py
+    picture_width = models.PositiveIntegerField(null=True, blank=True)
+    picture_height = models.PositiveIntegerField(null=True, blank=True)
+    picture_placeholder = models.CharField(max_length=64, blank=True)
+    picture_variants = models.JSONField(default=dict, blank=True)
+    # Tokens carrying an older version are refused (see authentication.py)
+    token_version = models.PositiveIntegerField(default=0)
+    tokens_revoked_at = models.DateTimeField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized counters, maintained by the signals in signals.py
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
 
-    @property
-    def followers_count(self):
-        return self.user.follower_relationships.count()
-
-    @property
-    def following_count(self):
-        return self.user.following_relationships.count()
+    counter_fields = ('followers_count', 'following_count')
+    derived_fields = ('picture_width', 'picture_height', 'picture_placeholder', 'picture_variants',
+                      'token_version', 'tokens_revoked_at')
 
     def __str__(self):
         return self.user.username
 
-class Post(models.Model):
+class Post(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField()
     image = models.ImageField(upload_to='post_images/', blank=True, null=True)
+    # Filled in by the image pipeline in images.py
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_placeholder = models.CharField(max_length=64, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
     reposts = models.ManyToManyField(User, related_name='reposted_posts', blank=True)
+    # Denormalized counters, maintained by the signals in signals.py
+    likes_count = models.PositiveIntegerField(default=0)
+    reposts_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+
+    counter_fields = ('likes_count', 'reposts_count', 'comments_count')
+    derived_fields = ('image_width', 'image_height', 'image_placeholder', 'image_variants')
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+            models.Index(fields=['author', '-created_at', '-id'], name='post_author_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.author.username}'s post at {self.created_at}"
 
-class Comment(models.Model):
+class TimelineEntry(models.Model):
+    """
+    A post materialized into a follower's home timeline (fan-out on write)
+    """
+    user = models.ForeignKey(User, related_name='timeline_entries', on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='timeline_entries', on_delete=models.CASCADE)
+    author = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_created_idx'),
+            models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.post} in {self.user.username}'s timeline"
+
+class TrendingPost(models.Model):
+    """
+    A candidate of the explore feed. ``score`` is the log of the post's
+    time-decayed engagement relative to a fixed epoch (see trending.py), so
+    scores of different posts can be compared without ever being decayed.
+    """
+    post = models.OneToOneField(Post, primary_key=True, related_name='trending', on_delete=models.CASCADE)
+    author = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    score = models.FloatField()
+    post_created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-score']
+        indexes = [
+            models.Index(fields=['-score', '-post'], name='trending_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.post} ({self.score:.3f})"
+
+class Comment(CounterFieldsMixin, models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
     content = models.TextField()
@@ -54,6 +138,11 @@ class Comment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     likes = models.ManyToManyField(User, related_name='liked_comments', blank=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    # Denormalized counters, maintained by the signals in signals.py
+    likes_count = models.PositiveIntegerField(default=0)
+    replies_count = models.PositiveIntegerField(default=0)
+
+    counter_fields = ('likes_count', 'replies_count')
 
     class Meta:
         ordering = ['created_at']
@@ -70,6 +159,62 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['sender', 'receiver', '-created_at', '-id'], name='message_thread_idx'),
+            models.Index(
+                fields=['receiver', 'sender'], condition=models.Q(is_read=False), name='message_unread_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender.username} to {self.receiver.username}"
+
+class Conversation(models.Model):
+    """
+    A user's inbox entry for the direct-message thread with another user.
+    Every thread has one row per participant, kept up to date by signals.
+    """
+    owner = models.ForeignKey(User, related_name='conversations', on_delete=models.CASCADE)
+    other = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    last_message = models.ForeignKey(Message, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    # Moves whenever anything shown in the thread changes (see conversations.py)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('owner', 'other')
+        ordering = ['-last_message_at']
+        indexes = [
+            models.Index(fields=['owner', '-last_message_at', '-id'], name='conversation_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.owner.username}'s conversation with {self.other.username}"
+
+class SearchTerm(models.Model):
+    """
+    Inverted index entry: ``term`` occurs in the searchable text of one object
+    """
+    USER = 'user'
+    POST = 'post'
+    COMMENT = 'comment'
+    KIND_CHOICES = (
+        (USER, 'User'),
+        (POST, 'Post'),
+        (COMMENT, 'Comment'),
+    )
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    term = models.CharField(max_length=64)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('kind', 'object_id', 'term')
+        indexes = [
+            models.Index(fields=['kind', 'term'], name='search_term_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.kind} {self.object_id}"
@@ -0,0 +1,63 @@
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import conversations
+
+
+def user_group(user_id):
+    """
+    Channel layer group every WebSocket connection of a user joins
+    """
+    return f'user_{user_id}'
+
+
+def _plain(data):
+    # Channel layers that cross process boundaries only carry plain JSON types
+    return json.loads(json.dumps(data, cls=JSONEncoder))
+
+
+def notify(user_ids, event, data):
+    """
+    Push ``event`` to every connection of the given users once the current
+    transaction commits. Delivery is best effort: no layer means no push.
+    """
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    message = {'type': 'notify', 'event': event, 'data': _plain(data)}
+    recipients = {user_id for user_id in user_ids if user_id is not None}
+
+    def send():
+        for user_id in recipients:
+            async_to_sync(layer.group_send)(user_group(user_id), message)
+
+    transaction.on_commit(send)
+
+
+def message_event(event, message, serialized):
+    """
+    Message events go to both participants; the receiver also gets their new unread total
+    """
+    notify([message.sender_id], event, {'message': serialized})
+    notify([message.receiver_id], event, {'message': serialized, 'unread_count': conversations.unread_total(message.receiver_id)})
+
+
+def messages_read(reader_id, sender_ids_by_message):
+    """
+    Tell the reader's other devices and the original senders which messages were read
+    """
+    message_ids = sorted(sender_ids_by_message)
+    notify([reader_id], 'message.read', {
+        'reader_id': reader_id,
+        'message_ids': message_ids,
+        'unread_count': conversations.unread_total(reader_id),
+    })
+    for sender_id in set(sender_ids_by_message.values()):
+        notify([sender_id], 'message.read', {
+            'reader_id': reader_id,
+            'message_ids': [pk for pk in message_ids if sender_ids_by_message[pk] == sender_id],
+        })
@@ -0,0 +1,245 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import DateTimeField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on a unique, ordered tuple of columns.
+
+    Every page is a single range scan over ``ordering``: no COUNT query and
+    no OFFSET, so the cost of a page does not depend on how far the client
+    has scrolled. Cursors are opaque to clients.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    # The last field must be unique so that every row has a distinct position
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request, queryset.model)
+        self.reverse = reverse
+
+        ordering = self.get_ordering(reverse)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(ordering, position))
+
+        results = self.fetch(queryset, self.page_size + 1)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def fetch(self, queryset, limit):
+        return list(queryset[:limit])
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, reverse=False):
+        if not reverse:
+            return self.ordering
+        return tuple(field[1:] if field.startswith('-') else '-' + field for field in self.ordering)
+
+    def position_filter(self, ordering, position):
+        """
+        Build ``(a, b) < (x, y)`` style row comparison for the given ordering
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_position(self, item):
+        if isinstance(item, dict):
+            return [item[field.lstrip('-')] for field in self.ordering]
+        return [getattr(item, field.lstrip('-')) for field in self.ordering]
+
+    def parse_position(self, model, values):
+        fields = [model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+        if len(values) != len(fields):
+            raise ValueError('Cursor does not match the ordering')
+        return [field.to_python(value) for field, value in zip(fields, values)]
+
+    def encode_cursor(self, position, reverse=False):
+        payload = {'p': [
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in position
+        ]}
+        if reverse:
+            payload['r'] = 1
+        raw = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            payload = json.loads(raw)
+            position = self.parse_position(model, payload['p'])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(payload.get('r'))
+
+    def _link(self, cursor):
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.encode_cursor(self.get_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self._link(self.encode_cursor(self.get_position(self.page[0]), reverse=True))
+
+
+class OldestFirstKeysetPagination(KeysetPagination):
+    """
+    Keyset pagination in chronological order, used for comment replies
+    """
+    ordering = ('created_at', 'id')
+
+
+class TimelinePagination(KeysetPagination):
+    """
+    The home feed, newest first, keyed on the timeline entries rather than
+    the posts so that their ``(user, -created_at, -post)`` index serves both
+    the ordering and the cursor (see timeline.home_timeline)
+    """
+    ordering = ('-feed_created_at', '-feed_post_id')
+
+    def parse_position(self, model, values):
+        created_at, post_id = values
+        return [DateTimeField().to_python(created_at), int(post_id)]
+
+
+class ConversationPagination(KeysetPagination):
+    """
+    Inbox rows, most recently active first
+    """
+    ordering = ('-last_message_at', '-id')
+
+
+class SearchResultsPagination(KeysetPagination):
+    """
+    Ranked search hits, best score first; pages over aggregated rows
+    """
+    ordering = ('-score', '-object_id')
+
+    def parse_position(self, model, values):
+        score, object_id = values
+        return [int(score), int(object_id)]
+
+
+class TrendingPagination(KeysetPagination):
+    """
+    Pages through the explore candidate pool, best score first.
+
+    Candidates by ``exclude_authors`` are dropped in memory while scanning at
+    most ``scan_limit`` rows, instead of anti-joining against the follow graph.
+    A scan that stops at the limit still links onwards, from the last row it
+    read, even when the page came out short or empty.
+    """
+    ordering = ('-score', '-post_id')
+    scan_limit = 500
+    exclude_authors = frozenset()
+
+    def fetch(self, queryset, limit):
+        results = []
+        scanned, self.last_scanned = 0, None
+        for candidate in queryset[:self.scan_limit]:
+            scanned += 1
+            self.last_scanned = candidate
+            if candidate.author_id in self.exclude_authors:
+                continue
+            results.append(candidate)
+            if len(results) == limit:
+                break
+        self.truncated = len(results) < limit and scanned == self.scan_limit
+        return results
+
+    def paginate_queryset(self, queryset, request, view=None):
+        results = super().paginate_queryset(queryset, request, view)
+        if self.truncated:
+            if self.reverse:
+                self.has_previous = True
+            else:
+                self.has_next = True
+        return results
+
+    def get_next_link(self):
+        if self.truncated and not self.reverse:
+            return self._link(self.encode_cursor(self.get_position(self.last_scanned)))
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.truncated and self.reverse:
+            return self._link(self.encode_cursor(self.get_position(self.last_scanned), reverse=True))
+        return super().get_previous_link()
+
+
+class RecentExplorePagination(KeysetPagination):
+    """
+    Newest-first explore fallback. Its cursors travel in their own parameter,
+    so explore knows which listing a follow-up request continues.
+    """
+    cursor_query_param = 'recent_cursor'
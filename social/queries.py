@@ -0,0 +1,29 @@
+from django.db.models import Exists, OuterRef
+
+from .models import Comment, Post
+
+
+def comment_list_queryset(queryset=None):
+    """
+    Comments with everything CommentSerializer needs loaded up front
+    """
+    if queryset is None:
+        queryset = Comment.objects.all()
+    return queryset.select_related('author')
+
+
+def post_list_queryset(user=None, queryset=None):
+    """
+    The single query plan used for every endpoint that renders PostSerializer.
+
+    Counts are stored on the rows themselves (see counters.py) and the
+    bounded comment trees are loaded for the whole page by PostListSerializer.
+    """
+    if queryset is None:
+        queryset = Post.objects.all()
+    queryset = queryset.select_related('author__profile')
+    if user is not None and user.is_authenticated:
+        queryset = queryset.annotate(is_liked=Exists(
+            Post.likes.through.objects.filter(post_id=OuterRef('pk'), user_id=user.id)
+        ))
+    return queryset
@@ -0,0 +1,138 @@
+import re
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db.models import Case, IntegerField, Max, Q, Sum, Value, When
+
+from .models import Comment, Post, SearchTerm
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+# Upper bound for prefix range scans: every term starting with ``p`` sorts in [p, p + PREFIX_END)
+PREFIX_END = '\U0010ffff'
+
+# Relative importance of each searchable field
+USERNAME_WEIGHT = 4
+NAME_WEIGHT = 3
+EMAIL_WEIGHT = 2
+BIO_WEIGHT = 1
+CONTENT_WEIGHT = 1
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall((text or '').lower())]
+
+
+def _weighted_terms(fields):
+    """
+    Sum ``weight`` per term over ``(text, weight)`` pairs
+    """
+    weights = Counter()
+    for text, weight in fields:
+        for token in tokenize(text):
+            weights[token] += weight
+    return weights
+
+
+def _replace_terms(kind, object_id, weights):
+    """
+    Make the object's index rows match ``weights``, writing only the terms
+    that changed; saves that leave the indexed text alone cost one read
+    """
+    rows = SearchTerm.objects.filter(kind=kind, object_id=object_id)
+    current = dict(rows.values_list('term', 'weight'))
+    if current == weights:
+        return
+    stale = [term for term in current if term not in weights]
+    if stale:
+        rows.filter(term__in=stale).delete()
+    for term, weight in weights.items():
+        if term in current and current[term] != weight:
+            rows.filter(term=term).update(weight=weight)
+    SearchTerm.objects.bulk_create([
+        SearchTerm(kind=kind, object_id=object_id, term=term, weight=weight)
+        for term, weight in weights.items() if term not in current
+    ])
+
+
+def email_local_part(email):
+    # The domain would match everyone at the same provider
+    return (email or '').rpartition('@')[0]
+
+
+def index_user(user, bio=None):
+    if bio is None:
+        bio = user.profile.bio
+    _replace_terms(SearchTerm.USER, user.id, _weighted_terms([
+        (user.username, USERNAME_WEIGHT),
+        (user.first_name, NAME_WEIGHT),
+        (user.last_name, NAME_WEIGHT),
+        (email_local_part(user.email), EMAIL_WEIGHT),
+        (bio, BIO_WEIGHT),
+    ]))
+
+
+def index_post(post):
+    _replace_terms(SearchTerm.POST, post.id, _weighted_terms([(post.content, CONTENT_WEIGHT)]))
+
+
+def index_comment(comment):
+    _replace_terms(SearchTerm.COMMENT, comment.id, _weighted_terms([(comment.content, CONTENT_WEIGHT)]))
+
+
+def remove(kind, object_id):
+    SearchTerm.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def rebuild(batch_size=500):
+    """
+    Reindex every user, post and comment. Returns the number of objects indexed.
+    """
+    SearchTerm.objects.all().delete()
+    indexed = 0
+    for user in User.objects.select_related('profile').iterator(chunk_size=batch_size):
+        index_user(user)
+        indexed += 1
+    for post in Post.objects.only('id', 'content').iterator(chunk_size=batch_size):
+        index_post(post)
+        indexed += 1
+    for comment in Comment.objects.only('id', 'content').iterator(chunk_size=batch_size):
+        index_comment(comment)
+        indexed += 1
+    return indexed
+
+
+def _prefix(term):
+    return Q(term__gte=term, term__lt=term + PREFIX_END)
+
+
+def matches(kind, query):
+    """
+    Ranked hits for ``query``: rows of ``{'object_id', 'score'}``, best first.
+
+    Every query word must match the prefix of some indexed term of the object;
+    the score is the summed weight of the matching terms.
+    """
+    tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not tokens:
+        return SearchTerm.objects.none().values('object_id')
+
+    any_token = Q()
+    for token in tokens:
+        any_token |= _prefix(token)
+    hits = SearchTerm.objects.filter(any_token, kind=kind).values('object_id').annotate(
+        score=Sum('weight'),
+        **{
+            f'matched_{i}': Max(Case(When(_prefix(token), then=Value(1)), default=Value(0),
+                                     output_field=IntegerField()))
+            for i, token in enumerate(tokens)
+        },
+    )
+    for i in range(len(tokens)):
+        hits = hits.filter(**{f'matched_{i}': 1})
+    return hits.values('object_id', 'score')
+
+
+def matching_ids(kind, query):
+    return matches(kind, query).values('object_id')
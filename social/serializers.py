@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import models
 from django.contrib.auth.password_validation import validate_password
-from .models import Profile, Post, Comment, Message, Follow
+from .models import Profile, Post, Comment, Message, Follow, Conversation
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from . import cache, comment_tree, images, loaders, metrics
+from .compiled import CompiledSerializerMixin
 
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
@@ -22,15 +25,41 @@ class RegisterSerializer(serializers.ModelSerializer):
         user = User.objects.create_user(**validated_data)
         return user
 
-class ProfileSerializer(serializers.ModelSerializer):
+def _as_list(data):
+    iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+    return list(iterable)
+
+def profile_cache_key(profile):
+    # Follow counters are updated by user id, so profiles are cached under it too
+    return profile.user_id
+
+class ProfileListSerializer(serializers.ListSerializer):
+    @metrics.timed_serializer
+    def to_representation(self, data):
+        profiles = _as_list(data)
+        return cache.render_many(
+            'profile', profiles, self.render_missing, cache.request_variant(self.context),
+            key=profile_cache_key,
+        )
+
+    def render_missing(self, profiles):
+        loaders.prime_users(self.context, profiles, 'user')
+        return [self.child.render_shared(profile) for profile in profiles]
+
+class ProfileSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
     username = serializers.ReadOnlyField(source='user.username')
     followers_count = serializers.SerializerMethodField()
     following_count = serializers.SerializerMethodField()
+    picture_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Profile
-        fields = ('id', 'username', 'bio', 'profile_picture', 'followers_count', 'following_count', 'created_at', 'updated_at')
-        read_only_fields = ('id', 'created_at', 'updated_at')
+        fields = ('id', 'username', 'bio', 'profile_picture', 'picture_width', 'picture_height',
+                  'picture_placeholder', 'picture_srcset', 'followers_count', 'following_count',
+                  'created_at', 'updated_at')
+        read_only_fields = ('id', 'picture_width', 'picture_height', 'picture_placeholder',
+                            'created_at', 'updated_at')
+        list_serializer_class = ProfileListSerializer
 
     def get_followers_count(self, obj):
         return obj.followers_count or 0
@@ -38,85 +67,218 @@ class ProfileSerializer(serializers.ModelSerializer):
     def get_following_count(self, obj):
         return obj.following_count or 0
 
+    def get_picture_srcset(self, obj):
+        return images.srcset(obj, self.context.get('request'))
+
+    @metrics.timed_serializer
     def to_representation(self, instance):
+        return cache.render_one(
+            'profile', instance, self.render_shared, cache.request_variant(self.context),
+            key=profile_cache_key,
+        )
+
+    def render_shared(self, instance):
         """
         Ensure all fields are present and properly typed
         """
+        loaders.prime_users(self.context, [instance], 'user')
         data = super().to_representation(instance)
-        # Ensure required fields have default values
-        data['id'] = instance.id
-        data['followers_count'] = self.get_followers_count(instance)
-        data['following_count'] = self.get_following_count(instance)
+        # id and the counts are always rendered by the fields themselves
         data['bio'] = data.get('bio') or ''
         return data
 
-class UserSerializer(serializers.ModelSerializer):
+class UserListSerializer(serializers.ListSerializer):
+    @metrics.timed_serializer
+    def to_representation(self, data):
+        users = _as_list(data)
+        loaders.prime_profiles(self.context, users)
+        return super().to_representation(users)
+
+class UserSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
     profile = ProfileSerializer(read_only=True)
 
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'profile')
         read_only_fields = ('id',)
+        list_serializer_class = UserListSerializer
+
+    @metrics.timed_serializer
+    def to_representation(self, instance):
+        loaders.prime_profiles(self.context, [instance])
+        return super().to_representation(instance)
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentListSerializer(serializers.ListSerializer):
+    @metrics.timed_serializer
+    def to_representation(self, data):
+        comments = _as_list(data)
+        depth, width = comment_tree.limits(self.context)
+        # The listed comments are one level; load what is below them in bulk
+        comment_tree.attach_replies(comments, depth - 1, width)
+        loaders.prime_users(self.context, list(walk_comments(comments)), 'author')
+        return super().to_representation(comments)
+
+def walk_comments(comments):
+    """
+    Every comment of the loaded trees below ``comments``, including them
+    """
+    for comment in comments:
+        yield comment
+        yield from walk_comments(getattr(comment, 'tree_replies', ()))
+
+class CommentSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
     username = serializers.CharField(source='author.username', read_only=True)
-    likes_count = serializers.SerializerMethodField()
+    likes_count = serializers.IntegerField(read_only=True)
+    replies_count = serializers.IntegerField(read_only=True)
     replies = serializers.SerializerMethodField()
+    has_more_replies = serializers.SerializerMethodField()
+    replies_cursor = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
-        fields = ('id', 'post', 'username', 'content', 'created_at', 'updated_at', 'likes_count', 'replies')
+        fields = ('id', 'post', 'username', 'content', 'created_at', 'updated_at', 'likes_count',
+                  'replies_count', 'replies', 'has_more_replies', 'replies_cursor')
         read_only_fields = ('id', 'created_at', 'updated_at')
-
-    def get_likes_count(self, obj):
-        return obj.likes.count()
+        list_serializer_class = CommentListSerializer
 
     def get_replies(self, obj):
-        replies = Comment.objects.filter(parent=obj)
-        return CommentSerializer(replies, many=True).data
+        if not hasattr(obj, 'tree_replies'):
+            depth, width = comment_tree.limits(self.context)
+            comment_tree.attach_replies([obj], depth - 1, width)
+        # Deeper levels were loaded together with their parents
+        return comment_list(self).to_representation(obj.tree_replies)
+
+    def get_has_more_replies(self, obj):
+        return comment_tree.has_more_replies(obj)
+
+    def get_replies_cursor(self, obj):
+        if not comment_tree.has_more_replies(obj):
+            return None
+        return comment_tree.replies_cursor(obj)
+
+def comment_list(parent):
+    """
+    One comment list serializer per parent serializer, so the comments of a
+    whole page share their fields (and compiled plan) instead of rebuilding
+    them for every post or comment
+    """
+    serializer = parent.__dict__.get('_comment_list')
+    if serializer is None:
+        serializer = parent.__dict__['_comment_list'] = CommentSerializer(many=True, context=parent.context)
+    return serializer
+
+def post_dependencies(post):
+    # author_username is rendered into the fragment
+    return [('user', post.author_id)]
+
+class PostListSerializer(serializers.ListSerializer):
+    @metrics.timed_serializer
+    def to_representation(self, data):
+        posts = _as_list(data)
+        child = self.child
+        rendered = cache.render_many(
+            'post', posts, self.render_missing, child.fragment_variant(), post_dependencies
+        )
+        for post, item in zip(posts, rendered):
+            child.add_viewer_fields(post, item)
+        return rendered
+
+    def render_missing(self, posts):
+        comment_tree.attach_post_comments(posts, *comment_tree.limits(self.context))
+        prime_post_authors(self.context, posts)
+        return [self.child.render_shared(post) for post in posts]
+
+def prime_post_authors(context, posts):
+    # Post and comment authors in one query, then the post authors' profiles
+    comments = walk_comments(
+        comment for post in posts for comment in getattr(post, 'tree_comments', ())
+    )
+    loaders.prime_users(context, list(posts) + list(comments), 'author')
+    loaders.prime_profiles(context, [post.author for post in posts])
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
     author_username = serializers.CharField(source='author.username', read_only=True)
     author_user_id = serializers.ReadOnlyField(source='author.id')
     author_profile_id = serializers.ReadOnlyField(source='author.profile.id')
-    likes_count = serializers.SerializerMethodField()
-    reposts_count = serializers.SerializerMethodField()
-    comments_count = serializers.SerializerMethodField()
+    likes_count = serializers.IntegerField(read_only=True)
+    reposts_count = serializers.IntegerField(read_only=True)
+    comments_count = serializers.IntegerField(read_only=True)
     comments = serializers.SerializerMethodField()
+    has_more_comments = serializers.SerializerMethodField()
+    comments_cursor = serializers.SerializerMethodField()
     is_liked = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         fields = ('id', 'author_username', 'author_user_id', 'author_profile_id', 'content', 'image', 
+                 'image_width', 'image_height', 'image_placeholder', 'image_srcset',
                  'created_at', 'updated_at', 'likes_count', 'reposts_count', 'comments_count', 
-                 'comments', 'is_liked')
+                 'comments', 'has_more_comments', 'comments_cursor', 'is_liked')
         read_only_fields = ('id', 'author_username', 'author_user_id', 'author_profile_id', 
+                          'image_width', 'image_height', 'image_placeholder',
                           'created_at', 'updated_at', 'is_liked')
+        list_serializer_class = PostListSerializer
 
-    def get_likes_count(self, obj):
-        return obj.likes.count()
+    # Fields that depend on who is asking; everything else is cached per post
+    viewer_fields = ('is_liked',)
 
-    def get_reposts_count(self, obj):
-        return obj.reposts.count()
-
-    def get_comments_count(self, obj):
-        return obj.comments.count()
+    @property
+    def _readable_fields(self):
+        for field in super()._readable_fields:
+            if field.field_name not in self.viewer_fields:
+                yield field
 
     def get_is_liked(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            # Annotated by queries.post_list_queryset; query only when missing
+            is_liked = getattr(obj, 'is_liked', None)
+            if is_liked is not None:
+                return is_liked
             return obj.likes.filter(id=request.user.id).exists()
         return False
 
+    def get_image_srcset(self, obj):
+        return images.srcset(obj, self.context.get('request'))
+
     def get_comments(self, obj):
-        # Only get top-level comments (comments without parents)
-        comments = Comment.objects.filter(post=obj, parent=None)
-        return CommentSerializer(comments, many=True).data
+        # Bounded tree of top-level comments, normally loaded for the whole page
+        # by PostListSerializer
+        if not hasattr(obj, 'tree_comments'):
+            comment_tree.attach_post_comments([obj], *comment_tree.limits(self.context))
+        return comment_list(self).to_representation(obj.tree_comments)
+
+    def get_has_more_comments(self, obj):
+        return comment_tree.has_more_comments(obj)
+
+    def get_comments_cursor(self, obj):
+        if not comment_tree.has_more_comments(obj):
+            return None
+        return comment_tree.comments_cursor(obj)
+
+    def fragment_variant(self):
+        depth, width = comment_tree.limits(self.context)
+        return f'{cache.request_variant(self.context)}|{depth}|{width}'
 
+    def add_viewer_fields(self, instance, data):
+        data['is_liked'] = self.get_is_liked(instance)
+        return data
+
+    @metrics.timed_serializer
     def to_representation(self, instance):
+        data = cache.render_one(
+            'post', instance, self.render_shared, self.fragment_variant(), post_dependencies
+        )
+        return self.add_viewer_fields(instance, data)
+
+    def render_shared(self, instance):
         """
         Ensure all author-related fields are present and non-null
         """
+        if not hasattr(instance, 'tree_comments'):
+            comment_tree.attach_post_comments([instance], *comment_tree.limits(self.context))
+            prime_post_authors(self.context, [instance])
         data = super().to_representation(instance)
         # Ensure author fields are present
         if not data.get('author_username'):
@@ -127,7 +289,14 @@ class PostSerializer(serializers.ModelSerializer):
             data['author_profile_id'] = instance.author.profile.id
         return data
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageListSerializer(serializers.ListSerializer):
+    @metrics.timed_serializer
+    def to_representation(self, data):
+        messages = _as_list(data)
+        loaders.prime_users(self.context, messages, 'sender', 'receiver')
+        return super().to_representation(messages)
+
+class MessageSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
     sender_username = serializers.CharField(source='sender.username', read_only=True)
     receiver_username = serializers.CharField(source='receiver.username', read_only=True)
 
@@ -136,6 +305,50 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ('id', 'sender', 'sender_username', 'receiver', 'receiver_username', 
                  'content', 'created_at', 'is_read')
         read_only_fields = ('id', 'created_at')
+        list_serializer_class = MessageListSerializer
+
+    @metrics.timed_serializer
+    def to_representation(self, instance):
+        loaders.prime_users(self.context, [instance], 'sender', 'receiver')
+        return super().to_representation(instance)
+
+class MarkReadSerializer(serializers.Serializer):
+    """
+    Input of the bulk mark-as-read endpoint: explicit ids, or a conversation
+    read up to a message id and/or timestamp
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=500)
+    user_id = serializers.IntegerField(required=False)
+    up_to_id = serializers.IntegerField(required=False)
+    before = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if 'ids' not in attrs and 'user_id' not in attrs:
+            raise serializers.ValidationError("Provide either 'ids' or 'user_id'.")
+        if 'user_id' not in attrs and ('up_to_id' in attrs or 'before' in attrs):
+            raise serializers.ValidationError("'up_to_id' and 'before' require 'user_id'.")
+        return attrs
+
+class ConversationListSerializer(serializers.ListSerializer):
+    @metrics.timed_serializer
+    def to_representation(self, data):
+        rows = _as_list(data)
+        messages = [row.last_message for row in rows if row.last_message_id]
+        # Only the relations the view didn't select_related are loaded
+        others = loaders.prime_users(self.context, rows, 'other')
+        loaders.prime_users(self.context, messages, 'sender', 'receiver')
+        loaders.prime_profiles(self.context, others)
+        return super().to_representation(rows)
+
+class ConversationSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+    user = UserSerializer(source='other', read_only=True)
+    last_message = MessageSerializer(read_only=True)
+
+    class Meta:
+        model = Conversation
+        fields = ('user', 'last_message', 'unread_count')
+        read_only_fields = fields
+        list_serializer_class = ConversationListSerializer
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     def validate(self, attrs):
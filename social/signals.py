@@ -1,7 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Profile
+from .models import Comment, Follow, Message, Post, Profile, SearchTerm
+from . import authentication, cache, conversations, counters, images, interactions, notifications, search, trending
+from .serializers import MessageSerializer
 
 @receiver(post_save, sender=User)
 def create_profile(sender, instance, created, **kwargs):
@@ -9,5 +11,258 @@ def create_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
 
 @receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save() 
\ No newline at end of file
+def save_profile(sender, instance, update_fields=None, **kwargs):
+    # Logins only stamp last_login; nothing the profile shows changes
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    instance.profile.save()
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        counters.adjust(Profile.objects.filter(user_id=instance.following_id), 'followers_count', 1)
+        counters.adjust(Profile.objects.filter(user_id=instance.follower_id), 'following_count', 1)
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.adjust(Profile.objects.filter(user_id=instance.following_id), 'followers_count', -1)
+    counters.adjust(Profile.objects.filter(user_id=instance.follower_id), 'following_count', -1)
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        counters.adjust(Post.objects.filter(pk=instance.post_id), 'comments_count', 1)
+        if instance.parent_id:
+            counters.adjust(Comment.objects.filter(pk=instance.parent_id), 'replies_count', 1)
+        trending.record([instance.post_id], trending.COMMENT_WEIGHT)
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.adjust(Post.objects.filter(pk=instance.post_id), 'comments_count', -1)
+    if instance.parent_id:
+        counters.adjust(Comment.objects.filter(pk=instance.parent_id), 'replies_count', -1)
+    trending.record([instance.post_id], -trending.COMMENT_WEIGHT)
+
+@receiver(m2m_changed)
+def m2m_counters(sender, instance, action, reverse, pk_set, **kwargs):
+    relation = counters.counted_relation(sender)
+    if relation is None:
+        return
+    model, field, counter = relation
+
+    # Django reports the ids *submitted* for removal, so narrow them down to
+    # links that actually exist before they are deleted
+    if action in ('pre_remove', 'pre_clear'):
+        pending = getattr(instance, '_counter_removals', {})
+        pending[sender] = counters.existing_links(field, instance, reverse, pk_set)
+        instance._counter_removals = pending
+    elif action == 'post_add':
+        counters.apply_m2m_change(model, counter, instance, reverse, pk_set, 1)
+        record_engagement(model, field, instance, reverse, pk_set, 1)
+    elif action in ('post_remove', 'post_clear'):
+        removed = getattr(instance, '_counter_removals', {}).pop(sender, pk_set)
+        counters.apply_m2m_change(model, counter, instance, reverse, removed, -1)
+        record_engagement(model, field, instance, reverse, removed, -1)
+
+TRENDING_WEIGHTS = {'likes': trending.LIKE_WEIGHT, 'reposts': trending.REPOST_WEIGHT}
+
+def record_engagement(model, field, instance, reverse, pk_set, sign):
+    if model is not Post or not pk_set:
+        return
+    weight = sign * TRENDING_WEIGHTS[field.name]
+    if reverse:
+        trending.record(pk_set, weight)
+    else:
+        trending.record_posts([instance], weight * len(pk_set))
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        conversations.message_created(instance)
+    else:
+        # Edits may have changed the read state
+        conversations.refresh_unread(instance.receiver_id, instance.sender_id)
+
+    if created:
+        notifications.message_event('message.created', instance, MessageSerializer(instance).data)
+    elif update_fields is not None and set(update_fields) == {'is_read'}:
+        notifications.messages_read(instance.receiver_id, {instance.id: instance.sender_id})
+    else:
+        notifications.message_event('message.updated', instance, MessageSerializer(instance).data)
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    conversations.message_deleted(instance)
+    notifications.message_event('message.deleted', instance, {'id': instance.id})
+
+@receiver(post_save, sender=Follow)
+def follow_notification(sender, instance, created, **kwargs):
+    if created:
+        notifications.notify([instance.following_id], 'user.followed', {
+            'user_id': instance.follower_id,
+            'username': instance.follower.username,
+        })
+
+@receiver(post_save, sender=Comment)
+def comment_notification(sender, instance, created, **kwargs):
+    if not created:
+        return
+    recipients = {instance.post.author_id}
+    if instance.parent_id:
+        recipients.add(instance.parent.author_id)
+    recipients.discard(instance.author_id)
+    notifications.notify(recipients, 'comment.created', {
+        'comment_id': instance.id,
+        'post_id': instance.post_id,
+        'parent_id': instance.parent_id,
+        'user_id': instance.author_id,
+        'username': instance.author.username,
+    })
+
+@receiver(m2m_changed, sender=Post.likes.through)
+def like_notification(sender, instance, action, reverse, pk_set, user=None, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        likes = [(post, instance) for post in Post.objects.filter(pk__in=pk_set)]
+    elif user is not None and pk_set == {user.pk}:
+        # Sent by interactions.add with the user who liked
+        likes = [(instance, user)]
+    else:
+        likes = [(instance, user) for user in User.objects.filter(pk__in=pk_set)]
+    for post, user in likes:
+        if post.author_id != user.id:
+            notifications.notify([post.author_id], 'post.liked', {
+                'post_id': post.id,
+                'user_id': user.id,
+                'username': user.username,
+            })
+
+# Keep the search index in sync. Users are indexed through their profile,
+# which is saved whenever the user is.
+@receiver(post_save, sender=Profile)
+def index_profile(sender, instance, **kwargs):
+    search.index_user(instance.user, bio=instance.bio)
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    search.remove(SearchTerm.USER, instance.id)
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        trending.post_created(instance)
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove(SearchTerm.POST, instance.id)
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    search.index_comment(instance)
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    search.remove(SearchTerm.COMMENT, instance.id)
+
+# Evict cached post and profile fragments (see cache.py). Counter columns are
+# updated with queryset.update(), so the receivers above don't cover them.
+@receiver(post_save, sender=User)
+def invalidate_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    cache.invalidate('user', [instance.id])
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile(sender, instance, **kwargs):
+    cache.invalidate('profile', [instance.user_id])
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow(sender, instance, **kwargs):
+    cache.invalidate('profile', [instance.follower_id, instance.following_id])
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    cache.invalidate('post', [instance.id])
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment(sender, instance, **kwargs):
+    # Comments are embedded in their post's fragment
+    cache.invalidate('post', [instance.post_id])
+
+@receiver(m2m_changed)
+def invalidate_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    relation = counters.counted_relation(sender)
+    if relation is None:
+        return
+    if action in ('post_add', 'post_remove'):
+        changed = pk_set
+    elif action == 'pre_clear':
+        # The cleared ids were collected by m2m_counters
+        changed = instance._counter_removals.get(sender)
+    else:
+        return
+    if not changed:
+        return
+
+    model = relation[0]
+    ids = changed if reverse else {instance.pk}
+    if model is Comment:
+        if reverse:
+            ids = Comment.objects.filter(pk__in=ids).values_list('post_id', flat=True)
+        else:
+            ids = [instance.post_id]
+    cache.invalidate('post', ids)
+
+# Drop the viewer state cached by interactions.post_states
+@receiver(m2m_changed, sender=Post.likes.through)
+@receiver(m2m_changed, sender=Post.reposts.through)
+def forget_post_state(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        users = [instance.pk]
+    elif action in ('post_add', 'post_remove'):
+        users = pk_set or ()
+    elif action == 'pre_clear':
+        users = instance._counter_removals.get(sender, ())
+    else:
+        return
+    interactions.state_cache.forget(users)
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def forget_follow_state(sender, instance, **kwargs):
+    interactions.state_cache.forget([instance.follower_id])
+
+# Resize uploaded images in the background (see images.py)
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Profile)
+def process_image(sender, instance, **kwargs):
+    images.schedule(instance)
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Profile)
+def release_image(sender, instance, **kwargs):
+    images.release(instance)
+
+# Tokens carry is_active, so deactivating a user has to revoke them. Only
+# the save that deactivates does; later edits of the inactive user don't.
+@receiver(pre_save, sender=User)
+def note_deactivation(sender, instance, update_fields=None, **kwargs):
+    instance._deactivating = (
+        instance.pk is not None and not instance.is_active
+        and (update_fields is None or 'is_active' in update_fields)
+        and User.objects.filter(pk=instance.pk, is_active=True).exists()
+    )
+
+@receiver(post_save, sender=User)
+def revoke_inactive_user_tokens(sender, instance, created, **kwargs):
+    if not created and getattr(instance, '_deactivating', False):
+        authentication.revoke_tokens(instance.id)
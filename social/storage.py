@@ -0,0 +1,90 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+# Media files are stored under the SHA-256 of their content:
+#
+#     post_images/3f/3fa4...e1.jpg
+#
+# The upload is streamed to a temporary file next to its destination while
+# being hashed, then renamed into place. Uploading the same bytes twice costs
+# one read and no extra disk space, and a name never changes its content, so
+# it doubles as a strong ETag and the files can be cached forever.
+#
+# Because identical uploads share a file, a name can be referenced by several
+# rows: the image pipeline only deletes files no row references any more (see
+# images.discard). Whatever that misses, e.g. after a crash, is removed by
+# the collect_media command, which is meant to run daily.
+
+# Uploads in progress, written inside MEDIA_ROOT and never served
+TEMPORARY_PREFIX = '.upload-'
+HASH_NAME = re.compile(r'(?:^|/)[0-9a-f]{2}/([0-9a-f]{64})(?:\.[^/]*)?$')
+
+
+def content_hash(name):
+    """
+    The content hash embedded in a stored name, or None for other names
+    """
+    match = HASH_NAME.search(name)
+    return match.group(1) if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    chunk_size = 64 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content has been hashed
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(self.path(name))
+        self._makedirs(directory)
+        extension = os.path.splitext(name)[1].lower()
+
+        digest = hashlib.sha256()
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=TEMPORARY_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as destination:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(self.chunk_size):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    destination.write(chunk)
+
+            hexdigest = digest.hexdigest()
+            stored = os.path.join(os.path.dirname(name), hexdigest[:2], f'{hexdigest}{extension}')
+            full_path = self.path(stored)
+            if os.path.exists(full_path):
+                # Same bytes as an earlier upload; touch it so a concurrent
+                # discard() or collect_media sees it as new again
+                os.unlink(temporary)
+                os.utime(full_path)
+            else:
+                self._makedirs(os.path.dirname(full_path))
+                if self.file_permissions_mode is not None:
+                    os.chmod(temporary, self.file_permissions_mode)
+                # Atomic; a concurrent upload of the same bytes renames an
+                # identical file over it
+                os.replace(temporary, full_path)
+                self._ensure_location_group_id(full_path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        return stored.replace('\\', '/')
+
+    def _makedirs(self, directory):
+        if self.directory_permissions_mode is None:
+            os.makedirs(directory, exist_ok=True)
+            return
+        # os.makedirs() doesn't apply the mode to intermediate directories
+        old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+        try:
+            os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+        finally:
+            os.umask(old_umask)
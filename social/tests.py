@@ -1,3 +1,1632 @@
-from django.test import TestCase
+import gzip
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import User, update_last_login
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from social_media_api import databases
+from social_media_api.asgi import application
+
+from . import (
+    authentication, benchmark, cache, comment_tree, compression, conversations, db_router, images, interactions, metrics,
+    throttling, search, timeline, trending,
+)
+from .models import Comment, Conversation, Follow, Message, Post, Profile, SearchTerm, TimelineEntry, TrendingPost
+
+
+class SocialTestCase(TestCase):
+    """
+    A user per name in ``accounts`` (alice and bob unless a class says
+    otherwise), and ``self.client`` signed in as the first of them
+    """
+    accounts = ('alice', 'bob')
+    account_fields = {}
+
+    def setUp(self):
+        for username in self.accounts:
+            user = User.objects.create_user(username, password='pass12345', **self.account_fields.get(username, {}))
+            setattr(self, username, user)
+        self.client = self.client_for(getattr(self, self.accounts[0]))
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+
+class HomeTimelineTests(SocialTestCase):
+    def follow(self, user):
+        return self.client.post(f'/api/profiles/{user.profile.id}/follow/')
+
+    def feed_ids(self):
+        response = self.client.get('/api/posts/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [post['id'] for post in response.data['results']]
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        old_post = Post.objects.create(author=self.bob, content='before follow')
+        self.follow(self.bob)
+        self.assertEqual(self.feed_ids(), [old_post.id])
+
+        self.follow(self.bob)
+        self.assertEqual(self.feed_ids(), [])
+        self.assertFalse(TimelineEntry.objects.filter(user=self.alice).exists())
+
+    def test_new_post_is_fanned_out_to_followers(self):
+        self.follow(self.bob)
+        bob_client = self.client_for(self.bob)
+        response = bob_client.post('/api/posts/', {'content': 'hello'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.feed_ids(), [response.data['id']])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_high_fanout_authors_are_read_on_demand(self):
+        self.follow(self.bob)
+        bob_client = self.client_for(self.bob)
+        response = bob_client.post('/api/posts/', {'content': 'hello'})
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed_ids(), [response.data['id']])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=2)
+    def test_posts_stay_when_an_author_drops_below_the_threshold(self):
+        carol = User.objects.create_user('carol', password='pass12345')
+        self.follow(self.bob)
+        self.client_for(carol).post(f'/api/profiles/{self.bob.profile.id}/follow/')
+        post = Post.objects.create(author=self.bob, content='while popular')
+        self.assertEqual(self.feed_ids(), [post.id])
+
+        self.client_for(carol).delete(f'/api/profiles/{self.bob.profile.id}/follow/')
+        self.assertEqual(self.feed_ids(), [post.id])
+        self.assertTrue(TimelineEntry.objects.filter(user=self.alice, post=post).exists())
+
+    def test_feed_pages_on_timeline_entries(self):
+        self.follow(self.bob)
+        posts = [Post.objects.create(author=self.bob, content=str(i)) for i in range(5)]
+        timeline.backfill(self.alice, self.bob)
+        # Identical timestamps still page deterministically on the post id
+        TimelineEntry.objects.filter(post__in=posts[1:4]).update(created_at=posts[1].created_at)
+        ids, url = [], '/api/posts/feed/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        expected = TimelineEntry.objects.filter(user=self.alice).order_by('-created_at', '-post_id')
+        self.assertEqual(ids, list(expected.values_list('post_id', flat=True)))
+
+
+class KeysetPaginationTests(SocialTestCase):
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_user_posts_pages_without_gaps_or_duplicates(self):
+        posts = [Post.objects.create(author=self.bob, content=str(i)) for i in range(7)]
+        # Identical timestamps must still page deterministically on id
+        Post.objects.filter(id__in=[p.id for p in posts[2:5]]).update(created_at=posts[2].created_at)
+        expected = list(Post.objects.filter(author=self.bob).order_by('-created_at', '-id').values_list('id', flat=True))
+
+        self.assertEqual(self.walk(f'/api/users/{self.bob.id}/posts/?page_size=3'), expected)
+
+    def test_previous_cursor_returns_preceding_page(self):
+        for i in range(5):
+            Message.objects.create(sender=self.bob, receiver=self.alice, content=str(i))
+        first = self.client.get(f'/api/messages/with/{self.bob.id}/?page_size=2')
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [m['id'] for m in back.data['results']],
+            [m['id'] for m in first.data['results']],
+        )
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/posts/explore/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class PostListQueryCountTests(SocialTestCase):
+    """
+    Every endpoint rendering a list of posts must cost the same number of
+    queries regardless of how many posts, comments and likes are on the page
+    """
+    accounts = ('alice', 'bob', 'carol')
+
+    def setUp(self):
+        super().setUp()
+        self.client.post(f'/api/profiles/{self.bob.profile.id}/follow/')
+
+    def add_posts(self, count):
+        for i in range(count):
+            for author in (self.bob, self.carol):
+                post = Post.objects.create(author=author, content=f'post {i}')
+                timeline.fan_out_post(post)
+                post.likes.add(self.alice, self.carol)
+                post.reposts.add(self.alice)
+                comment = Comment.objects.create(post=post, author=self.carol, content='top')
+                comment.likes.add(self.bob)
+                Comment.objects.create(post=post, author=self.bob, content='reply', parent=comment)
+
+    def query_counts(self):
+        urls = [
+            '/api/posts/',
+            '/api/posts/feed/',
+            '/api/posts/explore/',
+            f'/api/users/{self.bob.id}/posts/',
+            f'/api/users/{self.alice.id}/liked_posts/',
+            f'/api/users/{self.alice.id}/reposted_posts/',
+        ]
+        counts = {}
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            counts[url] = len(queries)
+        return counts
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.add_posts(1)
+        small = self.query_counts()
+        self.add_posts(3)
+        self.assertEqual(self.query_counts(), small)
+
+
+class BatchLoaderTests(SocialTestCase):
+    """
+    Users and profiles behind a list response are loaded with a constant
+    number of queries, on cold fragment caches
+    """
+    accounts = ('alice',)
+
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(author=self.alice, content='hello')
+        self.users = 0
+
+    def add_users(self, count):
+        for _ in range(count):
+            self.users += 1
+            user = User.objects.create_user(f'user{self.users}', password='pass12345')
+            Follow.objects.create(follower=user, following=self.alice)
+            Message.objects.create(sender=user, receiver=self.alice, content='hi')
+            Message.objects.create(sender=self.alice, receiver=user, content='hello')
+            Comment.objects.create(post=self.post, author=user, content='nice')
+
+    def query_counts(self):
+        urls = [
+            '/api/users/',
+            f'/api/profiles/{self.alice.profile.id}/followers/',
+            '/api/comments/',
+            '/api/messages/',
+            '/api/messages/conversations/',
+        ]
+        counts = {}
+        for url in urls:
+            caches['default'].clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            counts[url] = len(queries)
+        return counts
+
+    def test_query_count_does_not_grow_with_related_users(self):
+        self.add_users(1)
+        small = self.query_counts()
+        self.add_users(4)
+        self.assertEqual(self.query_counts(), small)
+
+
+class CounterColumnTests(SocialTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(author=self.bob, content='hello')
+
+    def assertCounts(self, **expected):
+        self.post.refresh_from_db()
+        for field, value in expected.items():
+            self.assertEqual(getattr(self.post, field), value, field)
+
+    def test_m2m_changes_update_counters_in_both_directions(self):
+        self.post.likes.add(self.alice, self.bob)
+        self.post.likes.add(self.alice)
+        self.assertCounts(likes_count=2)
+        self.bob.liked_posts.remove(self.post)
+        self.post.likes.remove(self.bob)
+        self.assertCounts(likes_count=1)
+        self.alice.reposted_posts.add(self.post)
+        self.assertCounts(reposts_count=1)
+        self.post.reposts.clear()
+        self.assertCounts(reposts_count=0)
+
+    def test_comment_create_and_cascade_delete(self):
+        top = Comment.objects.create(post=self.post, author=self.alice, content='top')
+        Comment.objects.create(post=self.post, author=self.bob, content='reply', parent=top)
+        top.likes.add(self.bob)
+        top.refresh_from_db()
+        self.assertEqual(top.likes_count, 1)
+        self.assertCounts(comments_count=2)
+        top.delete()
+        self.assertCounts(comments_count=0)
+
+    def test_follow_counters_survive_stale_saves(self):
+        stale_profile = Profile.objects.get(user=self.bob)
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        stale_profile.bio = 'updated'
+        stale_profile.save()
+        self.assertEqual(Profile.objects.get(user=self.bob).followers_count, 1)
+        self.assertEqual(Profile.objects.get(user=self.alice).following_count, 1)
+        Follow.objects.filter(follower=self.alice).delete()
+        self.assertEqual(Profile.objects.get(user=self.bob).followers_count, 0)
+
+    def test_reconcile_command_fixes_drift(self):
+        self.post.likes.add(self.alice)
+        Post.objects.filter(pk=self.post.pk).update(likes_count=7, comments_count=3)
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        self.assertCounts(likes_count=1, comments_count=0)
+
+
+@override_settings(COMMENT_TREE_MAX_DEPTH=2, COMMENT_TREE_MAX_WIDTH=2, FEED_COMMENT_PREVIEW=1)
+class CommentTreeTests(SocialTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(author=self.bob, content='viral')
+        self.top = [Comment.objects.create(post=self.post, author=self.alice, content=f'top {i}') for i in range(3)]
+        self.replies = [
+            Comment.objects.create(post=self.post, author=self.bob, content=f'reply {i}', parent=self.top[0])
+            for i in range(5)
+        ]
+        Comment.objects.create(post=self.post, author=self.alice, content='deep', parent=self.replies[0])
+
+    def test_post_tree_is_capped_by_depth_and_width(self):
+        comments = self.client.get(f'/api/posts/{self.post.id}/').data['comments']
+        self.assertEqual([c['id'] for c in comments], [c.id for c in self.top[:2]])
+
+        first = comments[0]
+        self.assertEqual([r['id'] for r in first['replies']], [r.id for r in self.replies[:2]])
+        self.assertTrue(first['has_more_replies'])
+        self.assertIsNotNone(first['replies_cursor'])
+
+        # The reply at the depth limit reports its hidden child without loading it
+        self.assertEqual(first['replies'][0]['replies'], [])
+        self.assertTrue(first['replies'][0]['has_more_replies'])
+        self.assertIsNone(first['replies'][0]['replies_cursor'])
+
+    def test_all_levels_load_in_one_query(self):
+        other = Post.objects.create(author=self.alice, content='quiet')
+        posts = list(Post.objects.filter(id__in=[self.post.id, other.id]).order_by('id'))
+        with self.assertNumQueries(1):
+            comment_tree.attach_post_comments(posts, 3, 2)
+        first = posts[0].tree_comments[0]
+        self.assertEqual([r.id for r in first.tree_replies], [r.id for r in self.replies[:2]])
+        self.assertEqual(len(first.tree_replies[0].tree_replies), 1)
+        self.assertEqual((posts[0].top_level_count, posts[1].top_level_count), (3, 0))
+
+    def test_truncated_top_level_links_onwards(self):
+        data = self.client.get(f'/api/posts/{self.post.id}/').data
+        self.assertTrue(data['has_more_comments'])
+        response = self.client.get(f'/api/posts/{self.post.id}/comments/?cursor={data["comments_cursor"]}')
+        self.assertEqual([c['id'] for c in response.data['results']], [self.top[2].id])
+        self.assertIsNone(response.data['next'])
+
+        Comment.objects.filter(id=self.top[2].id).delete()
+        data = self.client.get(f'/api/posts/{self.post.id}/').data
+        self.assertFalse(data['has_more_comments'])
+        self.assertIsNone(data['comments_cursor'])
+
+    def test_replies_endpoint_continues_from_cursor(self):
+        comments = self.client.get(f'/api/posts/{self.post.id}/').data['comments']
+        cursor = comments[0]['replies_cursor']
+        response = self.client.get(f'/api/comments/{self.top[0].id}/replies/?cursor={cursor}&page_size=2')
+        self.assertEqual([r['id'] for r in response.data['results']], [r.id for r in self.replies[2:4]])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([r['id'] for r in response.data['results']], [self.replies[4].id])
+        self.assertIsNone(response.data['next'])
+
+    def test_feed_embeds_only_a_preview(self):
+        self.client.post(f'/api/profiles/{self.bob.profile.id}/follow/')
+        post = self.client.get('/api/posts/feed/').data['results'][0]
+        self.assertEqual([c['id'] for c in post['comments']], [self.top[0].id])
+        self.assertEqual(post['comments'][0]['replies'], [])
+        self.assertTrue(post['comments'][0]['has_more_replies'])
+
+
+class ConversationInboxTests(SocialTestCase):
+    accounts = ('alice', 'bob', 'carol')
+
+    def inbox(self):
+        response = self.client.get('/api/messages/conversations/')
+        self.assertEqual(response.status_code, 200)
+        return [
+            (row['user']['id'], row['last_message']['id'], row['unread_count'])
+            for row in response.data['results']
+        ]
+
+    def test_inbox_tracks_latest_message_and_unread_counts(self):
+        first = Message.objects.create(sender=self.bob, receiver=self.alice, content='hi')
+        Message.objects.create(sender=self.alice, receiver=self.carol, content='hey')
+        latest = Message.objects.create(sender=self.bob, receiver=self.alice, content='again')
+        carol_msg = Message.objects.filter(sender=self.alice).get()
+        self.assertEqual(self.inbox(), [(self.bob.id, latest.id, 2), (self.carol.id, carol_msg.id, 0)])
+
+        self.client.post(f'/api/messages/{first.id}/mark_as_read/')
+        latest.delete()
+        self.assertEqual(self.inbox(), [(self.carol.id, carol_msg.id, 0), (self.bob.id, first.id, 0)])
+
+    def test_inbox_query_count_is_constant(self):
+        for other in (self.bob, self.carol):
+            Message.objects.create(sender=other, receiver=self.alice, content='hi')
+        with CaptureQueriesContext(connection) as queries:
+            self.inbox()
+        small = len(queries)
+        for i in range(5):
+            user = User.objects.create_user(f'user{i}', password='pass12345')
+            Message.objects.create(sender=user, receiver=self.alice, content='hi')
+        with CaptureQueriesContext(connection) as queries:
+            self.inbox()
+        self.assertEqual(len(queries), small)
+
+    def test_rebuild_matches_incremental_state(self):
+        Message.objects.create(sender=self.bob, receiver=self.alice, content='hi')
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='yo')
+        expected = self.inbox()
+        call_command('rebuild_conversations', stdout=StringIO())
+        self.assertEqual(self.inbox(), expected)
+
+
+class RealtimeNotificationTests(SocialTestCase):
+    async def connect(self, token):
+        communicator = WebsocketCommunicator(application, f'/ws/notifications/?token={token}')
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    def committed(self, action):
+        with self.captureOnCommitCallbacks(execute=True):
+            return action()
+
+    async def test_unauthenticated_connections_are_rejected(self):
+        communicator, connected, code = await self.connect('not-a-token')
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_message_and_like_events_are_pushed(self):
+        communicator, connected, _ = await self.connect(str(AccessToken.for_user(self.alice)))
+        self.assertTrue(connected)
+
+        message = await sync_to_async(self.committed)(
+            lambda: Message.objects.create(sender=self.bob, receiver=self.alice, content='hi')
+        )
+        event = await communicator.receive_json_from()
+        self.assertEqual(event['type'], 'message.created')
+        self.assertEqual(event['data']['message']['id'], message.id)
+        self.assertEqual(event['data']['unread_count'], 1)
+
+        def like():
+            post = Post.objects.create(author=self.alice, content='hello')
+            post.likes.add(self.bob)
+            return post
+        post = await sync_to_async(self.committed)(like)
+        event = await communicator.receive_json_from()
+        self.assertEqual(event, {
+            'type': 'post.liked',
+            'data': {'post_id': post.id, 'user_id': self.bob.id, 'username': 'bob'},
+        })
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    def test_unread_total_comes_from_inbox_rows(self):
+        Message.objects.create(sender=self.bob, receiver=self.alice, content='first')
+        with CaptureQueriesContext(connection) as queries:
+            Message.objects.create(sender=self.bob, receiver=self.alice, content='second')
+        counts = [q['sql'] for q in queries if 'COUNT(' in q['sql'] and 'social_message' in q['sql']]
+        self.assertEqual(counts, [])
+        self.assertEqual(conversations.unread_total(self.alice.id), 2)
+        self.assertEqual(conversations.unread_total(self.bob.id), 0)
+
+
+class BulkMarkReadTests(SocialTestCase):
+    accounts = ('alice', 'bob', 'carol')
+
+    def setUp(self):
+        super().setUp()
+        self.from_bob = [Message.objects.create(sender=self.bob, receiver=self.alice, content=str(i)) for i in range(4)]
+        self.from_carol = Message.objects.create(sender=self.carol, receiver=self.alice, content='hi')
+
+    def test_marks_conversation_up_to_message(self):
+        response = self.client.post('/api/messages/mark_read/', {
+            'user_id': self.bob.id, 'up_to_id': self.from_bob[2].id,
+        }, format='json')
+        self.assertEqual(response.data, {'marked': 3, 'unread_count': 2})
+        conversation = self.alice.conversations.get(other=self.bob)
+        self.assertEqual(conversation.unread_count, 1)
+
+    def test_marks_explicit_ids_of_own_messages_only(self):
+        outgoing = Message.objects.create(sender=self.alice, receiver=self.bob, content='mine')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/messages/mark_read/', {
+                'ids': [self.from_bob[0].id, self.from_carol.id, outgoing.id],
+            }, format='json')
+        self.assertEqual(response.data, {'marked': 2, 'unread_count': 3})
+        self.assertFalse(Message.objects.get(pk=outgoing.pk).is_read)
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "social_message"')]
+        self.assertEqual(len(updates), 1)
+
+    def test_requires_a_selector(self):
+        response = self.client.post('/api/messages/mark_read/', {'up_to_id': 5}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(SocialTestCase):
+    account_fields = {
+        'alice': {'first_name': 'Alice', 'last_name': 'Walker'},
+        'bob': {'first_name': 'Bob', 'last_name': 'Walton'},
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.bob.profile.bio = 'Alice fan, walking enthusiast'
+        self.bob.profile.save()
+
+    def search(self, query, kind='users', **params):
+        response = self.client.get('/api/search/', {'q': query, 'type': kind, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ranked_prefix_search_over_users(self):
+        ids = [user['id'] for user in self.search('ali')['results']]
+        # A username/name match outranks a mention in someone's bio
+        self.assertEqual(ids, [self.alice.id, self.bob.id])
+        self.assertEqual([u['id'] for u in self.search('walt')['results']], [self.bob.id])
+        # Every query word has to match
+        self.assertEqual([u['id'] for u in self.search('alice walton')['results']], [self.bob.id])
+
+    def test_logins_leave_the_index_alone(self):
+        with mock.patch.object(search, 'index_user') as index_user:
+            update_last_login(None, self.alice)
+        index_user.assert_not_called()
+        self.alice.first_name = 'Alicia'
+        self.alice.save()
+        self.assertEqual([u['id'] for u in self.search('alicia')['results']], [self.alice.id])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.create(author=self.bob, content='Sourdough starter tips')
+        self.assertEqual([p['id'] for p in self.search('sourd', 'posts')['results']], [post.id])
+        post.content = 'Something else'
+        post.save()
+        self.assertEqual(self.search('sourd', 'posts')['results'], [])
+        comment = Comment.objects.create(post=post, author=self.alice, content='Great sourdough')
+        self.assertEqual([c['id'] for c in self.search('sourdough', 'comments')['results']], [comment.id])
+        post.delete()
+        self.assertEqual(self.search('sourdough', 'comments')['results'], [])
+
+    def test_cursor_pagination_over_ranked_hits(self):
+        posts = [Post.objects.create(author=self.bob, content='kitten ' * (i + 1)) for i in range(5)]
+        seen = []
+        page = self.search('kitten', 'posts', page_size=2)
+        while True:
+            seen.extend(p['id'] for p in page['results'])
+            if not page['next']:
+                break
+            page = self.client.get(page['next']).data
+        self.assertEqual(seen, [p.id for p in reversed(posts)])
+
+    def test_user_list_search_uses_the_index(self):
+        response = self.client.get('/api/users/', {'search': 'walker'})
+        self.assertEqual([u['id'] for u in response.data['results']], [self.alice.id])
+
+    def test_user_search_matches_email(self):
+        self.bob.email = 'b.builder@example.com'
+        self.bob.save()
+        for query in ('builder', 'B.Builder@Example.com'):
+            response = self.client.get('/api/users/', {'search': query})
+            self.assertEqual([u['id'] for u in response.data['results']], [self.bob.id])
+        response = self.client.get('/api/users/', {'search': 'example'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_unchanged_saves_do_not_rewrite_the_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.alice.save()
+        writes = [q['sql'] for q in queries if 'social_searchterm' in q['sql'] and not q['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+
+        self.alice.last_name = 'Walkers'
+        self.alice.save()
+        terms = dict(SearchTerm.objects.filter(kind=SearchTerm.USER, object_id=self.alice.id).values_list('term', 'weight'))
+        self.assertEqual(terms, {'alice': 7, 'walkers': 3})
+
+
+class TrendingExploreTests(SocialTestCase):
+    accounts = ('alice', 'bob', 'carol')
+
+    def explore(self, **params):
+        response = self.client.get('/api/posts/explore/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_engagement_ranks_above_recency(self):
+        quiet = Post.objects.create(author=self.bob, content='quiet')
+        busy = Post.objects.create(author=self.bob, content='busy')
+        newest = Post.objects.create(author=self.carol, content='newest')
+        busy.likes.add(self.carol, self.alice)
+        Comment.objects.create(post=busy, author=self.carol, content='nice')
+
+        self.assertEqual([p['id'] for p in self.explore()['results']], [busy.id, newest.id, quiet.id])
+
+        # Withdrawing the engagement gives the post its creation score back
+        busy.likes.clear()
+        busy.comments.all().delete()
+        self.assertEqual([p['id'] for p in self.explore()['results']], [newest.id, busy.id, quiet.id])
+
+    def test_first_engagements_racing_add_up(self):
+        post = Post.objects.create(author=self.bob, content='new')
+        TrendingPost.objects.all().delete()
+        insert = TrendingPost.objects.bulk_create
+
+        def raced(rows, **kwargs):
+            # Another worker's first like lands between our read and insert
+            TrendingPost.objects.create(
+                post_id=post.id, author_id=self.bob.id, post_created_at=post.created_at, score=other_like
+            )
+            return insert(rows, **kwargs)
+        other_like = trending._log_add(
+            trending.event_score(trending.POST_WEIGHT, post.created_at),
+            trending.event_score(trending.LIKE_WEIGHT, timezone.now()),
+        )
+        with mock.patch.object(TrendingPost.objects, 'bulk_create', side_effect=raced):
+            trending.record([post.id], trending.LIKE_WEIGHT, when=post.created_at)
+        self.assertGreater(TrendingPost.objects.get().score, other_like)
+
+    def test_excludes_followed_authors_and_self(self):
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        Post.objects.create(author=self.bob, content='followed')
+        Post.objects.create(author=self.alice, content='mine')
+        visible = Post.objects.create(author=self.carol, content='stranger')
+        self.assertEqual([p['id'] for p in self.explore()['results']], [visible.id])
+
+    def test_pool_without_visible_posts_falls_back_to_recency(self):
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        Post.objects.create(author=self.bob, content='followed')
+        older = Post.objects.create(author=self.carol, content='older')
+        newer = Post.objects.create(author=self.carol, content='newer')
+        TrendingPost.objects.filter(author=self.carol).delete()
+
+        page = self.explore(page_size=1)
+        self.assertEqual([p['id'] for p in page['results']], [newer.id])
+        self.assertIn('recent_cursor=', page['next'])
+        self.assertEqual([p['id'] for p in self.client.get(page['next']).data['results']], [older.id])
+
+    @override_settings(TRENDING_POOL_SIZE=2)
+    def test_scan_stopping_at_its_limit_links_onwards(self):
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        stranger = Post.objects.create(author=self.carol, content='stranger')
+        for content in ('followed', 'also followed'):
+            Post.objects.create(author=self.bob, content=content).likes.add(self.carol)
+
+        page = self.explore()
+        self.assertEqual(page['results'], [])
+        self.assertIsNotNone(page['next'])
+        self.assertEqual([p['id'] for p in self.client.get(page['next']).data['results']], [stranger.id])
+
+    def test_cursor_pages_do_not_overlap(self):
+        posts = [Post.objects.create(author=self.carol, content=f'post {i}') for i in range(5)]
+        for post in posts[:3]:
+            post.likes.add(self.bob)
+        Post.objects.create(author=self.alice, content='mine')
+
+        seen = []
+        page = self.explore(page_size=2)
+        while True:
+            self.assertLessEqual(len(page['results']), 2)
+            seen.extend(p['id'] for p in page['results'])
+            if not page['next']:
+                break
+            page = self.client.get(page['next']).data
+        self.assertEqual(sorted(seen), sorted(p.id for p in posts))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    @override_settings(TRENDING_MAX_AGE_HOURS=0)
+    def test_refresh_expires_old_posts_and_falls_back_to_recency(self):
+        post = Post.objects.create(author=self.bob, content='old news')
+        out = StringIO()
+        call_command('refresh_trending', stdout=out)
+        self.assertIn('1 expired', out.getvalue())
+        self.assertFalse(TrendingPost.objects.exists())
+        self.assertEqual([p['id'] for p in self.explore()['results']], [post.id])
+
+    def test_rebuild_seeds_from_counters(self):
+        plain = Post.objects.create(author=self.bob, content='plain')
+        liked = Post.objects.create(author=self.bob, content='liked')
+        liked.likes.add(self.carol)
+        TrendingPost.objects.all().delete()
+        call_command('refresh_trending', '--rebuild', stdout=StringIO())
+        ranked = list(TrendingPost.objects.order_by('-score').values_list('post_id', flat=True))
+        self.assertEqual(ranked, [liked.id, plain.id])
+
+
+class FragmentCacheTests(SocialTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        cache.reset_stats()
+        super().setUp()
+        self.post = Post.objects.create(author=self.bob, content='hello')
+
+    def get_post(self, client=None):
+        response = (client or self.client).get(f'/api/posts/{self.post.id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_repeat_reads_are_served_from_cache(self):
+        self.get_post()
+        with CaptureQueriesContext(connection) as cold:
+            self.get_post()
+        self.assertEqual(cache.stats()['post']['hits'], 1)
+        # Only the ETag validator and the row lookup are left; the comment
+        # tree is not reloaded
+        self.assertEqual(len(cold.captured_queries), 2)
+
+    def test_viewer_fields_are_not_shared(self):
+        self.post.likes.add(self.alice)
+        self.assertTrue(self.get_post()['is_liked'])
+        bob_client = self.client_for(self.bob)
+        data = self.get_post(bob_client)
+        self.assertFalse(data['is_liked'])
+        self.assertEqual(data['likes_count'], 1)
+        self.assertEqual(cache.stats()['post']['hits'], 1)
+
+    def test_writes_invalidate_fragments(self):
+        self.assertEqual(self.get_post()['likes_count'], 0)
+        self.post.likes.add(self.alice)
+        self.assertEqual(self.get_post()['likes_count'], 1)
+        self.alice.liked_posts.clear()
+        self.assertEqual(self.get_post()['likes_count'], 0)
+
+        Comment.objects.create(post=self.post, author=self.alice, content='first')
+        data = self.get_post()
+        self.assertEqual(data['comments_count'], 1)
+        self.assertEqual([c['content'] for c in data['comments']], ['first'])
+
+        self.bob.username = 'robert'
+        self.bob.save()
+        self.assertEqual(self.get_post()['author_username'], 'robert')
+        self.assertEqual(cache.stats()['post']['hits'], 0)
+
+    def test_follow_invalidates_both_profiles(self):
+        url = f'/api/profiles/{self.bob.profile.id}/'
+        self.assertEqual(self.client.get(url).data['followers_count'], 0)
+        self.client.post(f'/api/profiles/{self.bob.profile.id}/follow/')
+        self.assertEqual(self.client.get(url).data['followers_count'], 1)
+        self.assertEqual(self.client.get(f'/api/users/{self.alice.id}/profile/').data['following_count'], 1)
+
+    def test_stats_endpoint_is_admin_only(self):
+        self.get_post()
+        self.assertEqual(self.client.get('/api/cache/stats/').status_code, 403)
+        admin = User.objects.create_superuser('admin', password='pass12345')
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/cache/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['kinds']['post']['misses'], 1)
+
+
+class InteractionEndpointTests(SocialTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(author=self.bob, content='hello')
+
+    def test_put_and_delete_are_idempotent(self):
+        url = f'/api/posts/{self.post.id}/like/'
+        for _ in range(2):
+            response = self.client.put(url)
+            self.assertEqual(response.data, {'status': 'liked', 'is_liked': True, 'likes_count': 1})
+        self.assertEqual(self.client.get(url).data['is_liked'], True)
+        for _ in range(2):
+            response = self.client.delete(url)
+            self.assertEqual(response.data, {'status': 'unliked', 'is_liked': False, 'likes_count': 0})
+
+        url = f'/api/posts/{self.post.id}/repost/'
+        self.client.put(url)
+        self.assertEqual(self.client.put(url).data['reposts_count'], 1)
+        self.assertEqual(self.client.post(url).data, {'status': 'unreposted', 'is_reposted': False, 'reposts_count': 0})
+
+        comment = Comment.objects.create(post=self.post, author=self.bob, content='hi')
+        url = f'/api/comments/{comment.id}/like/'
+        self.client.put(url)
+        self.assertEqual(self.client.put(url).data['likes_count'], 1)
+
+    def test_like_and_unlike_queries(self):
+        url = f'/api/posts/{self.post.id}/like/'
+        # post, insert, counter, trending row and its update, fresh count,
+        # plus the transaction's savepoints
+        with self.assertNumQueries(10):
+            self.client.put(url)
+        with self.assertNumQueries(8):
+            self.client.delete(url)
+
+    def test_unfollow_sends_the_deleted_row(self):
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        deleted = []
+
+        def receiver(sender, instance, **kwargs):
+            deleted.append(instance.pk)
+        post_delete.connect(receiver, sender=Follow)
+        self.addCleanup(post_delete.disconnect, receiver, sender=Follow)
+        follow = Follow.objects.get()
+        self.assertTrue(interactions.unfollow(self.alice, self.bob))
+        self.assertFalse(interactions.unfollow(self.alice, self.bob))
+        self.assertEqual(deleted, [follow.pk])
+
+    def test_follow_put_and_delete(self):
+        url = f'/api/profiles/{self.bob.profile.id}/follow/'
+        self.client.put(url)
+        response = self.client.put(url)
+        self.assertEqual(response.data, {'status': 'followed', 'is_following': True, 'followers_count': 1})
+        self.assertEqual(self.alice.timeline_entries.count(), 1)
+        self.client.delete(url)
+        response = self.client.delete(url)
+        self.assertEqual(response.data, {'status': 'unfollowed', 'is_following': False, 'followers_count': 0})
+        self.assertEqual(self.alice.timeline_entries.count(), 0)
+        self.bob.profile.refresh_from_db()
+        self.alice.profile.refresh_from_db()
+        self.assertEqual((self.bob.profile.followers_count, self.alice.profile.following_count), (0, 0))
+
+
+class PostStateTests(SocialTestCase):
+    accounts = ('alice', 'bob', 'carol')
+
+    def setUp(self):
+        interactions.state_cache.clear()
+        super().setUp()
+        self.posts = [Post.objects.create(author=author, content='x') for author in (self.bob, self.carol, self.bob)]
+
+    def state(self, ids):
+        response = self.client.get('/api/posts/state/', {'ids': ','.join(map(str, ids))})
+        self.assertEqual(response.status_code, 200)
+        return {item['id']: item for item in response.data['results']}
+
+    def test_flags_in_three_queries_then_from_cache(self):
+        first, second, third = self.posts
+        first.likes.add(self.alice)
+        second.reposts.add(self.alice)
+        Follow.objects.create(follower=self.alice, following=self.bob)
+
+        ids = [p.id for p in self.posts] + [999999]
+        with self.assertNumQueries(3):
+            states = self.state(ids)
+        self.assertEqual(list(states), [first.id, second.id, third.id])
+        self.assertEqual(states[first.id], {
+            'id': first.id, 'is_liked': True, 'is_reposted': False, 'is_following_author': True,
+        })
+        self.assertEqual(states[second.id], {
+            'id': second.id, 'is_liked': False, 'is_reposted': True, 'is_following_author': False,
+        })
+        self.assertTrue(states[third.id]['is_following_author'])
+
+        with self.assertNumQueries(0):
+            self.state([first.id, second.id])
+
+    def test_own_interactions_invalidate_cached_state(self):
+        post = self.posts[1]
+        self.assertFalse(self.state([post.id])[post.id]['is_liked'])
+        self.client.put(f'/api/posts/{post.id}/like/')
+        self.assertTrue(self.state([post.id])[post.id]['is_liked'])
+        self.client.put(f'/api/profiles/{self.carol.profile.id}/follow/')
+        self.assertTrue(self.state([post.id])[post.id]['is_following_author'])
+        self.alice.liked_posts.clear()
+        self.assertFalse(self.state([post.id])[post.id]['is_liked'])
+
+    def test_rejects_bad_input(self):
+        self.assertEqual(self.client.get('/api/posts/state/', {'ids': '1,x'}).status_code, 400)
+        too_many = ','.join(str(i) for i in range(interactions.MAX_STATE_IDS + 1))
+        self.assertEqual(self.client.get('/api/posts/state/', {'ids': too_many}).status_code, 400)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/posts/state/', {'ids': '1'}).status_code, 401)
+
+
+class ConcurrentInteractionTests(TransactionTestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pass12345')
+        self.post = Post.objects.create(author=self.author, content='popular')
+        self.users = [User.objects.create_user(f'fan{i}', password='pass12345') for i in range(6)]
+
+    def hammer(self, method, url, users, repeat=3):
+        errors = []
+
+        def run(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                for _ in range(repeat):
+                    # SQLite allows one writer at a time; retry when locked out
+                    for _ in range(50):
+                        try:
+                            getattr(client, method)(url)
+                            break
+                        except OperationalError:
+                            continue
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=run, args=(user,)) for user in users for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_counts_stay_exact_under_double_taps(self):
+        url = f'/api/posts/{self.post.id}/like/'
+        self.hammer('put', url, self.users)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, len(self.users))
+        self.assertEqual(self.post.likes.count(), len(self.users))
+
+        self.hammer('delete', url, self.users[:4])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 2)
+        self.assertEqual(self.post.likes.count(), 2)
+
+
+@override_settings(DATABASE_REPLICAS=['default'])
+class ReplicaRoutingTests(SocialTestCase):
+    """
+    The test database doubles as the only "replica". Test transactions keep
+    the actual reads on the primary, so the routing decision is checked.
+    """
+    def setUp(self):
+        caches['default'].clear()
+        super().setUp()
+
+    def replica_reads(self, method, url, **kwargs):
+        decisions = []
+
+        def read_from_replicas(user):
+            decisions.append(original(user))
+            return decisions[-1]
+
+        original = db_router.read_from_replicas
+        with mock.patch.object(db_router, 'read_from_replicas', read_from_replicas):
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400)
+        return sum(decisions)
+
+    def test_read_actions_use_replicas_and_writers_read_their_writes(self):
+        self.assertGreater(self.replica_reads('get', '/api/posts/'), 0)
+        self.assertGreater(self.replica_reads('get', '/api/posts/feed/'), 0)
+        self.assertEqual(self.replica_reads('get', '/api/messages/'), 0)
+        self.assertEqual(self.replica_reads('post', '/api/posts/', data={'content': 'hi'}), 0)
+
+        # alice just wrote, so she stays on the primary; bob doesn't
+        self.assertEqual(self.replica_reads('get', '/api/posts/'), 0)
+        self.client.force_authenticate(self.bob)
+        self.assertGreater(self.replica_reads('get', '/api/posts/'), 0)
+
+    def test_router_outside_requests_and_transactions(self):
+        router = db_router.PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Post), 'default')
+        with db_router.request_scope() as state:
+            self.assertTrue(db_router.read_from_replicas(self.bob))
+            with mock.patch.object(db_router, 'choose_replica', return_value='replica_1'):
+                # TestCase wraps every test in a transaction, which pins reads
+                self.assertEqual(router.db_for_read(Post), 'default')
+            router.db_for_write(Post)
+            self.assertFalse(state.use_replica)
+        self.assertFalse(router.allow_migrate('default', 'social'))
+
+    def test_replicas_from_environment(self):
+        env = {'DB_ENGINE': 'sqlite', 'DB_NAME': 'primary.sqlite3', 'DB_REPLICAS': 'a.sqlite3, b.sqlite3',
+               'DB_CONN_MAX_AGE': '30'}
+        with mock.patch.dict(os.environ, env):
+            config, replicas = databases.from_env('.')
+        self.assertEqual(replicas, ['replica_1', 'replica_2'])
+        self.assertEqual(config['replica_2']['NAME'], 'b.sqlite3')
+        self.assertEqual(config['replica_1']['TEST'], {'MIRROR': 'default'})
+        self.assertEqual(config['default']['CONN_MAX_AGE'], 30)
+        self.assertTrue(config['default']['CONN_HEALTH_CHECKS'])
+
+
+def jpeg_upload(name='photo.jpg', size=(1200, 800), orientation=None):
+    exif = Image.Exif()
+    exif[0x010F] = 'Camera maker'
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(IMAGE_PROCESSING_ASYNC=False, IMAGE_VARIANT_WIDTHS=(160, 640), PROFILE_PICTURE_WIDTHS=(64,))
+class ImagePipelineTests(SocialTestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+        super().setUp()
+
+    def test_post_upload_gets_variants_and_placeholder(self):
+        response = self.client.post('/api/posts/', {'content': 'pic', 'image': jpeg_upload()}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        post = Post.objects.get(pk=response.data['id'])
+        self.assertEqual((post.image_width, post.image_height), (1200, 800))
+        self.assertEqual(len(post.image_placeholder), 6 + 2 * 11)
+        self.assertEqual(post.image_variants['source'], post.image.name)
+        widths = sorted({(item['width'], item['height']) for item in post.image_variants['items']})
+        self.assertEqual(widths, [(160, 107), (640, 427), (1200, 800)])
+
+        with Image.open(post.image.path) as stored:
+            self.assertFalse(stored.getexif())
+        # The upload with its EXIF data is gone, only the stripped copy is left
+        originals = [
+            os.path.join(path, name) for path, _, names in os.walk(settings.MEDIA_ROOT)
+            for name in names if images.VARIANTS_DIR not in path
+        ]
+        self.assertEqual(originals, [post.image.path])
+        data = self.client.get(f'/api/posts/{post.id}/').data
+        self.assertEqual(data['image_placeholder'], post.image_placeholder)
+        self.assertEqual(data['image_srcset']['webp'].count('w, '), 2)
+        self.assertIn('.webp 160w', data['image_srcset']['webp'])
+        self.assertTrue(data['image_srcset']['jpeg'].startswith('http://testserver/media/'))
+
+    def test_orientation_is_applied(self):
+        post = Post.objects.create(author=self.alice, content='pic', image=jpeg_upload(size=(300, 200), orientation=6))
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (200, 300))
+
+    def test_full_save_keeps_metadata_and_replacing_reprocesses(self):
+        post = Post.objects.create(author=self.alice, content='pic', image=jpeg_upload())
+        stale = Post.objects.get(pk=post.pk)
+        stale.refresh_from_db()
+        processed = stale.image_variants
+        stale.content = 'edited'
+        stale.save()
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants, processed)
+
+        post.image = jpeg_upload('other.jpg', size=(100, 100))
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.image_width, 100)
+        self.assertNotEqual(post.image.name, processed['source'])
+        self.assertEqual(post.image_variants['source'], post.image.name)
+
+    def test_profile_picture(self):
+        profile = self.alice.profile
+        response = self.client.patch(
+            f'/api/profiles/{profile.id}/', {'profile_picture': jpeg_upload(size=(500, 500))}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = self.client.get(f'/api/profiles/{profile.id}/').data
+        self.assertEqual(data['picture_width'], 500)
+        self.assertEqual(data['picture_srcset']['webp'].count(','), 1)
+
+    @override_settings(IMAGE_PROCESSING_ASYNC=True)
+    def test_async_processing_waits_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            post = Post.objects.create(author=self.alice, content='pic', image=jpeg_upload())
+        self.assertFalse(Post.objects.get(pk=post.pk).image_variants)
+        with mock.patch.object(images, 'executor') as executor:
+            for callback in callbacks:
+                callback()
+        model, pk = executor.return_value.submit.call_args.args[1:]
+        images.process(model, pk)
+        self.assertEqual(Post.objects.get(pk=post.pk).image_width, 1200)
+
+
+class MediaStorageTests(SocialTestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media, IMAGE_PROCESSING_ASYNC=False)
+        override.enable()
+        self.addCleanup(override.disable)
+        super().setUp()
+
+    def save(self, content, name='clip.bin'):
+        return default_storage.save(f'post_images/{name}', ContentFile(content))
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.save(b'x' * 200000)
+        second = self.save(b'x' * 200000, 'copy.bin')
+        self.assertEqual(first, second)
+        self.assertRegex(first, r'^post_images/[0-9a-f]{2}/[0-9a-f]{64}\.bin$')
+        self.assertNotEqual(self.save(b'y'), first)
+        self.assertEqual(len(os.listdir(os.path.dirname(default_storage.path(first)))), 1)
+
+    def test_range_requests_and_etags(self):
+        content = bytes(range(256)) * 40
+        url = f'/media/{self.save(content)}'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertIn('immutable', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(content)}')
+        self.assertEqual(b''.join(response.streaming_content), content[100:200])
+        response = self.client.get(url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), content[-10:])
+        response = self.client.get(url, HTTP_RANGE='bytes=10-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={len(content)}-').status_code, 416)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.post(url).status_code, 405)
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/post_images/missing.jpg').status_code, 404)
+        with open(os.path.join(self.media, 'post_images', '.upload-abc123'), 'wb') as partial:
+            partial.write(content)
+        self.assertEqual(self.client.get('/media/post_images/.upload-abc123').status_code, 404)
+
+    def test_unreferenced_files_are_deleted(self):
+        first = Post.objects.create(author=self.alice, content='pic', image=jpeg_upload())
+        second = Post.objects.create(author=self.alice, content='same pic', image=jpeg_upload())
+        first.refresh_from_db()
+        second.refresh_from_db()
+        shared = images.files_of(images.SPECS[Post], first)
+        self.assertEqual(shared, images.files_of(images.SPECS[Post], second))
+
+        # Still used by the second post
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        for name in shared:
+            self.assertTrue(default_storage.exists(name))
+
+        second.image = jpeg_upload('other.jpg', size=(100, 100))
+        second.save()
+        for name in shared:
+            self.assertFalse(default_storage.exists(name))
+        second.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual([files for _, _, files in os.walk(self.media) if files], [])
+
+    def test_collect_media_keeps_referenced_files(self):
+        post = Post.objects.create(author=self.alice, content='pic', image=jpeg_upload())
+        post.refresh_from_db()
+        orphan = self.save(b'orphan')
+        kept = [post.image.name] + [item['name'] for item in post.image_variants['items']]
+
+        call_command('collect_media', grace_hours=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        for name in kept:
+            self.assertTrue(default_storage.exists(name))
+
+
+TEST_RATES = {'read': '3/min', 'write': '2/min', 'auth': '2/min'}
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': TEST_RATES})
+class ThrottlingTests(SocialTestCase):
+    def setUp(self):
+        for reset in (caches['default'].clear, throttling.local_buckets.clear):
+            # Don't leave spent buckets behind for the next test
+            reset()
+            self.addCleanup(reset)
+        super().setUp()
+        self.post = Post.objects.create(author=self.alice, content='hello')
+
+    def test_read_budget_runs_out_and_refills(self):
+        remaining = [self.client.get('/api/posts/feed/')['RateLimit-Remaining'] for _ in range(3)]
+        self.assertEqual(remaining, ['2', '1', '0'])
+        response = self.client.get('/api/posts/feed/')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(response['Retry-After'], ('19', '20'))
+        self.assertEqual(response['RateLimit-Policy'], '3;w=60;name="read"')
+
+        # Writes have their own budget
+        self.assertEqual(self.client.put(f'/api/posts/{self.post.id}/like/').status_code, 200)
+
+        later = throttling.time.time() + 20
+        with mock.patch.object(throttling.time, 'time', return_value=later):
+            self.assertEqual(self.client.get('/api/posts/feed/').status_code, 200)
+            self.assertEqual(self.client.get('/api/posts/feed/').status_code, 429)
+
+    def test_auth_is_limited_per_address(self):
+        client = APIClient()
+        credentials = {'username': 'alice', 'password': 'wrong'}
+        self.assertEqual(client.post('/api/auth/token/', credentials).status_code, 401)
+        self.assertEqual(client.post('/api/auth/register/', {}).status_code, 400)
+        self.assertEqual(client.post('/api/auth/token/', credentials).status_code, 429)
+        # Signed-in reads are unaffected
+        self.assertEqual(self.client.get('/api/posts/feed/').status_code, 200)
+
+    @override_settings(THROTTLE_CACHE_ALIAS='missing')
+    def test_falls_back_to_local_buckets(self):
+        with self.assertLogs('social.throttling', 'WARNING'):
+            statuses = [self.client.get('/api/posts/feed/').status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+
+
+    def test_locked_bucket_refuses_instead_of_going_local(self):
+        backend = caches['default']
+        backend.add(f'throttle:read:user:{self.alice.id}:lock', 'someone-else', 60)
+        with mock.patch.object(throttling.time, 'sleep'):
+            response = self.client.get('/api/posts/feed/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(throttling.local_buckets.buckets, {})
+        # Someone else's lock is left alone
+        self.assertEqual(backend.get(f'throttle:read:user:{self.alice.id}:lock'), 'someone-else')
+
+    def test_overrunning_holder_keeps_the_new_lock(self):
+        backend = caches['default']
+        real_get = backend.get
+
+        def get(key, *args, **kwargs):
+            if key.endswith(':lock'):
+                # Our lock expired meanwhile and another worker took it
+                backend.set(key, 'someone-else', 60)
+            return real_get(key, *args, **kwargs)
+        with mock.patch.object(backend, 'get', side_effect=get):
+            self.assertTrue(throttling.consume('throttle:test', 5, 60).allowed)
+        self.assertEqual(backend.get('throttle:test:lock'), 'someone-else')
+
+
+class ClaimsAuthenticationTests(SocialTestCase):
+    def setUp(self):
+        for reset in (caches['default'].clear, authentication.denylist.clear, authentication.token_cache.clear):
+            reset()
+            self.addCleanup(reset)
+        super().setUp()
+        self.post = Post.objects.create(author=self.bob, content='hello')
+        response = self.client.post('/api/auth/token/', {'username': 'alice', 'password': 'pass12345'})
+        self.tokens = response.json()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {self.tokens["access"]}')
+
+    def user_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries.captured_queries if 'FROM "auth_user"' in q['sql']]
+
+    def test_reads_skip_the_user_query(self):
+        self.user_queries('/api/messages/unread_count/')
+        self.assertEqual(self.user_queries('/api/messages/unread_count/'), [])
+        self.assertEqual(self.user_queries('/api/posts/feed/'), [])
+        self.assertEqual(self.user_queries('/api/posts/explore/'), [])
+        # Writes that need the row still get it
+        response = self.api.put(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(response.data['likes_count'], 1)
+        self.assertEqual(self.api.post(f'/api/profiles/{self.alice.profile.id}/follow/').status_code, 400)
+
+    def test_tokens_are_validated_once(self):
+        with mock.patch.object(
+            authentication.JWTAuthentication, 'get_validated_token', autospec=True,
+            side_effect=authentication.JWTAuthentication.get_validated_token,
+        ) as validate:
+            self.api.get('/api/messages/unread_count/')
+            self.api.get('/api/messages/unread_count/')
+        self.assertEqual(validate.call_count, 1)
+
+    def test_revoked_tokens_are_refused(self):
+        self.assertEqual(self.api.post('/api/auth/revoke/').status_code, 200)
+        self.assertEqual(self.api.get('/api/messages/unread_count/').status_code, 401)
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+        # After the denylist reloads from the database as well
+        authentication.denylist.clear()
+        self.assertEqual(self.api.get('/api/messages/unread_count/').status_code, 401)
+        fresh = self.client.post('/api/auth/token/', {'username': 'alice', 'password': 'pass12345'}).json()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {fresh["access"]}')
+        self.assertEqual(self.api.get('/api/messages/unread_count/').status_code, 200)
+
+    def test_refresh_reads_claims_again(self):
+        User.objects.filter(pk=self.alice.pk).update(username='alicia')
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AccessToken(response.json()['access'])['username'], 'alicia')
+        self.assertEqual(RefreshToken(response.json()['refresh'])['username'], 'alicia')
+
+        User.objects.filter(pk=self.alice.pk).update(is_active=False)
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': response.json()['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+    def test_deactivation_revokes_tokens(self):
+        self.alice.is_active = False
+        self.alice.save()
+        self.assertEqual(self.api.get('/api/messages/unread_count/').status_code, 401)
+
+        # Only the deactivating save revokes
+        revoked = Profile.objects.values_list('token_version', 'tokens_revoked_at').get(user=self.alice)
+        self.alice.first_name = 'Alicia'
+        self.alice.save()
+        self.alice.save(update_fields=['first_name'])
+        self.assertEqual(
+            Profile.objects.values_list('token_version', 'tokens_revoked_at').get(user=self.alice), revoked
+        )
+
+
+class MetricsTests(SocialTestCase):
+    accounts = ('alice', 'admin')
+    account_fields = {'admin': {'is_staff': True}}
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        super().setUp()
+        Post.objects.create(author=self.alice, content='hello')
+
+    def scrape(self):
+        response = self.client_for(self.admin).get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_requests_are_recorded_per_view_action(self):
+        self.client.get('/api/posts/feed/')
+        self.client.get('/api/posts/feed/')
+        self.client.get('/api/messages/unread_count/')
+        text = self.scrape()
+
+        self.assertIn('social_http_requests_total{endpoint="PostViewSet.feed",method="GET",status="200"} 2', text)
+        self.assertIn('social_http_requests_total{endpoint="MessageViewSet.unread_count",method="GET",status="200"} 1', text)
+        for name in ('social_http_request_duration_seconds', 'social_db_queries_per_request',
+                     'social_db_duration_seconds', 'social_serializer_duration_seconds', 'social_render_duration_seconds',
+                     'social_http_response_size_bytes'):
+            self.assertIn(f'{name}_count{{endpoint="PostViewSet.feed"}} 2', text)
+            self.assertIn(f'{name}_bucket{{endpoint="PostViewSet.feed",le="+Inf"}} 2', text)
+        for name in ('social_serializer_duration_seconds', 'social_render_duration_seconds'):
+            spent = re.search(name + r'_sum\{endpoint="PostViewSet.feed"\} (\S+)', text)
+            self.assertGreater(float(spent.group(1)), 0)
+
+    def test_nested_serializers_are_timed_once(self):
+        sample = metrics.Sample()
+        token = metrics._current.set(sample)
+        self.addCleanup(metrics._current.reset, token)
+        outer = metrics.timed_serializer(lambda serializer, data: inner(serializer, data))
+        inner = metrics.timed_serializer(lambda serializer, data: sample.serializing)
+        self.assertEqual(outer(None, None), 1)
+        self.assertGreater(sample.serializer_time, 0)
+        self.assertEqual(sample.serializing, 0)
+
+    def test_metrics_are_admin_only(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(APIClient().get('/metrics').status_code, 401)
+
+    def test_repeated_statements_are_flagged(self):
+        sample = metrics.Sample()
+        execute = lambda sql, params, many, context: None
+        for user_id in range(4):
+            sample(execute, f'SELECT * FROM "auth_user" WHERE "id" = {user_id}', None, False, {})
+        sample(execute, 'SELECT * FROM "social_post" WHERE "id" IN (%s, %s)', None, False, {})
+        sample(execute, 'SELECT * FROM "social_post" WHERE "id" IN (%s, %s, %s)', None, False, {})
+
+        self.assertEqual(sample.queries, 6)
+        self.assertEqual(
+            list(sample.repeated().values()), [('SELECT * FROM "auth_user" WHERE "id" = ?', 4)]
+        )
+        metrics.registry.record('ProfileViewSet.list', 'GET', 200, sample, sample.repeated())
+        self.assertIn('social_db_duplicate_queries_total{endpoint="ProfileViewSet.list"} 3', self.scrape())
+
+    def test_sampled_slow_requests_keep_a_profile(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS_PROFILE_SAMPLE_RATE=1, METRICS_SLOW_REQUEST_MS=0, METRICS_PROFILE_DIR=directory):
+            with self.assertLogs('social.metrics', 'WARNING'):
+                response = self.client.get('/api/posts/feed/')
+        self.assertEqual(os.listdir(directory), [response['X-Profile']])
+        self.assertIn('social_profiles_saved_total{endpoint="PostViewSet.feed"} 1', self.scrape())
+
+
+class CompiledSerializationTests(SocialTestCase):
+    def setUp(self):
+        super().setUp()
+        Profile.objects.filter(user=self.alice).update(bio='ünïcode \u2028 bio')
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        self.post = Post.objects.create(author=self.bob, content='hello "world" \u2029')
+        Post.objects.create(author=self.alice, content='mine')
+        self.post.likes.add(self.alice)
+        comment = Comment.objects.create(post=self.post, author=self.alice, content='first')
+        Comment.objects.create(post=self.post, author=self.bob, parent=comment, content='reply')
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='hi')
+
+    def responses(self):
+        cache.invalidate_all()
+        paths = [
+            '/api/posts/feed/', '/api/posts/', f'/api/posts/{self.post.id}/', f'/api/users/{self.bob.id}/posts/',
+            f'/api/profiles/{self.alice.profile.id}/', f'/api/users/{self.alice.id}/', '/api/messages/', '/api/messages/conversations/',
+            f'/api/comments/?post={self.post.id}',
+        ]
+        responses = {}
+        for path in paths:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+            responses[path] = response.content
+        return responses
+
+    def test_output_matches_drf_field_rendering(self):
+        compiled = self.responses()
+        with override_settings(SERIALIZER_COMPILED=False):
+            plain = self.responses()
+        for path in plain:
+            self.assertEqual(compiled[path], plain[path], path)
+        self.assertIn(b'"replies":[{', compiled[f'/api/posts/{self.post.id}/'])
+
+    def test_fast_renderer_matches_json_renderer(self):
+        from datetime import datetime, timezone as dt_timezone
+        from decimal import Decimal
+        from rest_framework.renderers import JSONRenderer
+        from rest_framework.utils.serializer_helpers import ReturnDict
+        from .renderers import FastJSONRenderer
+
+        data = [
+            ReturnDict({'text': 'ünïcode \u2028 \u2029 "quoted" \\ \n', 'none': None, 'flag': True}, serializer=None),
+            {1: 'int key', 'when': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc)},
+            {'price': Decimal('1.50'), 'ratio': 0.25, 'big': 2 ** 40, 'nested': [[], {}, ()]},
+        ]
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        feed = self.client.get('/api/posts/feed/').data
+        self.assertEqual(FastJSONRenderer().render(feed), JSONRenderer().render(feed))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+        indented = FastJSONRenderer().render(data, 'application/json; indent=2')
+        self.assertEqual(indented, JSONRenderer().render(data, 'application/json; indent=2'))
+
+
+class ConditionalRequestTests(SocialTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(author=self.bob, content='hello')
+
+    def revalidate(self, path, client=None, **headers):
+        client = client or self.client
+        first = client.get(path)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('private', first['Cache-Control'])
+        return first, lambda: client.get(path, HTTP_IF_NONE_MATCH=first['ETag'], **headers)
+
+    def test_unchanged_post_is_not_sent_again(self):
+        path = f'/api/posts/{self.post.id}/'
+        first, again = self.revalidate(path)
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        with self.assertNumQueries(1):
+            response = again()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.content, b'')
+
+        comment = Comment.objects.create(post=self.post, author=self.bob, content='first')
+        self.assertEqual(again().status_code, 200)
+        _, again = self.revalidate(path)
+        comment.content = 'edited'
+        comment.save()
+        self.assertEqual(again().status_code, 200)
+        _, again = self.revalidate(path)
+        self.post.likes.add(self.bob)
+        self.assertEqual(again().status_code, 200)
+
+    def test_post_etags_are_per_viewer(self):
+        path = f'/api/posts/{self.post.id}/'
+        first, _ = self.revalidate(path)
+        response = self.client_for(self.bob).get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_profile_and_user_posts(self):
+        _, profile_again = self.revalidate(f'/api/profiles/{self.bob.profile.id}/')
+        _, posts_again = self.revalidate(f'/api/users/{self.bob.id}/posts/')
+        self.assertEqual(profile_again().status_code, 304)
+        self.assertEqual(posts_again().status_code, 304)
+
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        self.assertEqual(profile_again().status_code, 200)
+        Post.objects.create(author=self.bob, content='second')
+        self.assertEqual(posts_again().status_code, 200)
+
+    def test_user_posts_follow_image_processing_and_renames(self):
+        path = f'/api/users/{self.bob.id}/posts/'
+        Comment.objects.create(post=self.post, author=self.alice, content='first')
+        _, again = self.revalidate(path)
+        with self.assertNumQueries(3):
+            self.assertEqual(again().status_code, 304)
+
+        # What images.process writes, without moving updated_at
+        Post.objects.filter(pk=self.post.pk).update(
+            image='post_images/processed.jpg', image_variants={'source': 'post_images/processed.jpg', 'items': []}
+        )
+        self.assertEqual(again().status_code, 200)
+        _, again = self.revalidate(path)
+        User.objects.filter(pk=self.alice.pk).update(username='alice2')
+        self.assertEqual(again().status_code, 200)
+
+    def test_threads_answer_if_modified_since(self):
+        message = Message.objects.create(sender=self.bob, receiver=self.alice, content='hi')
+        path = f'/api/messages/with/{self.bob.id}/'
+        first, again = self.revalidate(path)
+        self.assertEqual(again().status_code, 304)
+        response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        conversations.mark_read(self.alice, ids=[message.id])
+        self.assertEqual(again().status_code, 200)
+        _, again = self.revalidate(path)
+        message.delete()
+        self.assertEqual(again().status_code, 200)
+
+    def test_writes_and_unknown_ids_are_unaffected(self):
+        self.assertEqual(self.client.get('/api/posts/999999/', HTTP_IF_NONE_MATCH='*').status_code, 404)
+        self.assertEqual(self.client.get('/api/messages/with/999999/').status_code, 404)
+        response = self.client.patch(f'/api/profiles/{self.alice.profile.id}/', {'bio': 'new'}, format='json')
+        self.assertNotIn('ETag', response)
+
+
+class TunedSQLiteTests(TransactionTestCase):
+    def setUp(self):
+        if connection.settings_dict['ENGINE'] != 'social_media_api.sqlite':
+            self.skipTest('DB_SQLITE_TUNED is off')
+
+    def test_pragmas_and_immediate_transactions(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                User.objects.create_user('alice', password='pass12345')
+        self.assertEqual(queries.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        self.people = benchmark.seed(users=8, follows=3, posts=2, comments=1, likes=2, messages=2)
+
+    def test_seed_rebuilds_derived_data(self):
+        self.assertEqual(Post.objects.count(), 16)
+        post = Post.objects.annotate(n=Count('likes')).first()
+        self.assertEqual(post.likes_count, post.n)
+        self.assertTrue(Conversation.objects.filter(owner__in=self.people).exists())
+
+    def test_replay_reports_every_endpoint(self):
+        context = benchmark.Context(self.people)
+        recorder, wall = benchmark.replay(benchmark.SCENARIOS, context, benchmark.InProcessClient, iterations=30)
+        results = benchmark.report(recorder, wall)
+
+        self.assertEqual(results['total']['errors'], 0, results['endpoints'])
+        self.assertIn('GET /api/posts/feed/', results['endpoints'])
+        feed = results['endpoints']['GET /api/posts/feed/']
+        self.assertLessEqual(feed['p50_ms'], feed['p95_ms'])
+        self.assertLessEqual(feed['p95_ms'], feed['p99_ms'])
+        self.assertIsNotNone(feed['queries_per_request'])
+        self.assertLessEqual(feed['wire_bytes_per_request'], feed['bytes_per_request'])
+
+    def test_replay_file_scenarios(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as lines:
+            lines.write('{"name": "mine", "method": "GET", "path": "/api/profiles/{profile}/"}\n\n')
+        self.addCleanup(os.remove, lines.name)
+        scenarios = benchmark.load_scenarios(lines.name)
+        recorder, wall = benchmark.replay(
+            scenarios, benchmark.Context(self.people), benchmark.InProcessClient, iterations=5
+        )
+        self.assertEqual(list(recorder.samples), ['GET /api/profiles/{profile}/'])
+        self.assertEqual(benchmark.report(recorder, wall)['total']['statuses'], {'200': 5})
+
+    def test_temporary_run_restarts_through_django(self):
+        with mock.patch('subprocess.run', return_value=mock.Mock(returncode=0)) as run:
+            call_command('benchmark_api', iterations=7, scenarios='feed', output='out.json')
+        command = run.call_args.args[0]
+        self.assertEqual(command[:4], [sys.executable, '-m', 'django', 'benchmark_api'])
+        self.assertIn('--in-place', command)
+        self.assertEqual(command[command.index('--iterations') + 1], '7')
+        self.assertEqual(command[command.index('--output') + 1], os.path.abspath('out.json'))
+        env = run.call_args.kwargs['env']
+        self.assertEqual(env['DJANGO_SETTINGS_MODULE'], settings.SETTINGS_MODULE)
+        self.assertEqual(env['DB_ENGINE'], 'sqlite')
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 0.5), 50)
+        self.assertEqual(benchmark.percentile(values, 0.99), 99)
+        self.assertEqual(benchmark.percentile([7], 0.95), 7)
+
+
+@mock.patch.object(compression, 'brotli', None)
+class CompressionTests(SocialTestCase):
+    def setUp(self):
+        super().setUp()
+        Post.objects.bulk_create([
+            Post(author=self.bob, content=f'post {i} ' + 'lorem ipsum dolor sit amet ' * 10) for i in range(10)
+        ])
+        self.path = f'/api/users/{self.bob.id}/posts/'
+
+    def test_large_list_is_gzipped(self):
+        plain = self.client.get(self.path)
+        response = self.client.get(self.path, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content), len(plain.content) // 3)
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertTrue(response['ETag'].startswith('W/'))
+
+    def test_not_compressed_unless_accepted(self):
+        for header in ('', 'identity', 'gzip;q=0', 'br'):
+            response = self.client.get(self.path, HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(response.has_header('Content-Encoding'), header)
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertEqual(len(response.json()['results']), 10)
+
+    def test_small_bodies_are_sent_as_is(self):
+        response = self.client.get(f'/api/profiles/{self.bob.profile.id}/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertLess(len(response.content), settings.COMPRESSION_MIN_SIZE)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertNotIn('Accept-Encoding', response.get('Vary', ''))
+
+    @override_settings(COMPRESSION_STREAM_SIZE=1024)
+    def test_large_bodies_are_compressed_while_streamed(self):
+        plain = self.client.get(self.path)
+        response = self.client.get(self.path, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain.content)
+
+    @override_settings(COMPRESSION_ENABLED=False)
+    def test_disabled(self):
+        response = self.client.get(self.path, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_negotiation(self):
+        self.assertEqual(compression.negotiate('gzip;q=0.5, br'), 'gzip')
+        self.assertEqual(compression.negotiate('*'), 'gzip')
+        self.assertIsNone(compression.negotiate('*;q=0'))
+        self.assertIsNone(compression.negotiate('deflate'))
+        with mock.patch.object(compression, 'available', return_value=('br', 'gzip')):
+            self.assertEqual(compression.negotiate('gzip, br'), 'br')
+            self.assertEqual(compression.negotiate('gzip, br;q=0.1'), 'gzip')
+
+    def apply(self, response, path='/api/anything/'):
+        request = RequestFactory().get(path, HTTP_ACCEPT_ENCODING='gzip')
+        return compression.apply(request, response)
+
+    def test_skips_media_ranges_and_encoded_bodies(self):
+        body = os.urandom(4096)
+        self.assertFalse(self.apply(HttpResponse(body, content_type='image/webp')).has_header('Content-Encoding'))
+        ranged = HttpResponse(b'{}' * 4096, content_type='application/json', headers={'Accept-Ranges': 'bytes'})
+        self.assertFalse(self.apply(ranged).has_header('Content-Encoding'))
+        encoded = HttpResponse(b'x' * 4096, content_type='text/plain', headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(self.apply(encoded).content, b'x' * 4096)
+        token = HttpResponse(b'{}' * 4096, content_type='application/json')
+        self.assertFalse(self.apply(token, '/api/auth/token/').has_header('Content-Encoding'))
+
+    def test_streaming_response_and_strong_etag(self):
+        response = StreamingHttpResponse((b'line %d\n' % i for i in range(1000)), content_type='text/plain')
+        response['ETag'] = '"abc"'
+        response = self.apply(response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)),
+                         b''.join(b'line %d\n' % i for i in range(1000)))
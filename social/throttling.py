@@ -0,0 +1,179 @@
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+# Token buckets: every (scope, client) pair has a bucket holding up to
+# ``capacity`` tokens that refills continuously at ``capacity / period``
+# tokens per second, and each request takes one token. Clients can burst up
+# to the full budget and are then held to the average rate, instead of being
+# locked out until a fixed window ends.
+#
+# Buckets live in THROTTLE_CACHE_ALIAS so that all workers share them. The
+# read-modify-write of a bucket runs under a short lock taken with
+# cache.add(), which is atomic on locmem, memcached, Redis and database
+# caches. The lock holds a token of its owner, so a holder that overran
+# LOCK_TIMEOUT doesn't release a lock someone else has taken since. A request
+# that can't get the lock in time is refused like one over its budget: a
+# client hammering one bucket hard enough to keep it locked is over it anyway,
+# and falling back to per-process buckets would multiply the limit by the
+# number of workers. Only when the cache is unreachable is the bucket of this
+# process used instead.
+
+DEFAULT_CACHE_ALIAS = 'default'
+LOCK_TIMEOUT = 2  # seconds a crashed holder can keep a bucket locked
+LOCK_ATTEMPTS = 8  # backing off from 1 ms, about a quarter of a second in all
+LOCAL_BUCKETS = 10000
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def parse_rate(rate):
+    """
+    ``'60/min'`` or ``'10/5m'`` -> ``(capacity, period_seconds)``
+    """
+    if rate is None:
+        return None
+    count, period = rate.split('/')
+    multiplier = ''.join(ch for ch in period if ch.isdigit())
+    unit = period[len(multiplier):]
+    if unit not in PERIODS:
+        raise ValueError(f'Unknown throttle period in {rate!r}')
+    return int(count), PERIODS[unit] * int(multiplier or 1)
+
+
+class Decision:
+    def __init__(self, allowed, capacity, tokens, rate):
+        self.allowed = allowed
+        self.capacity = capacity
+        self.remaining = int(tokens)
+        # Seconds until one token is back, and until the bucket is full
+        self.retry_after = 0 if allowed else (1 - tokens) / rate
+        self.reset = (capacity - tokens) / rate
+
+
+def take(state, capacity, rate, now):
+    """
+    Refill the ``(tokens, stamp)`` state to ``now`` and take a token.
+    Returns the new state and the decision.
+    """
+    tokens, stamp = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + max(0.0, now - stamp) * rate)
+    allowed = tokens >= 1
+    if allowed:
+        tokens -= 1
+    return (tokens, now), Decision(allowed, capacity, tokens, rate)
+
+
+class LocalBuckets:
+    """
+    In-process buckets, used when the shared cache is unavailable
+    """
+    def __init__(self, size=LOCAL_BUCKETS):
+        self.size = size
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        with self.lock:
+            state, decision = take(self.buckets.get(key), capacity, rate, time.time())
+            self.buckets[key] = state
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+        return decision
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+local_buckets = LocalBuckets()
+
+
+class LockTimeout(Exception):
+    pass
+
+
+def _shared_take(backend, key, capacity, rate, period):
+    lock = f'{key}:lock'
+    owner = uuid.uuid4().hex
+    for attempt in range(LOCK_ATTEMPTS):
+        if backend.add(lock, owner, LOCK_TIMEOUT):
+            break
+        time.sleep(0.001 * 2 ** attempt)
+    else:
+        raise LockTimeout(key)
+    try:
+        state, decision = take(backend.get(key), capacity, rate, time.time())
+        # An untouched bucket is full again after one period
+        backend.set(key, state, period + 1)
+        return decision
+    finally:
+        # Not ours any more if we overran LOCK_TIMEOUT
+        if backend.get(lock) == owner:
+            backend.delete(lock)
+
+
+def consume(key, capacity, period):
+    rate = capacity / period
+    alias = getattr(settings, 'THROTTLE_CACHE_ALIAS', DEFAULT_CACHE_ALIAS)
+    try:
+        return _shared_take(caches[alias], key, capacity, rate, period)
+    except LockTimeout:
+        logger.info('Throttle bucket %s stayed locked, refusing the request', key)
+        return Decision(False, capacity, 0, rate)
+    except Exception:
+        logger.warning('Throttle cache %r unavailable, using the local bucket', alias, exc_info=True)
+        return local_buckets.take(key, capacity, rate)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    One budget per scope and client. The scope is the view's
+    ``throttle_scope`` when set (e.g. ``'auth'``), otherwise ``'read'`` for
+    safe methods and ``'write'`` for the rest. Authenticated clients are
+    identified by user, anonymous ones by address.
+    """
+    cache_prefix = 'throttle'
+
+    def get_scope(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope:
+            return scope
+        return 'read' if request.method in SAFE_METHODS else 'write'
+
+    def get_rate(self, scope):
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        return parse_rate(rates.get(scope))
+
+    def get_client(self, request, scope):
+        if request.user and request.user.is_authenticated and scope != 'auth':
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        rate = self.get_rate(scope)
+        if rate is None:
+            return True
+        capacity, period = rate
+        decision = consume(f'{self.cache_prefix}:{scope}:{self.get_client(request, scope)}', capacity, period)
+        self.decision = decision
+        # Picked up by RateLimitHeadersMiddleware
+        request._request.rate_limit = (scope, period, decision)
+        return decision.allowed
+
+    def wait(self):
+        # DRF truncates Retry-After to whole seconds
+        return math.ceil(self.decision.retry_after)
@@ -0,0 +1,148 @@
+from django.conf import settings
+from django.db.models import F, Q
+
+from .models import Follow, Post, Profile, TimelineEntry
+
+# Authors with at least this many followers are not fanned out on write;
+# their posts are merged into followers' feeds at read time instead.
+DEFAULT_FANOUT_THRESHOLD = 5000
+# Number of recent posts copied into a timeline when a follow is created.
+DEFAULT_BACKFILL_LIMIT = 200
+BATCH_SIZE = 1000
+
+
+def fanout_threshold():
+    return getattr(settings, 'TIMELINE_FANOUT_THRESHOLD', DEFAULT_FANOUT_THRESHOLD)
+
+
+def backfill_limit():
+    return getattr(settings, 'TIMELINE_BACKFILL_LIMIT', DEFAULT_BACKFILL_LIMIT)
+
+
+def is_high_fanout(user_id):
+    return Profile.objects.filter(
+        user_id=user_id, followers_count__gte=fanout_threshold()
+    ).exists()
+
+
+def high_fanout_following_ids(user):
+    """
+    Ids of followed authors whose posts are read on demand instead of being
+    materialized into timelines
+    """
+    return list(
+        Follow.objects.filter(
+            follower_id=user.id, following__profile__followers_count__gte=fanout_threshold()
+        ).values_list('following_id', flat=True)
+    )
+
+
+def _write_entries(entries):
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def fan_out_post(post):
+    """
+    Push a freshly created post into the timeline of every follower of its author
+    """
+    if is_high_fanout(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        following_id=post.author_id
+    ).values_list('follower_id', flat=True)
+
+    batch = []
+    for follower_id in follower_ids.iterator(chunk_size=BATCH_SIZE):
+        batch.append(TimelineEntry(
+            user_id=follower_id,
+            post_id=post.id,
+            author_id=post.author_id,
+            created_at=post.created_at,
+        ))
+        if len(batch) >= BATCH_SIZE:
+            _write_entries(batch)
+            batch = []
+    if batch:
+        _write_entries(batch)
+
+
+def backfill(follower, followed):
+    """
+    Copy the most recent posts of a newly followed author into the follower's timeline
+    """
+    if is_high_fanout(followed.id):
+        return
+    posts = Post.objects.filter(author_id=followed.id).order_by('-created_at').values_list(
+        'id', 'created_at'
+    )[:backfill_limit()]
+    _write_entries([
+        TimelineEntry(user_id=follower.id, post_id=post_id, author_id=followed.id, created_at=created_at)
+        for post_id, created_at in posts
+    ])
+
+
+def trim(follower, unfollowed):
+    """
+    Remove an unfollowed author's posts from the follower's timeline
+    """
+    TimelineEntry.objects.filter(user_id=follower.id, author_id=unfollowed.id).delete()
+
+
+def catch_up(author):
+    """
+    After an unfollow: if it took the author just below the fan-out
+    threshold, copy their recent posts into every follower's timeline. Posts
+    written while above it were only read on demand, and would otherwise
+    drop out of the feeds now that the author is read from timelines.
+    """
+    if not Profile.objects.filter(user_id=author.id, followers_count=fanout_threshold() - 1).exists():
+        return
+    posts = list(Post.objects.filter(author_id=author.id).order_by('-created_at').values_list(
+        'id', 'created_at'
+    )[:backfill_limit()])
+    if not posts:
+        return
+    follower_ids = Follow.objects.filter(following_id=author.id).values_list('follower_id', flat=True)
+
+    batch = []
+    for follower_id in follower_ids.iterator(chunk_size=BATCH_SIZE):
+        batch.extend(
+            TimelineEntry(user_id=follower_id, post_id=post_id, author_id=author.id, created_at=created_at)
+            for post_id, created_at in posts
+        )
+        if len(batch) >= BATCH_SIZE:
+            _write_entries(batch)
+            batch = []
+    if batch:
+        _write_entries(batch)
+
+
+def home_timeline(user):
+    """
+    Posts for the user's home feed: materialized entries plus, for authors
+    above the fan-out threshold, their posts read directly.
+
+    Posts carry ``feed_created_at`` and ``feed_post_id``, which
+    TimelinePagination orders and pages on. With no such authors they come
+    from the joined timeline entries, so the scan runs on the entries'
+    ``(user, -created_at, -post)`` index.
+    """
+    high_fanout_ids = high_fanout_following_ids(user)
+    if not high_fanout_ids:
+        return Post.objects.filter(timeline_entries__user_id=user.id).annotate(
+            feed_created_at=F('timeline_entries__created_at'), feed_post_id=F('timeline_entries__post_id'),
+        ).order_by('-feed_created_at', '-feed_post_id')
+
+    entry_post_ids = TimelineEntry.objects.filter(user_id=user.id).values('post_id')
+    return Post.objects.filter(
+        Q(id__in=entry_post_ids) | Q(author_id__in=high_fanout_ids)
+    ).annotate(feed_created_at=F('created_at'), feed_post_id=F('id')).order_by('-feed_created_at', '-feed_post_id')
+
+
+def rebuild(user):
+    """
+    Recompute a user's timeline from scratch from their current follows
+    """
+    TimelineEntry.objects.filter(user_id=user.id).delete()
+    for follow in Follow.objects.filter(follower_id=user.id).select_related('following'):
+        backfill(user, follow.following)
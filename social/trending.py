@@ -0,0 +1,156 @@
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Post, TrendingPost
+
+# Scores are stored as log(sum(weight * 2 ** ((event_time - EPOCH) / half_life))).
+# Adding an event only touches one row, and because every score shares the
+# same reference point, ranking by the stored value is the same as ranking by
+# engagement decayed to "now" - no periodic rescoring is needed.
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+DEFAULT_HALF_LIFE_HOURS = 12
+# Posts older than this stop collecting engagement and leave the pool
+DEFAULT_MAX_AGE_HOURS = 72
+# Candidates kept by refresh() and scanned per explore page
+DEFAULT_POOL_SIZE = 500
+
+POST_WEIGHT = 1.0
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 1.5
+REPOST_WEIGHT = 2.0
+
+
+def half_life():
+    return timedelta(hours=getattr(settings, 'TRENDING_HALF_LIFE_HOURS', DEFAULT_HALF_LIFE_HOURS))
+
+
+def max_age():
+    return timedelta(hours=getattr(settings, 'TRENDING_MAX_AGE_HOURS', DEFAULT_MAX_AGE_HOURS))
+
+
+def pool_size():
+    return getattr(settings, 'TRENDING_POOL_SIZE', DEFAULT_POOL_SIZE)
+
+
+def event_score(weight, when):
+    """
+    Log-space contribution of one interaction of ``weight`` at time ``when``
+    """
+    elapsed = (when - EPOCH) / half_life()
+    return math.log(weight) + elapsed * math.log(2)
+
+
+def _log_add(a, b):
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def _log_subtract(a, b):
+    """
+    log(exp(a) - exp(b)), or None when nothing meaningful is left
+    """
+    if b >= a:
+        return None
+    return a + math.log1p(-math.exp(b - a))
+
+
+def is_eligible(post_created_at, now=None):
+    return (now or timezone.now()) - post_created_at <= max_age()
+
+
+def post_created(post):
+    """
+    Enter a new post into the candidate pool
+    """
+    TrendingPost.objects.get_or_create(post_id=post.id, defaults={
+        'author_id': post.author_id,
+        'post_created_at': post.created_at,
+        'score': event_score(POST_WEIGHT, post.created_at),
+    })
+
+
+def record(post_ids, weight, when=None):
+    """
+    Add (or, with a negative weight, withdraw) one interaction on each post
+    """
+    when = when or timezone.now()
+    posts = Post.objects.filter(
+        pk__in=post_ids, created_at__gte=when - max_age()
+    ).only('id', 'author_id', 'created_at')
+    record_posts(posts, weight, when)
+
+
+def record_posts(posts, weight, when=None):
+    """
+    record() for post instances already at hand
+    """
+    when = when or timezone.now()
+    contribution = event_score(abs(weight), when)
+
+    for post in posts:
+        post_id, author_id, created_at = post.pk, post.author_id, post.created_at
+        if not is_eligible(created_at, when):
+            continue
+        # Inside the caller's transaction when there is one; the row lock
+        # below is held until that commits
+        with transaction.atomic(savepoint=False):
+            row = TrendingPost.objects.select_for_update().filter(post_id=post_id).first()
+            if row is None:
+                if weight < 0:
+                    continue
+                # Two first engagements can both get here; the one whose
+                # insert is ignored adds to the row the other created
+                TrendingPost.objects.bulk_create([TrendingPost(
+                    post_id=post_id, author_id=author_id, post_created_at=created_at,
+                    score=event_score(POST_WEIGHT, created_at),
+                )], ignore_conflicts=True)
+                row = TrendingPost.objects.select_for_update().filter(post_id=post_id).first()
+                if row is None:
+                    continue
+            if weight > 0:
+                row.score = _log_add(row.score, contribution)
+            else:
+                remaining = _log_subtract(row.score, contribution)
+                # Never drop below the post's own creation score
+                row.score = max(remaining or float('-inf'), event_score(POST_WEIGHT, created_at))
+            row.save(update_fields=['score', 'updated_at'])
+
+
+def refresh():
+    """
+    Drop posts that aged out and trim the pool to the best candidates.
+    Meant to run periodically (see the refresh_trending command).
+    """
+    expired, _ = TrendingPost.objects.filter(post_created_at__lt=timezone.now() - max_age()).delete()
+    keep = list(TrendingPost.objects.order_by('-score', '-post_id').values_list('post_id', flat=True)[:pool_size()])
+    trimmed, _ = TrendingPost.objects.exclude(post_id__in=keep).delete()
+    return expired, trimmed
+
+
+def rebuild():
+    """
+    Seed the pool from recent posts and their current counters. Interaction
+    times are not stored, so they are approximated by the post's creation time.
+    """
+    TrendingPost.objects.all().delete()
+    since = timezone.now() - max_age()
+    rows = []
+    for post in Post.objects.filter(created_at__gte=since).only(
+        'id', 'author_id', 'created_at', 'likes_count', 'reposts_count', 'comments_count'
+    ).iterator():
+        weight = (
+            POST_WEIGHT + LIKE_WEIGHT * post.likes_count
+            + REPOST_WEIGHT * post.reposts_count + COMMENT_WEIGHT * post.comments_count
+        )
+        rows.append(TrendingPost(
+            post_id=post.id, author_id=post.author_id, post_created_at=post.created_at,
+            score=event_score(weight, post.created_at),
+        ))
+    TrendingPost.objects.bulk_create(rows, batch_size=1000)
+    refresh()
+    return TrendingPost.objects.count()
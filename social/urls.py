@@ -1,8 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenObtainPairView
 from . import views
-from .views import CustomTokenObtainPairView
+from .views import CustomTokenObtainPairView, CustomTokenRefreshView
 
 router = DefaultRouter()
 router.register(r'users', views.UserViewSet)
@@ -13,7 +13,10 @@ router.register(r'messages', views.MessageViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('cache/stats/', views.CacheStatsView.as_view(), name='cache_stats'),
     path('auth/register/', views.RegisterView.as_view(), name='register'),
     path('auth/token/', CustomTokenObtainPairView.as_view(), name='custom_token_obtain_pair'),
-    path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('auth/token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
+    path('auth/revoke/', views.RevokeTokensView.as_view(), name='revoke_tokens'),
 ] 
\ No newline at end of file
@@ -1,20 +1,30 @@
+from django.http import HttpResponse
 from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
-from .models import Profile, Post, Comment, Message, Follow
+from .models import Profile, Post, Comment, Message, Follow, Conversation, SearchTerm, TrendingPost
+from . import (
+    authentication, cache, comment_tree, conditional, conversations, db_router, interactions, metrics, notifications,
+    search, timeline, trending,
+)
+from .queries import comment_list_queryset, post_list_queryset
+from .pagination import (
+    ConversationPagination, KeysetPagination, OldestFirstKeysetPagination, RecentExplorePagination,
+    SearchResultsPagination, StandardResultsSetPagination, TimelinePagination, TrendingPagination
+)
 from .serializers import (
     UserSerializer, ProfileSerializer, PostSerializer,
-    CommentSerializer, MessageSerializer, RegisterSerializer
+    CommentSerializer, MessageSerializer, RegisterSerializer, ConversationSerializer,
+    MarkReadSerializer
 )
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.db.models import Q, Max
-from rest_framework.pagination import PageNumberPagination
 from rest_framework import viewsets, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -25,12 +35,13 @@ from django.db.models import Q
 
 class RegisterView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_scope = 'auth'
 
     def post(self, request):
         serializer = RegisterSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            refresh = RefreshToken.for_user(user)
+            refresh = authentication.tokens_for(user)
             return Response({
                 'user': UserSerializer(user).data,
                 'refresh': str(refresh),
@@ -38,21 +49,53 @@ class RegisterView(APIView):
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class UserViewSet(viewsets.ModelViewSet):
+class ReplicaReadMixin:
+    """
+    Serve the listed read-only actions from a read replica when one is
+    configured (see db_router.py)
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        action_name = getattr(self, 'action', None) or request.method.lower()
+        if request.method in permissions.SAFE_METHODS and action_name in self.replica_actions:
+            db_router.read_from_replicas(request.user)
+
+def interaction_response(request, instance, name, counter, flag, states):
+    """
+    Like/repost endpoints: PUT links, DELETE unlinks, POST toggles and GET
+    only reports. Answers with the resulting state and the fresh count.
+    """
+    user = request.user
+    if request.method == 'GET':
+        active = user.is_authenticated and getattr(instance, name).filter(pk=user.pk).exists()
+    elif request.method == 'PUT':
+        interactions.add(instance, name, user)
+        active = True
+    elif request.method == 'DELETE':
+        interactions.remove(instance, name, user)
+        active = False
+    else:
+        active = interactions.toggle(instance, name, user)
+    return Response({
+        'status': states[active],
+        flag: active,
+        counter: interactions.counter(instance, counter),
+    })
+
+class UserViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    replica_actions = ('list', 'retrieve', 'profile', 'posts', 'liked_posts', 'reposted_posts')
     
-    # Add filtering and search backends
+    # Add filtering backends; ?search= is answered by the search index in get_queryset
     filter_backends = [
         DjangoFilterBackend,
-        filters.SearchFilter,
         filters.OrderingFilter
     ]
     
-    # Configure search fields
-    search_fields = ['username', 'first_name', 'last_name', 'email']
-    
     # Configure filterable fields
     filterset_fields = ['is_active', 'is_staff']
     
@@ -69,12 +112,11 @@ class UserViewSet(viewsets.ModelViewSet):
         # Custom search parameter handling
         search_query = self.request.query_params.get('search', None)
         if search_query:
-            queryset = queryset.filter(
-                Q(username__icontains=search_query) |
-                Q(first_name__icontains=search_query) |
-                Q(last_name__icontains=search_query) |
-                Q(email__icontains=search_query)
-            )
+            matching = Q(id__in=search.matching_ids(SearchTerm.USER, search_query))
+            if '@' in search_query:
+                # Whole addresses; only their local part is indexed
+                matching |= Q(email__iexact=search_query.strip())
+            queryset = queryset.filter(matching)
         
         # Additional custom filters
         username = self.request.query_params.get('username', None)
@@ -94,31 +136,40 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = ProfileSerializer(profile)
         return Response(serializer.data)
 
-    @action(detail=True, methods=['get'])
+    def paginated_posts(self, posts):
+        posts = post_list_queryset(self.request.user, posts)
+        page = self.paginate_queryset(posts)
+        serializer = PostSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
+    @conditional.conditional(conditional.user_posts)
     def posts(self, request, pk=None):
         user = self.get_object()
-        posts = Post.objects.filter(author=user).order_by('-created_at')
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data)
+        posts = Post.objects.filter(author=user)
+        return self.paginated_posts(posts)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
     def liked_posts(self, request, pk=None):
         user = self.get_object()
-        posts = Post.objects.filter(likes=user).order_by('-created_at')
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data)
+        posts = Post.objects.filter(likes=user)
+        return self.paginated_posts(posts)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
     def reposted_posts(self, request, pk=None):
         user = self.get_object()
-        posts = Post.objects.filter(reposts=user).order_by('-created_at')
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data)
+        posts = Post.objects.filter(reposts=user)
+        return self.paginated_posts(posts)
 
-class ProfileViewSet(viewsets.ModelViewSet):
+class ProfileViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    replica_actions = ('list', 'retrieve', 'followers', 'following')
+
+    @conditional.conditional(conditional.profile)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     @action(detail=True, methods=['get'])
     def followers(self, request, pk=None):
@@ -147,98 +198,116 @@ class ProfileViewSet(viewsets.ModelViewSet):
         serializer = ProfileSerializer(following_profiles, many=True)
         return Response(serializer.data)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['put', 'delete', 'post'])
     def follow(self, request, pk=None):
+        """
+        PUT follows, DELETE unfollows and POST toggles. Repeating a PUT or
+        DELETE changes nothing.
+        """
         profile_to_follow = self.get_object()
         user_following = request.user
 
         # Prevent following yourself
-        if user_following == profile_to_follow.user:
+        if profile_to_follow.user_id == user_following.id:
             return Response({"detail": "You cannot follow yourself."}, status=status.HTTP_400_BAD_REQUEST)
 
-        follow_instance, created = Follow.objects.get_or_create(
-            follower=user_following,
-            following=profile_to_follow.user
-        )
-
-        if created:
-            return Response({"status": "followed"}, status=status.HTTP_200_OK)
+        target = profile_to_follow.user
+        if request.method == 'DELETE':
+            following = False
+            changed = interactions.unfollow(user_following, target)
         else:
-            # If it already exists, it means the user was already following, so unfollow
-            follow_instance.delete()
-            return Response({"status": "unfollowed"}, status=status.HTTP_200_OK)
-
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-class PostViewSet(viewsets.ModelViewSet):
+            following = True
+            changed = interactions.follow(user_following, target)
+            if not changed and request.method == 'POST':
+                # Toggle: it already existed, so unfollow
+                following = False
+                changed = interactions.unfollow(user_following, target)
+
+        if changed and following:
+            timeline.backfill(user_following, target)
+        elif changed:
+            timeline.trim(user_following, target)
+            timeline.catch_up(target)
+        return Response({
+            "status": "followed" if following else "unfollowed",
+            "is_following": following,
+            "followers_count": interactions.counter(profile_to_follow, 'followers_count'),
+        }, status=status.HTTP_200_OK)
+
+class PostViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     pagination_class = StandardResultsSetPagination
+    replica_actions = ('list', 'retrieve', 'feed', 'explore', 'comments')
+
+    def get_queryset(self):
+        if self.request.method in permissions.SAFE_METHODS:
+            return post_list_queryset(self.request.user)
+        return Post.objects.all()
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
+        if self.action in ('feed', 'explore'):
+            # Only embed a short preview of each post's comments
+            context['comment_depth'] = 1
+            context['comment_width'] = comment_tree.feed_preview()
         return context
 
-    def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+    @conditional.conditional(conditional.post)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
-    @action(detail=True, methods=['get'])
-    def like(self, request, pk=None):
-        try:
-            post = self.get_object()
-            is_liked = post.likes.filter(id=request.user.id).exists()
-            return Response({
-                'status': 'liked' if is_liked else 'unliked'
-            })
-        except Post.DoesNotExist:
-            return Response(
-                {'detail': 'Post not found.'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+    def perform_create(self, serializer):
+        post = serializer.save(author=self.request.user)
+        timeline.fan_out_post(post)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['get', 'put', 'delete', 'post'])
     def like(self, request, pk=None):
-        try:
-            post = self.get_object()
-            if request.user in post.likes.all():
-                post.likes.remove(request.user)
-                return Response({'status': 'unliked'})
-            else:
-                post.likes.add(request.user)
-                return Response({'status': 'liked'})
-        except Post.DoesNotExist:
-            return Response(
-                {'detail': 'Post not found.'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        return interaction_response(
+            request, self.get_object(), 'likes', 'likes_count', 'is_liked', ('unliked', 'liked')
+        )
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['get', 'put', 'delete', 'post'])
     def repost(self, request, pk=None):
+        return interaction_response(
+            request, self.get_object(), 'reposts', 'reposts_count', 'is_reposted', ('unreposted', 'reposted')
+        )
+
+    @action(detail=True, methods=['get'], pagination_class=OldestFirstKeysetPagination)
+    def comments(self, request, pk=None):
         post = self.get_object()
-        if request.user in post.reposts.all():
-            post.reposts.remove(request.user)
-            return Response({"status": "unreposted"})
-        else:
-            post.reposts.add(request.user)
-            return Response({"status": "reposted"})
+        comments = comment_list_queryset(Comment.objects.filter(post_id=post.id, parent=None))
+        page = self.paginate_queryset(comments)
+        serializer = CommentSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def state(self, request):
+        """
+        Liked/reposted/following flags for the posts on screen: ?ids=1,2,3
+        """
+        try:
+            ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk.strip()]
+        except ValueError:
+            return Response({"detail": "ids must be a comma-separated list of post ids."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > interactions.MAX_STATE_IDS:
+            return Response({"detail": f"At most {interactions.MAX_STATE_IDS} ids are allowed."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        states = interactions.post_states(request.user, ids)
+        return Response({
+            'results': [{'id': pk, **states[pk]} for pk in ids if pk in states]
+        })
+
+    @action(detail=False, methods=['get'], pagination_class=TimelinePagination)
     def feed(self, request):
         try:
-            # Get users that the current user follows
-            following_users = User.objects.filter(
-                follower_relationships__follower=request.user
-            )
-            
-            # Get posts from users that the current user follows
-            posts = Post.objects.filter(
-                author__in=following_users
-            ).order_by('-created_at')
+            # Read the precomputed home timeline of the current user
+            posts = post_list_queryset(request.user, timeline.home_timeline(request.user))
             
             # Apply pagination
             page = self.paginate_queryset(posts)
@@ -248,59 +317,86 @@ class PostViewSet(viewsets.ModelViewSet):
             
             serializer = self.get_serializer(posts, many=True)
             return Response(serializer.data)
+        except APIException:
+            raise
         except Exception as e:
             return Response(
                 {'detail': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], pagination_class=TrendingPagination)
     def explore(self, request):
         try:
-            # Get users that the current user follows
-            following_users = User.objects.filter(
-                follower_relationships__follower=request.user
-            )
-            
-            # Get posts from users that the current user doesn't follow
-            # Exclude the current user's posts as well
-            posts = Post.objects.exclude(
-                author__in=following_users
-            ).exclude(
-                author=request.user
-            ).order_by('-created_at')
-            
-            # Apply pagination
-            page = self.paginate_queryset(posts)
-            if page is not None:
-                serializer = self.get_serializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
-            
-            serializer = self.get_serializer(posts, many=True)
-            return Response(serializer.data)
+            # Skip authors the current user already follows, and the user themself
+            excluded = set(Follow.objects.filter(
+                follower_id=request.user.id
+            ).values_list('following_id', flat=True))
+            excluded.add(request.user.id)
+
+            if RecentExplorePagination.cursor_query_param in request.query_params:
+                return self.recent_explore(request, excluded)
+
+            # Rank from the precomputed pool, then load the page's posts in one query
+            candidates = TrendingPost.objects.only('post_id', 'author_id', 'score')
+            paginator = self.paginator
+            paginator.scan_limit = trending.pool_size()
+            paginator.exclude_authors = excluded
+            page = paginator.paginate_queryset(candidates, request, view=self)
+            if not page and not paginator.truncated and paginator.cursor_query_param not in request.query_params:
+                # Nothing in the pool this user may see
+                return self.recent_explore(request, excluded)
+            posts = post_list_queryset(request.user).in_bulk([c.post_id for c in page])
+            ranked = [posts[c.post_id] for c in page if c.post_id in posts]
+
+            serializer = self.get_serializer(ranked, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        except APIException:
+            raise
         except Exception as e:
             return Response(
                 {'detail': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class CommentViewSet(viewsets.ModelViewSet):
+    def recent_explore(self, request, excluded):
+        """
+        Newest posts from everyone else, for when the trending pool has
+        nothing to show the user
+        """
+        posts = post_list_queryset(request.user).exclude(author__in=excluded)
+        paginator = RecentExplorePagination()
+        page = paginator.paginate_queryset(posts, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+class CommentViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    replica_actions = ('list', 'retrieve', 'replies')
+
+    def get_queryset(self):
+        if self.request.method in permissions.SAFE_METHODS:
+            return comment_list_queryset()
+        return Comment.objects.all()
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['get', 'put', 'delete', 'post'])
     def like(self, request, pk=None):
+        return interaction_response(
+            request, self.get_object(), 'likes', 'likes_count', 'is_liked', ('unliked', 'liked')
+        )
+
+    @action(detail=True, methods=['get'], pagination_class=OldestFirstKeysetPagination)
+    def replies(self, request, pk=None):
         comment = self.get_object()
-        if request.user in comment.likes.all():
-            comment.likes.remove(request.user)
-            return Response({"status": "unliked"})
-        else:
-            comment.likes.add(request.user)
-            return Response({"status": "liked"})
+        replies = comment_list_queryset(Comment.objects.filter(parent=comment))
+        page = self.paginate_queryset(replies)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post'])
     def reply(self, request, pk=None):
@@ -326,7 +422,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     def update(self, request, *args, **kwargs):
         message = self.get_object()
         # Only allow sender to edit their own messages
-        if message.sender != request.user:
+        if message.sender_id != request.user.id:
             return Response(
                 {"error": "You can only edit your own messages"},
                 status=status.HTTP_403_FORBIDDEN
@@ -336,7 +432,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     def partial_update(self, request, *args, **kwargs):
         message = self.get_object()
         # Only allow sender to edit their own messages
-        if message.sender != request.user:
+        if message.sender_id != request.user.id:
             return Response(
                 {"error": "You can only edit your own messages"},
                 status=status.HTTP_403_FORBIDDEN
@@ -346,35 +442,27 @@ class MessageViewSet(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         message = self.get_object()
         # Only allow sender to delete their own messages
-        if message.sender != request.user:
+        if message.sender_id != request.user.id:
             return Response(
                 {"error": "You can only delete your own messages"},
                 status=status.HTTP_403_FORBIDDEN
             )
         return super().destroy(request, *args, **kwargs)
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], pagination_class=ConversationPagination)
     def conversations(self, request):
-        user = request.user
-        # Get all users this user has messaged with
-        messages = Message.objects.filter(Q(sender=user) | Q(receiver=user))
-        # Find the latest message for each conversation
-        convo_map = {}
-        for msg in messages:
-            other_user = msg.receiver if msg.sender == user else msg.sender
-            if other_user.id not in convo_map or msg.created_at > convo_map[other_user.id].created_at:
-                convo_map[other_user.id] = msg
-        # Build response
-        result = []
-        for other_user_id, last_msg in convo_map.items():
-            other_user = last_msg.receiver if last_msg.sender == user else last_msg.sender
-            result.append({
-                'user': UserSerializer(other_user).data,
-                'last_message': MessageSerializer(last_msg).data
-            })
-        return Response(result)
-
-    @action(detail=False, methods=['get'], url_path='with/(?P<user_id>[^/.]+)')
+        inbox = Conversation.objects.filter(
+            owner_id=request.user.id, last_message__isnull=False
+        ).select_related(
+            'other__profile', 'last_message__sender', 'last_message__receiver'
+        )
+        page = self.paginate_queryset(inbox)
+        serializer = ConversationSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], url_path='with/(?P<user_id>[^/.]+)',
+            pagination_class=KeysetPagination)
+    @conditional.conditional(conditional.thread)
     def with_user(self, request, user_id=None):
         user = request.user
         try:
@@ -383,8 +471,8 @@ class MessageViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'User not found.'}, status=404)
         
         messages = Message.objects.filter(
-            (Q(sender=user) & Q(receiver=other_user)) |
-            (Q(sender=other_user) & Q(receiver=user))
+            (Q(sender_id=user.id) & Q(receiver=other_user)) |
+            (Q(sender=other_user) & Q(receiver_id=user.id))
         ).order_by('-created_at')  # Descending order for newest first
         
         # Apply pagination
@@ -398,22 +486,94 @@ class MessageViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def unread_count(self, request):
-        count = Message.objects.filter(receiver=request.user, is_read=False).count()
-        return Response({"unread_count": count})
+        return Response({"unread_count": conversations.unread_total(request.user.id)})
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        changed = conversations.mark_read(
+            request.user,
+            ids=params.get('ids'),
+            sender_id=params.get('user_id'),
+            up_to_id=params.get('up_to_id'),
+            before=params.get('before'),
+        )
+        if changed:
+            notifications.messages_read(request.user.id, changed)
+        return Response({
+            "marked": len(changed),
+            "unread_count": conversations.unread_total(request.user.id),
+        })
 
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
         message = self.get_object()
-        if message.receiver == request.user:
+        if message.receiver_id == request.user.id:
             message.is_read = True
-            message.save()
+            message.save(update_fields=['is_read'])
             return Response({"status": "marked as read"})
         return Response(
             {"error": "You can only mark messages sent to you as read"},
             status=status.HTTP_403_FORBIDDEN
         )
 
+class SearchView(ReplicaReadMixin, APIView):
+    """
+    Ranked prefix search over users, posts or comments: /search/?q=...&type=posts
+    """
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = SearchResultsPagination
+    replica_actions = ('get',)
+
+    def get(self, request):
+        kind = request.query_params.get('type', SearchTerm.USER).rstrip('s')
+        if kind not in dict(SearchTerm.KIND_CHOICES):
+            return Response(
+                {"detail": "type must be one of: users, posts, comments."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        paginator = self.pagination_class()
+        hits = paginator.paginate_queryset(
+            search.matches(kind, request.query_params.get('q', '')), request, view=self
+        )
+        ids = [hit['object_id'] for hit in hits]
+        context = {'request': request}
+        if kind == SearchTerm.USER:
+            objects = User.objects.select_related('profile').in_bulk(ids)
+            serializer_class = UserSerializer
+        elif kind == SearchTerm.POST:
+            objects = post_list_queryset(request.user).in_bulk(ids)
+            serializer_class = PostSerializer
+        else:
+            objects = comment_list_queryset().in_bulk(ids)
+            serializer_class = CommentSerializer
+
+        # Keep the ranking order; skip hits whose object vanished meanwhile
+        ranked = [objects[pk] for pk in ids if pk in objects]
+        serializer = serializer_class(ranked, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
+
+class CacheStatsView(APIView):
+    """
+    Fragment cache hit/miss counters of the serving process
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'backend': cache.store().__class__.__name__,
+            'kinds': cache.stats(),
+        })
+
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        # Claims read by authentication.ClaimsJWTAuthentication
+        return authentication.add_claims(super().get_token(user), user)
+
     def validate(self, attrs):  
         data = super().validate(attrs)
         data['user'] = UserSerializer(self.user).data
@@ -421,3 +581,26 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
+    throttle_scope = 'auth'
+
+class CustomTokenRefreshView(TokenRefreshView):
+    serializer_class = authentication.ClaimsTokenRefreshSerializer
+
+class RevokeTokensView(APIView):
+    """
+    Sign out everywhere: every access and refresh token issued to the user
+    so far stops working
+    """
+    def post(self, request):
+        authentication.revoke_tokens(request.user.id)
+        return Response({'status': 'tokens revoked'})
+
+
+class MetricsView(APIView):
+    """
+    Request histograms of this process in the Prometheus text format
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
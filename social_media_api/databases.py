@@ -0,0 +1,102 @@
+"""
+DATABASES built from environment variables.
+
+    DB_ENGINE                sqlite (default) or mssql
+    DB_NAME                  database name, or the SQLite file path
+    DB_USER / DB_PASSWORD / DB_HOST / DB_PORT   SQL Server credentials
+    DB_DRIVER                ODBC driver name (mssql)
+    DB_EXTRA_PARAMS          extra ODBC connection string parameters (mssql)
+    DB_POOLING               ODBC driver manager connection pooling, on by default (mssql)
+    DB_CONN_MAX_AGE          seconds a connection is reused across requests
+    DB_CONN_HEALTH_CHECKS    check reused connections before each request
+    DB_REPLICAS              comma-separated replica SQLite files (sqlite)
+                             or replica hosts (mssql), used for reads
+    DB_SQLITE_TUNED          WAL/pragmas/BEGIN IMMEDIATE backend, on by default (sqlite)
+    DB_SQLITE_BUSY_TIMEOUT   milliseconds to wait for the write lock (sqlite)
+    DB_SQLITE_SERIALIZE_WRITES  queue this process's write transactions (sqlite)
+"""
+import os
+
+REPLICA_PREFIX = 'replica_'
+
+
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def env_list(name):
+    return [item.strip() for item in os.environ.get(name, '').split(',') if item.strip()]
+
+
+def sqlite_primary(base_dir):
+    config = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DB_NAME') or base_dir / 'db.sqlite3',
+        'CONN_MAX_AGE': env_int('DB_CONN_MAX_AGE', 0),
+    }
+    if env_bool('DB_SQLITE_TUNED', True):
+        config['ENGINE'] = 'social_media_api.sqlite'
+        config['OPTIONS'] = {
+            'pragmas': {'busy_timeout': env_int('DB_SQLITE_BUSY_TIMEOUT', 20000)},
+            'serialize_writes': env_bool('DB_SQLITE_SERIALIZE_WRITES', False),
+        }
+    return config
+
+
+def mssql_primary():
+    return {
+        'ENGINE': 'mssql',
+        'NAME': os.environ.get('DB_NAME', 'social_media'),
+        'USER': os.environ.get('DB_USER', ''),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', ''),
+        'CONN_MAX_AGE': env_int('DB_CONN_MAX_AGE', 60),
+        'OPTIONS': {
+            'driver': os.environ.get('DB_DRIVER', 'ODBC Driver 18 for SQL Server'),
+            'extra_params': os.environ.get('DB_EXTRA_PARAMS', 'TrustServerCertificate=yes'),
+        },
+    }
+
+
+def configure_pooling():
+    """
+    Django 5.0 has no built-in pool for SQL Server; pyodbc hands connections
+    back to the ODBC driver manager's pool instead. Must run before the first
+    connection is opened.
+    """
+    import pyodbc
+    pyodbc.pooling = env_bool('DB_POOLING', True)
+
+
+def from_env(base_dir):
+    """
+    Return ``(DATABASES, DATABASE_REPLICAS)``
+    """
+    engine = os.environ.get('DB_ENGINE', 'sqlite').lower()
+    if engine == 'mssql':
+        configure_pooling()
+        primary = mssql_primary()
+    elif engine == 'sqlite':
+        primary = sqlite_primary(base_dir)
+    else:
+        raise ValueError(f'Unsupported DB_ENGINE {engine!r}; use sqlite or mssql')
+    primary['CONN_HEALTH_CHECKS'] = env_bool('DB_CONN_HEALTH_CHECKS', primary['CONN_MAX_AGE'] != 0)
+
+    databases = {'default': primary}
+    for i, location in enumerate(env_list('DB_REPLICAS'), start=1):
+        replica = dict(primary, TEST={'MIRROR': 'default'})
+        if engine == 'mssql':
+            replica['HOST'] = location
+        else:
+            replica['NAME'] = location
+        databases[f'{REPLICA_PREFIX}{i}'] = replica
+    return databases, [alias for alias in databases if alias != 'default']
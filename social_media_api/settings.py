@@ -14,25 +14,37 @@ from pathlib import Path
 import os
 from datetime import timedelta
 
+from dotenv import load_dotenv
+
+from . import databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Settings below can be overridden with environment variables or a .env file
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-tsu(obp)$e)2r69n$2)b^*yarfm#fq^g_gz9v^e81pxc9em)ij'
+SECRET_KEY = os.environ.get(
+    'DJANGO_SECRET_KEY', 'django-insecure-tsu(obp)$e)2r69n$2)b^*yarfm#fq^g_gz9v^e81pxc9em)ij'
+)
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = databases.env_bool('DJANGO_DEBUG', True)
 
-ALLOWED_HOSTS = ['localhost', '192.168.87.1', '192.168.31.1', '127.0.0.1', '192.168.100.96']
+ALLOWED_HOSTS = databases.env_list('DJANGO_ALLOWED_HOSTS') or [
+    'localhost', '192.168.87.1', '192.168.31.1', '127.0.0.1', '192.168.100.96'
+]
 
 
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',  # Serves the ASGI application (HTTP + WebSockets) from runserver
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -41,6 +53,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'corsheaders',
+    'channels',
     'social',
 ]
 
@@ -53,12 +66,16 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'social.middleware.CompressionMiddleware',
+    'social.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'social.middleware.DatabaseRoutingMiddleware',
+    'social.middleware.RateLimitHeadersMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,17 +99,28 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'social_media_api.wsgi.application'
+ASGI_APPLICATION = 'social_media_api.asgi.application'
+
+# Channel layer used to push real-time events to WebSocket clients. The
+# in-memory layer only reaches clients connected to the same process; use
+# 'channels_redis.core.RedisChannelLayer' when running several workers.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
 
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# SQLite by default; see databases.py for the DB_* variables selecting
+# SQL Server, persistent connections and read replicas
+DATABASES, DATABASE_REPLICAS = databases.from_env(BASE_DIR)
+
+DATABASE_ROUTERS = ['social.db_router.PrimaryReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = 5  # Reads stay on the primary this long after a user writes
+DATABASE_PIN_CACHE = 'default'  # Cache remembering recent writers; use a shared one with several workers
 
 
 # Password validation
@@ -139,19 +167,41 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Media files configuration
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Uploads are stored under their content hash (see social/storage.py)
+STORAGES = {
+    'default': {'BACKEND': 'social.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# Internal nginx location aliased to MEDIA_ROOT; when set, /media/ responses
+# carry X-Accel-Redirect and nginx sends the file
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT', '')
 
 # REST Framework settings
 REST_FRAMEWORK = {
+    # Basic authentication is left out: it hashes the password on every request
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'social.authentication.ClaimsJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
+    'PAGE_SIZE': 10,
+    # JSONRenderer output, written by orjson when it is installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'social.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Token buckets per user (per address when anonymous); see social/throttling.py
+    'DEFAULT_THROTTLE_CLASSES': [
+        'social.throttling.TokenBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'read': '600/min',
+        'write': '120/min',  # likes, follows, messages, posts
+        'auth': '10/min',  # login and registration, per address
+    },
 }
 
 # JWT Settings
@@ -165,3 +215,76 @@ SIMPLE_JWT = {
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Only for development
 CORS_ALLOW_CREDENTIALS = True
+
+# Home timeline settings
+TIMELINE_FANOUT_THRESHOLD = 5000  # Followers above which posts are merged at read time
+TIMELINE_BACKFILL_LIMIT = 200  # Posts copied into a timeline on follow
+
+# Comment tree settings
+COMMENT_TREE_MAX_DEPTH = 3  # Comment levels rendered below a post
+COMMENT_TREE_MAX_WIDTH = 10  # Comments rendered per parent at every level
+FEED_COMMENT_PREVIEW = 2  # Top-level comments embedded per post in feed/explore (0 = none)
+
+# Explore ranking settings
+TRENDING_HALF_LIFE_HOURS = 12  # Engagement loses half its weight every this many hours
+TRENDING_MAX_AGE_HOURS = 72  # Older posts stop collecting engagement and leave the pool
+TRENDING_POOL_SIZE = 500  # Candidates kept by refresh_trending and scanned per explore page
+
+# Cache settings
+# 'default' is a per-process LRU cache. With several worker processes, point
+# FRAGMENT_CACHE_ALIAS at 'shared' (or a database/Redis cache) so that
+# invalidations made by one worker are seen by all of them.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'social-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+FRAGMENT_CACHE_ALIAS = 'default'  # Cache holding serialized post/profile fragments
+FRAGMENT_CACHE_TIMEOUT = 300  # Seconds a fragment is kept; bounds staleness for missed invalidations
+
+# Post state settings
+INTERACTION_STATE_CACHE_USERS = 1000  # Users whose liked/reposted/following flags are kept in memory (0 = off)
+INTERACTION_STATE_CACHE_TIMEOUT = 60  # Seconds before a user's cached flags are looked up again
+
+# Image processing settings
+IMAGE_PROCESSING_ASYNC = True  # Resize uploads in a background thread pool; False runs it inside the request
+IMAGE_WORKERS = 2  # Threads of that pool per process
+IMAGE_MAX_DIMENSION = 2048  # Longest side of the stored original
+IMAGE_VARIANT_WIDTHS = (160, 320, 640, 1080)  # Resized copies of post images, on top of the original width
+PROFILE_PICTURE_WIDTHS = (64, 128, 256)  # Resized copies of profile pictures
+IMAGE_QUALITY = 82  # WebP/JPEG encoder quality
+
+# Rate limiting settings
+THROTTLE_CACHE_ALIAS = 'default'  # Cache holding the token buckets; share it between workers in production
+
+# Authentication settings
+AUTH_TOKEN_CACHE_SIZE = 10000  # Validated access tokens kept in memory per process (0 = off)
+AUTH_TOKEN_CACHE_SECONDS = 30  # Seconds a token is trusted without checking its signature again
+AUTH_DENYLIST_REFRESH = 5  # Seconds before revocations made by other processes are picked up
+
+# Serialization settings
+SERIALIZER_COMPILED = True  # Render rows through per-serializer accessor plans (social/compiled.py) instead of DRF's field dispatch
+
+# Metrics settings
+METRICS_ENABLED = True  # Per-endpoint histograms served on /metrics (admin only)
+METRICS_DUPLICATE_QUERY_THRESHOLD = 3  # Runs of one statement shape in a request counted as an N+1 suspect
+METRICS_MAX_FINGERPRINTS = 200  # Distinct (endpoint, statement) pairs kept as labels
+METRICS_PROFILE_SAMPLE_RATE = 0.0  # Fraction of requests run under cProfile (0 = off)
+METRICS_SLOW_REQUEST_MS = 500  # Sampled requests at least this slow keep their profile
+METRICS_PROFILE_DIR = os.path.join(BASE_DIR, '.profiles')  # Where those .prof dumps are written
+
+# Compression settings
+COMPRESSION_ENABLED = True  # gzip/brotli JSON and text responses for clients that accept it
+COMPRESSION_MIN_SIZE = 1024  # Bodies smaller than this are sent as they are
+COMPRESSION_STREAM_SIZE = 262144  # Bodies at least this large are compressed chunk by chunk while sent
+COMPRESSION_STREAMING = True  # Compress streaming responses and large bodies incrementally (False leaves them as they are)
+COMPRESSION_GZIP_LEVEL = 6  # zlib level, 1 (fastest) to 9 (smallest)
+COMPRESSION_BROTLI_QUALITY = 5  # 0-11; used when the optional brotli package is installed
+COMPRESSION_EXCLUDE_PATHS = ('/api/auth/',)  # Token responses are never compressed (BREACH)
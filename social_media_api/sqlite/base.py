@@ -0,0 +1,94 @@
+"""
+SQLite backend tuned for a single server handling concurrent API traffic.
+
+On top of Django's SQLite backend it
+
+* applies the ``pragmas`` option to every new connection: WAL journaling so
+  readers never wait for the writer, ``synchronous=NORMAL`` (safe with WAL),
+  a larger page cache and memory-mapped I/O;
+* starts transactions with ``BEGIN IMMEDIATE``: a write transaction takes the
+  write lock up front and waits ``busy_timeout`` for it, instead of failing
+  with "database is locked" when it first writes after reading;
+* with ``serialize_writes``, queues transactions of this process on a lock
+  per database file, so threads wait their turn in Python rather than
+  polling SQLite's lock.
+
+Django 5.1 added ``init_command`` and ``transaction_mode`` for the first two;
+this backend provides them on 5.0.
+"""
+import threading
+
+from django.db import OperationalError
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,  # milliseconds
+    'cache_size': -64000,  # negative: KiB, i.e. 64 MB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+_writer_locks = {}
+_writer_locks_guard = threading.Lock()
+
+
+def writer_lock(name):
+    with _writer_locks_guard:
+        return _writer_locks.setdefault(str(name), threading.Lock())
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    holds_writer_lock = False
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # Options understood by this backend, not by sqlite3.connect()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('serialize_writes', None)
+        return kwargs
+
+    def pragmas(self):
+        return {**DEFAULT_PRAGMAS, **self.settings_dict['OPTIONS'].get('pragmas', {})}
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas().items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.settings_dict['OPTIONS'].get('serialize_writes') and not self.is_in_memory_db():
+            timeout = self.pragmas()['busy_timeout'] / 1000
+            if not writer_lock(self.settings_dict['NAME']).acquire(timeout=timeout):
+                raise OperationalError('database is locked (timed out waiting for the writer queue)')
+            self.holds_writer_lock = True
+        try:
+            self.cursor().execute('BEGIN IMMEDIATE')
+        except Exception:
+            self.release_writer_lock()
+            raise
+
+    def release_writer_lock(self):
+        if self.holds_writer_lock:
+            self.holds_writer_lock = False
+            writer_lock(self.settings_dict['NAME']).release()
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self.release_writer_lock()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self.release_writer_lock()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self.release_writer_lock()